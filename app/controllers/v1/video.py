@@ -1,10 +1,9 @@
-import glob
 import os
 import pathlib
 import shutil
-from typing import Union
+from typing import Any, Dict, Union
 
-from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
+from fastapi import BackgroundTasks, Body, Depends, Path, Request, UploadFile
 from fastapi.params import File
 from fastapi.responses import FileResponse, StreamingResponse
 from loguru import logger
@@ -14,6 +13,7 @@ from app.controllers import base
 from app.controllers.manager.memory_manager import InMemoryTaskManager
 from app.controllers.manager.redis_manager import RedisTaskManager
 from app.controllers.v1.base import new_router
+from app.models import const
 from app.models.exception import HttpException
 from app.models.schema import (
     AudioRequest,
@@ -27,6 +27,7 @@ from app.models.schema import (
     TaskVideoRequest,
 )
 from app.services import state as sm
+from app.services.bgm_catalog import bgm_catalog
 from app.services import task as tm
 from app.utils import utils
 
@@ -58,6 +59,17 @@ def create_video(
     return create_task(request, body, stop_at="video")
 
 
+@router.post(
+    "/videos/plan",
+    response_model=TaskResponse,
+    summary="Plan a short video and save its timeline without rendering it",
+)
+def create_video_plan(
+    background_tasks: BackgroundTasks, request: Request, body: TaskVideoRequest
+):
+    return create_task(request, body, stop_at="plan")
+
+
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
 def create_subtitle(
     background_tasks: BackgroundTasks, request: Request, body: SubtitleRequest
@@ -156,6 +168,48 @@ def get_task(
     )
 
 
+@router.post(
+    "/tasks/{task_id}/rerender",
+    response_model=TaskResponse,
+    summary="Render a task again with some of its params changed",
+)
+def rerender_task(
+    request: Request,
+    task_id: str = Path(..., description="Task ID"),
+    changes: Dict[str, Any] = Body(default={}, description="The params to change"),
+):
+    # the script, audio, materials and footage of the task are reused where the
+    # changes don't affect them, see task.start
+    request_id = base.get_task_id(request)
+    task = sm.state.get_task(task_id)
+    if task and task.get("state") == const.TASK_STATE_PROCESSING:
+        raise HttpException(
+            task_id=task_id,
+            status_code=409,
+            message=f"{request_id}: task is still processing",
+        )
+    try:
+        params = tm.load_params(task_id, changes)
+    except FileNotFoundError:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+    except ValueError as e:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: {str(e)}"
+        )
+
+    task = {
+        "task_id": task_id,
+        "request_id": request_id,
+        "params": params.model_dump(),
+    }
+    sm.state.update_task(task_id)
+    task_manager.add_task(tm.start, task_id=task_id, params=params, stop_at="video")
+    logger.success(f"Task rerendering: {utils.to_json(task)}")
+    return utils.get_response(200, task)
+
+
 @router.delete(
     "/tasks/{task_id}",
     response_model=TaskDeletionResponse,
@@ -183,16 +237,15 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     "/musics", response_model=BgmRetrieveResponse, summary="Retrieve local BGM files"
 )
 def get_bgm_list(request: Request):
-    suffix = "*.mp3"
-    song_dir = utils.song_dir()
-    files = glob.glob(os.path.join(song_dir, suffix))
     bgm_list = []
-    for file in files:
+    for song in bgm_catalog.songs():
         bgm_list.append(
             {
-                "name": os.path.basename(file),
-                "size": os.path.getsize(file),
-                "file": file,
+                "name": song["name"],
+                "size": song["size"],
+                "file": song["file"],
+                "duration": song["duration"],
+                "sample_rate": song["sample_rate"],
             }
         )
     response = {"files": bgm_list}
@@ -215,6 +268,7 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
             # If the file already exists, it will be overwritten
             file.file.seek(0)
             buffer.write(file.file.read())
+        bgm_catalog.add(save_path)
         response = {"file": save_path}
         return utils.get_response(200, response)
 
@@ -25,6 +25,7 @@ class VideoTransitionMode(str, Enum):
     fade_out = "FadeOut"
     slide_in = "SlideIn"
     slide_out = "SlideOut"
+    crossfade = "Crossfade"
 
 
 class VideoAspect(str, Enum):
@@ -53,6 +54,12 @@ class MaterialInfo:
     duration: int = 0
 
 
+class LanguageTrack(BaseModel):
+    language: str  # e.g. "es" or "es-ES"
+    voice_name: str
+    video_script: Optional[str] = ""  # generated in `language` when empty
+
+
 class VideoParams(BaseModel):
     """
     {
@@ -76,6 +83,8 @@ class VideoParams(BaseModel):
     video_transition_mode: Optional[VideoTransitionMode] = None
     video_clip_duration: Optional[int] = 5
     video_count: Optional[int] = 1
+    # also write combined-N.mp4 (the clips without audio or subtitles), this costs an extra encode
+    combined_video_enabled: Optional[bool] = False
 
     video_source: Optional[str] = "pexels"
     video_materials: Optional[List[MaterialInfo]] = (
@@ -92,6 +101,11 @@ class VideoParams(BaseModel):
     bgm_volume: Optional[float] = 0.2
 
     subtitle_enabled: Optional[bool] = True
+    # burn: draw the subtitles on the frames, soft: mux them as mov_text tracks,
+    # webvtt: mov_text tracks plus a .vtt file per language next to the video
+    subtitle_mode: Optional[str] = "burn"
+    # extra languages, each one adds an audio and a subtitle track to the same video
+    languages: Optional[List[LanguageTrack]] = None
     subtitle_position: Optional[str] = "bottom"  # top, bottom, center
     custom_position: float = 70.0
     font_name: Optional[str] = "STHeitiMedium.ttc"
@@ -103,6 +117,56 @@ class VideoParams(BaseModel):
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
     paragraph_number: Optional[int] = 1
+    # moviepy or ffmpeg, empty for app.render_backend
+    render_backend: Optional[str] = ""
+    # seeds the clip order, transitions and bgm, picked and saved in timeline.json when empty
+    seed: Optional[int] = None
+
+
+class TimelineClip(BaseModel):
+    # a section of a source video, scaled to fit_width x fit_height and letterboxed
+    file_path: str
+    start_time: float
+    duration: float
+    width: int = 0  # of the source
+    height: int = 0
+    fit_width: int = 0
+    fit_height: int = 0
+    transition: str = ""
+    side: str = "left"
+
+
+class TimelineSubtitle(BaseModel):
+    start: float
+    end: float
+    text: str
+
+
+class TimelineAudio(BaseModel):
+    voice_file: str
+    duration: float = 0  # of the voice, the clips cover it
+    voice_volume: float = 1.0
+    bgm_file: str = ""
+    bgm_volume: float = 0.2
+
+
+class Timeline(BaseModel):
+    """
+    the edit decision list of one video: every clip in playing order, loops included,
+    the subtitle events and the audio layers. planned from probed metadata, the
+    renderers only carry it out
+    """
+
+    seed: int
+    width: int
+    height: int
+    fps: int
+    duration: float = 0
+    crossfade: float = 0
+    clips: List[TimelineClip] = []
+    subtitle_path: str = ""
+    subtitles: List[TimelineSubtitle] = []
+    audio: TimelineAudio
 
 
 class SubtitleRequest(BaseModel):
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.services.segment_cache import evict_lru
+from app.services.utils import ffmpeg
+from app.utils import utils
+
+sample_rate = 44100
+channels = 2
+# samples mixed per step, keeps the working set small for long tracks
+_chunk_size = sample_rate * 10
+# decoded bgm, shared by all tasks
+pcm_cache_dir = utils.storage_dir("cache_pcm")
+
+
+def get_pcm_file(file_path: str) -> str:
+    """
+    location of the decoded PCM of file_path in the shared cache, the name changes
+    whenever the source file does
+    """
+    st = os.stat(file_path)
+    parts = [os.path.abspath(file_path), str(st.st_size), str(st.st_mtime_ns), str(sample_rate), str(channels)]
+    key = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+    os.makedirs(pcm_cache_dir, exist_ok=True)
+    return os.path.join(pcm_cache_dir, f"{key}.f32")
+
+
+def get_pcm_cache_size() -> int:
+    return int(config.app.get("pcm_cache_max_size_mb", 1024)) * 1024 * 1024
+
+
+def decode_pcm(file_path: str, pcm_file: str = "") -> np.ndarray:
+    """
+    decodes file_path once into float32 stereo PCM on disk and returns it memory-mapped,
+    as an array of shape (samples, channels). without pcm_file the PCM is kept in the
+    shared cache, where the least recently used files are evicted once it grows past
+    app.pcm_cache_max_size_mb
+    """
+    cached = not pcm_file
+    pcm_file = pcm_file or get_pcm_file(file_path)
+    decoded = False
+    if cached and os.path.exists(pcm_file):
+        # bump the mtime, it is the recency used for eviction
+        os.utime(pcm_file)
+    elif not os.path.exists(pcm_file):
+        temp_file = f"{pcm_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        ok = ffmpeg.run(
+            [
+                "-i", file_path,
+                "-vn",
+                "-f", "f32le",
+                "-acodec", "pcm_f32le",
+                "-ar", str(sample_rate),
+                "-ac", str(channels),
+                temp_file,
+            ]
+        )
+        if not ok:
+            try:
+                os.remove(temp_file)
+            except Exception:
+                pass
+            raise ValueError(f"failed to decode audio: {file_path}")
+        os.replace(temp_file, pcm_file)
+        decoded = True
+
+    if os.path.getsize(pcm_file) == 0:
+        pcm = np.zeros((0, channels), dtype=np.float32)
+    else:
+        pcm = np.memmap(pcm_file, dtype=np.float32, mode="r").reshape(-1, channels)
+    if cached and decoded:
+        evict_lru(os.path.dirname(pcm_file), get_pcm_cache_size(), ".f32")
+    return pcm
+
+
+def _add_scaled(out: np.ndarray, pcm: np.ndarray, start: int, gain):
+    """
+    out[start:start + len(pcm)] += pcm * gain, in chunks
+    """
+    for offset in range(0, len(pcm), _chunk_size):
+        chunk = pcm[offset:offset + _chunk_size] * gain
+        out[start + offset:start + offset + len(chunk)] += chunk
+
+
+def mix_track(
+    out: np.ndarray,
+    voice: np.ndarray,
+    bgm: np.ndarray = None,
+    voice_volume: float = 1.0,
+    bgm_volume: float = 0.2,
+    bgm_fade_out: float = 3,
+):
+    """
+    mixes the voice and the looped bgm into out, an array of shape (samples, channels).
+    the bgm fades out at the end of every loop, like AudioFadeOut before AudioLoop.
+    """
+    out[:] = 0
+    _add_scaled(out, voice[:len(out)], 0, voice_volume)
+
+    if bgm is not None and len(bgm):
+        fade = min(len(bgm), int(bgm_fade_out * sample_rate))
+        body = bgm[:len(bgm) - fade]
+        # the faded tail is the same for every loop, compute it once
+        ramp = (fade - np.arange(fade, dtype=np.float32)) / max(fade, 1)
+        tail = bgm[len(bgm) - fade:] * (ramp[:, None] * bgm_volume)
+        for start in range(0, len(out), len(bgm)):
+            remaining = len(out) - start
+            _add_scaled(out, body[:remaining], start, bgm_volume)
+            if remaining > len(body):
+                tail_start = start + len(body)
+                out[tail_start:tail_start + len(tail)] += tail[:remaining - len(body)]
+
+    for offset in range(0, len(out), _chunk_size):
+        chunk = out[offset:offset + _chunk_size]
+        np.clip(chunk, -1, 1, out=chunk)
+
+
+def render_audio_track(
+    voice_file: str,
+    output_file: str,
+    duration: float,
+    bgm_file: str = "",
+    voice_volume: float = 1.0,
+    bgm_volume: float = 0.2,
+    audio_codec: str = "aac",
+) -> str:
+    """
+    decodes the voice and bgm once, mixes them with numpy and encodes the result to
+    output_file, ready to be muxed into every video of a task
+    """
+    # the voice is decoded next to the output and removed afterwards. a file left there by
+    # an interrupted run may be from another voice, so it is never reused
+    voice_pcm_file = f"{output_file}.voice.f32"
+    if os.path.exists(voice_pcm_file):
+        os.remove(voice_pcm_file)
+    voice = decode_pcm(voice_file, pcm_file=voice_pcm_file)
+    bgm = None
+    if bgm_file:
+        try:
+            bgm = decode_pcm(bgm_file)
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+
+    mix_file = f"{output_file}.f32"
+    samples = max(1, int(round(duration * sample_rate)))
+    try:
+        out = np.memmap(mix_file, dtype=np.float32, mode="w+", shape=(samples, channels))
+        mix_track(
+            out,
+            voice=voice,
+            bgm=bgm,
+            voice_volume=voice_volume,
+            bgm_volume=bgm_volume,
+        )
+        out.flush()
+        del out
+
+        ok = ffmpeg.run(
+            [
+                "-f", "f32le",
+                "-ar", str(sample_rate),
+                "-ac", str(channels),
+                "-i", mix_file,
+                "-c:a", audio_codec,
+                "-b:a", "192k",
+                output_file,
+            ]
+        )
+    finally:
+        del voice
+        for temp_file in (mix_file, voice_pcm_file):
+            try:
+                os.remove(temp_file)
+            except Exception:
+                pass
+
+    if not ok:
+        raise ValueError(f"failed to encode audio track: {output_file}")
+    logger.info(f"audio track rendered: {output_file}, duration: {duration:.2f}s")
+    return output_file
@@ -0,0 +1,219 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from app.config import config
+from app.services.media_index import media_index
+from app.services.utils import ffmpeg
+from app.utils import utils
+
+
+class BgmCatalog:
+    """
+    index of the songs in song_dir with their duration, sample rate and loudness.
+    the directory is only rescanned when its mtime changes or refresh_interval has
+    passed, and a song is only analyzed again when its size or mtime changes.
+    the analysis is kept in a sqlite db so it survives restarts.
+    """
+
+    suffix = ".mp3"
+
+    def __init__(self, song_dir: str, db_path: str, refresh_interval: float = 60):
+        self.song_dir = song_dir
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self._songs = {}
+        self._names = []
+        self._dir_mtime_ns = None
+        self._refreshed_at = 0
+        self._lock = threading.RLock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS songs (
+                    file TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    duration REAL,
+                    sample_rate INTEGER,
+                    loudness REAL
+                )
+                """
+            )
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _load(self, conn, file: str, mtime_ns: int, size: int):
+        row = conn.execute(
+            "SELECT duration, sample_rate, loudness FROM songs WHERE file = ? AND mtime_ns = ? AND size = ?",
+            (file, mtime_ns, size),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "name": os.path.basename(file),
+            "size": size,
+            "file": file,
+            "mtime_ns": mtime_ns,
+            "duration": row[0],
+            "sample_rate": row[1],
+            "loudness": row[2],
+        }
+
+    def _save(self, conn, song: dict):
+        conn.execute(
+            "INSERT OR REPLACE INTO songs (file, mtime_ns, size, duration, sample_rate, loudness) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                song["file"],
+                song["mtime_ns"],
+                song["size"],
+                song["duration"],
+                song["sample_rate"],
+                song["loudness"],
+            ),
+        )
+        conn.commit()
+
+    def _analyze(self, file: str, mtime_ns: int, size: int) -> dict:
+        song = {
+            "name": os.path.basename(file),
+            "size": size,
+            "file": file,
+            "mtime_ns": mtime_ns,
+            "duration": 0.0,
+            "sample_rate": 0,
+            "loudness": None,
+        }
+        try:
+            infos = ffmpeg.parse_infos(file)
+            song["duration"] = infos.get("duration") or 0.0
+            song["sample_rate"] = infos.get("audio_fps") or 0
+        except Exception as e:
+            logger.warning(f"failed to probe song: {file} => {str(e)}")
+        logger.debug(f"indexed song: {song}")
+        return song
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            try:
+                dir_mtime_ns = os.stat(self.song_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._songs, self._names = {}, []
+                return
+
+            now = time.time()
+            if (
+                not force
+                and dir_mtime_ns == self._dir_mtime_ns
+                and now - self._refreshed_at < self.refresh_interval
+            ):
+                return
+
+            songs = {}
+            conn = None
+            try:
+                conn = self._connect()
+                with os.scandir(self.song_dir) as it:
+                    for entry in it:
+                        if not entry.name.endswith(self.suffix) or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                        file = entry.path
+                        song = self._songs.get(file)
+                        if song and song["mtime_ns"] == st.st_mtime_ns and song["size"] == st.st_size:
+                            songs[file] = song
+                            continue
+                        song = self._load(conn, file, st.st_mtime_ns, st.st_size)
+                        if song is None:
+                            song = self._analyze(file, st.st_mtime_ns, st.st_size)
+                            self._save(conn, song)
+                        songs[file] = song
+            except Exception as e:
+                logger.error(f"failed to refresh bgm catalog: {str(e)}")
+                return
+            finally:
+                if conn:
+                    conn.close()
+
+            self._songs = songs
+            self._names = sorted(songs)
+            self._dir_mtime_ns = dir_mtime_ns
+            self._refreshed_at = now
+
+    def add(self, file: str):
+        """
+        indexes a song that was just written, e.g. by an upload
+        """
+        with self._lock:
+            # force the next lookup to rescan, an overwritten file keeps the directory mtime
+            self._dir_mtime_ns = None
+            self.refresh()
+            return self._songs.get(os.path.join(self.song_dir, os.path.basename(file)))
+
+    def songs(self) -> list:
+        self.refresh()
+        with self._lock:
+            return [self._songs[name] for name in self._names]
+
+    def random_song(self, rng: random.Random = None) -> str:
+        self.refresh()
+        with self._lock:
+            if not self._names:
+                return ""
+            return (rng or random).choice(self._names)
+
+    def get_duration(self, file: str) -> float:
+        """
+        duration of a catalog song, a custom bgm outside song_dir is looked up in the media index
+        """
+        self.refresh()
+        with self._lock:
+            song = self._songs.get(os.path.abspath(file))
+        if song and song["duration"]:
+            return song["duration"]
+        return media_index.probe(file).duration
+
+    def get_loudness(self, file: str):
+        """
+        integrated loudness of a catalog song in LUFS, measured once and then kept in the index
+        """
+        self.refresh()
+        with self._lock:
+            song = self._songs.get(os.path.abspath(file))
+            if song is None:
+                return None
+            if song["loudness"] is not None:
+                return song["loudness"]
+
+        loudness = ffmpeg.measure_loudness(file)
+        if loudness is None:
+            return None
+        with self._lock:
+            song["loudness"] = loudness
+            try:
+                conn = self._connect()
+                try:
+                    self._save(conn, song)
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.warning(f"failed to update bgm catalog: {str(e)}")
+        return loudness
+
+
+bgm_catalog = BgmCatalog(
+    song_dir=utils.song_dir(),
+    db_path=config.app.get("bgm_catalog_path", "")
+    or os.path.join(utils.storage_dir(create=True), "bgm_catalog.db"),
+    refresh_interval=config.app.get("bgm_catalog_refresh_interval", 60),
+)
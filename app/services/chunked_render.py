@@ -0,0 +1,177 @@
+from typing import List
+
+import numpy as np
+from loguru import logger
+from moviepy import VideoFileClip
+
+from app.config import config
+from app.models.schema import VideoParams
+from app.services import pipelined_render, video
+from app.services.planner import fps
+from app.services.text_raster_cache import text_raster_cache
+from app.services.utils import ffmpeg
+
+
+def get_render_pool():
+    """
+    returns the process pool shared by all tasks for rendering the time chunks of a
+    final video, or None when app.render_workers is not greater than 1
+    """
+    return video.get_process_pool("render", get_render_workers())
+
+
+def get_render_workers():
+    return int(config.app.get("render_workers", 1) or 1)
+
+
+def get_chunk_gop() -> int:
+    return int(config.app.get("render_chunk_gop", fps * 2))
+
+
+def get_chunk_ranges(duration: float, chunks: int, gop: int) -> List[tuple]:
+    """
+    splits the frames of a timeline into at most `chunks` ranges [start, end) of whole
+    GOPs, so every chunk starts on the keyframe a single encode would put there too
+    """
+    min_frames = int(config.app.get("render_chunk_min_duration", 10) * fps)
+    frames = int(duration * fps)
+    chunk_frames = max(frames / chunks, min_frames)
+    chunk_frames = max(1, int(np.ceil(chunk_frames / gop))) * gop
+    return [(start, min(start + chunk_frames, frames)) for start in range(0, frames, chunk_frames)]
+
+
+def open_timeline(video_path: str):
+    video_clip = VideoFileClip(video_path).without_audio()
+    return video_clip, [video_clip]
+
+
+def render_video_chunk(
+        build_timeline_fn,
+        timeline_args: dict,
+        subtitle_path: str,
+        params: VideoParams,
+        audio_track: str,
+        start_frame: int,
+        end_frame: int,
+        last: bool,
+        gop: int,
+        output_file: str,
+) -> str:
+    """
+    builds the timeline, composites the subtitles and encodes the frames in
+    [start_frame, end_frame) to output_file, without audio
+    """
+    video_clip, source_clips = build_timeline_fn(**timeline_args)
+    try:
+        if video_clip is None:
+            raise ValueError("no clips available for rendering")
+        last_frame = int(video_clip.duration * fps) if last else end_frame
+        if pipelined_render.pipeline_enabled():
+            if pipelined_render.encode_frames(
+                output_file,
+                params,
+                overlay=video.get_subtitle_overlay(subtitle_path, params),
+                video_clip=video_clip,
+                start_frame=start_frame,
+                frames=last_frame - start_frame,
+                ffmpeg_params=["-g", str(gop)],
+            ):
+                return output_file
+            # the readers were used by the forked source stage, start over with fresh ones
+            for source_clip in source_clips:
+                video.close_clip(source_clip)
+            source_clips = []
+            video_clip, source_clips = build_timeline_fn(**timeline_args)
+
+        # the audio track is muxed once the chunks are joined
+        video_clip = video.compose_video(
+            video_clip=video_clip,
+            audio_path="",
+            subtitle_path=subtitle_path,
+            params=params,
+            audio_track=audio_track,
+        )
+        # moviepy writes int(duration * fps) frames, the half frame keeps float errors
+        # from dropping the last one
+        end_time = None if last else (end_frame + 0.5) / fps
+        chunk_clip = video_clip.subclipped(start_frame / fps, end_time)
+        chunk_clip.write_videofile(
+            output_file,
+            audio=False,
+            threads=params.n_threads or 2,
+            logger=None,
+            fps=fps,
+            ffmpeg_params=["-g", str(gop)],
+        )
+        chunk_clip.close()
+        video_clip.close()
+    finally:
+        for source_clip in source_clips:
+            video.close_clip(source_clip)
+    logger.debug(f"subtitle raster cache stats: {text_raster_cache.stats()}")
+    return output_file
+
+
+def render_chunked(
+        build_timeline_fn,
+        timeline_args: dict,
+        duration: float,
+        audio_path: str,
+        subtitle_path: str,
+        output_file: str,
+        params: VideoParams,
+        audio_track: str = "",
+) -> bool:
+    """
+    renders the timeline that build_timeline_fn(**timeline_args) returns in GOP-aligned
+    time chunks on the render pool, each worker building the timeline itself. the chunks
+    are joined with stream copy and the audio is muxed once. returns False if the video
+    should be rendered in a single pass instead.
+    """
+    pool = get_render_pool()
+    if pool is None:
+        return False
+    gop = get_chunk_gop()
+    ranges = get_chunk_ranges(duration, get_render_workers(), gop)
+    if len(ranges) < 2:
+        return False
+
+    audio_track, temp_track = video.get_audio_track(
+        audio_track, audio_path, params, duration=duration, output_file=output_file
+    )
+    if not audio_track:
+        return False
+
+    logger.info(f"rendering {len(ranges)} chunks in parallel: {output_file}")
+    chunk_files = [f"{output_file}.chunk-{i + 1}.mp4" for i in range(len(ranges))]
+    video_file = f"{output_file}.video.mp4"
+    try:
+        futures = [
+            video.submit_job(
+                pool,
+                render_video_chunk,
+                build_timeline_fn=build_timeline_fn,
+                timeline_args=timeline_args,
+                subtitle_path=subtitle_path,
+                params=params,
+                audio_track=audio_track,
+                start_frame=start_frame,
+                end_frame=end_frame,
+                last=i == len(ranges) - 1,
+                gop=gop,
+                output_file=chunk_files[i],
+            )
+            for i, (start_frame, end_frame) in enumerate(ranges)
+        ]
+        for future in futures:
+            future.result()
+        if not ffmpeg.concat_copy(chunk_files, video_file):
+            raise ValueError(f"failed to join chunks into {video_file}")
+        if not ffmpeg.mux_audio(video_file, audio_track, output_file):
+            raise ValueError(f"failed to mux audio track into {output_file}")
+        return True
+    except Exception as e:
+        logger.error(f"failed to render video in chunks, fallback to a single pass: {str(e)}")
+        return False
+    finally:
+        video.delete_files(chunk_files + [video_file] + ([temp_track] if temp_track else []))
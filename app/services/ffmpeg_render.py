@@ -0,0 +1,305 @@
+import os
+import shutil
+from typing import List
+
+from loguru import logger
+from PIL import Image
+
+from app.models.schema import TimelineClip, VideoTransitionMode
+from app.services.bgm_catalog import bgm_catalog
+from app.services.utils import ffmpeg
+
+# transitions last one second, like the moviepy effects in build_normalized_clip
+transition_duration = 1
+sample_rate = 44100
+bgm_fade_out = 3
+# a file is decoded through the gaps between its clips instead of being opened again,
+# up to this many seconds
+_max_input_gap = 10
+
+# the direction a clip moves in when it slides towards `side`
+_slide_signs = {
+    "left": (-1, 0),
+    "right": (1, 0),
+    "top": (0, -1),
+    "bottom": (0, 1),
+}
+
+
+class Graph:
+    """
+    collects the inputs and filter chains of a single ffmpeg command
+    """
+
+    def __init__(self):
+        self.inputs = []
+        self.filters = []
+        self._labels = 0
+
+    def add_input(self, *args) -> int:
+        self.inputs.append(list(args))
+        return len(self.inputs) - 1
+
+    def label(self, prefix: str) -> str:
+        self._labels += 1
+        return f"{prefix}{self._labels}"
+
+    def add(self, inputs: List[str], chain: str, prefix: str = "v") -> str:
+        output = self.label(prefix)
+        self.filters.append("".join(f"[{i}]" for i in inputs) + chain + f"[{output}]")
+        return output
+
+
+def _fit_filters(clip: TimelineClip, width: int, height: int, fps: float) -> str:
+    # every clip of a file has the same fit size
+    x = (width - clip.fit_width) // 2
+    y = (height - clip.fit_height) // 2
+    return ",".join(
+        [
+            f"scale={clip.fit_width}:{clip.fit_height}:flags=bicubic",
+            f"pad={width}:{height}:{x}:{y}:black",
+            "setsar=1",
+            f"fps={fps}",
+            "format=yuv420p",
+        ]
+    )
+
+
+def _clip_filters(clip: TimelineClip, offset: float, width: int, height: int, fps: float) -> str:
+    filters = [
+        f"trim=start={offset:.6f}:duration={clip.duration:.6f}",
+        "setpts=PTS-STARTPTS",
+    ]
+    if clip.transition == VideoTransitionMode.fade_in.value:
+        filters.append(f"fade=t=in:st=0:d={transition_duration}")
+    elif clip.transition == VideoTransitionMode.fade_out.value:
+        start = max(0.0, clip.duration - transition_duration)
+        filters.append(f"fade=t=out:st={start:.6f}:d={transition_duration}")
+    elif clip.transition in (VideoTransitionMode.slide_in.value, VideoTransitionMode.slide_out.value):
+        filters.append(_slide_filters(clip, width, height, fps))
+    return ",".join(filters)
+
+
+def _slide_filters(clip: TimelineClip, width: int, height: int, fps: float) -> str:
+    """
+    shifts the frame by the same whole-pixel offsets as video_effects.slide_ramp: the
+    frame is padded with black on the side it moves away from and a full-size window
+    is cropped out of it. rgb24 keeps odd offsets exact
+    """
+    sign_x, sign_y = _slide_signs[clip.side]
+    frames = max(1, round(transition_duration * fps))
+    if clip.transition == VideoTransitionMode.slide_in.value:
+        # from a full frame away to 0 over the first frames
+        step = "n"
+        progress = f"(1-{step}/{transition_duration * fps})"
+    else:
+        # from 0 to a full frame away over the last frames
+        step = f"(n-{round(clip.duration * fps - frames)})"
+        progress = f"min(1,{step}/{transition_duration * fps})"
+
+    def offset(distance: int) -> str:
+        return f"if(between({step},0,{frames - 1}),round({progress}*{distance}),0)"
+
+    if sign_x:
+        pad_x = width if sign_x > 0 else 0
+        pad = f"pad={width * 2}:{height}:{pad_x}:0:black"
+        crop = f"crop={width}:{height}:'{pad_x}-({sign_x})*{offset(width)}':0:exact=1"
+    else:
+        pad_y = height if sign_y > 0 else 0
+        pad = f"pad={width}:{height * 2}:0:{pad_y}:black"
+        crop = f"crop={width}:{height}:0:'{pad_y}-({sign_y})*{offset(height)}':exact=1"
+    return f"format=rgb24,{pad},{crop},format=yuv420p"
+
+
+def _group_inputs(clips: List[TimelineClip]) -> List[List[int]]:
+    """
+    groups the clips that can share one decoder: clips of the same file whose windows
+    come in order in the timeline. a window that starts before the previous one ended,
+    e.g. a looped clip, would have to be buffered until its turn, so it gets its own input
+    """
+    groups = []
+    open_groups = {}
+    for i, clip in enumerate(clips):
+        group = None
+        for candidate in open_groups.get(clip.file_path, []):
+            last = clips[candidate[-1]]
+            gap = clip.start_time - (last.start_time + last.duration)
+            if 0 <= gap <= _max_input_gap:
+                group = candidate
+                break
+        if group is None:
+            group = []
+            groups.append(group)
+            open_groups.setdefault(clip.file_path, []).append(group)
+        group.append(i)
+    return groups
+
+
+def add_timeline(graph: Graph, clips: List[TimelineClip], width: int, height: int, fps: float, crossfade: float = 0) -> str:
+    """
+    decodes each file once per run of in-order clips, splits the scaled and letterboxed
+    frames into one trimmed branch per clip with its transition, and joins the clips with
+    concat, or with xfade when crossfade is set. returns the label of the video
+    """
+    labels = [None] * len(clips)
+    for group in _group_inputs(clips):
+        first, last = clips[group[0]], clips[group[-1]]
+        input_start = first.start_time
+        index = graph.add_input(
+            "-ss", f"{input_start:.6f}",
+            "-t", f"{last.start_time + last.duration - input_start:.6f}",
+            "-i", first.file_path,
+        )
+        source = graph.add([f"{index}:v:0"], _fit_filters(first, width, height, fps))
+        branches = [source]
+        if len(group) > 1:
+            branches = [graph.label("v") for _ in group]
+            graph.filters.append(f"[{source}]split={len(group)}" + "".join(f"[{b}]" for b in branches))
+        for i, branch in zip(group, branches):
+            clip = clips[i]
+            label = graph.add([branch], _clip_filters(clip, clip.start_time - input_start, width, height, fps))
+            labels[i] = graph.add([label], f"settb=AVTB,fps={fps}")
+
+    if not crossfade or len(labels) == 1:
+        return graph.add(labels, f"concat=n={len(labels)}:v=1:a=0")
+
+    # a clip can't overlap more than it lasts
+    crossfade = min([crossfade] + [clip.duration for clip in clips])
+    video = labels[0]
+    offset = 0.0
+    for clip, label in zip(clips, labels[1:]):
+        offset += clip.duration - crossfade
+        video = graph.add(
+            [video, label],
+            f"xfade=transition=fade:duration={crossfade:.6f}:offset={offset:.6f}",
+        )
+    return video
+
+
+def write_subtitle_track(overlay, duration: float, work_dir: str) -> str:
+    """
+    writes the subtitle overlay as transparent full-frame images and an ffconcat list
+    that shows each one for as long as its lines are on screen
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    blank_file = os.path.join(work_dir, "blank.png")
+    Image.new("RGBA", (overlay.video_width, overlay.video_height), (0, 0, 0, 0)).save(blank_file)
+
+    lines = ["ffconcat version 1.0"]
+    for index, (start, end, rgba) in enumerate(overlay.segments(duration)):
+        image_file = blank_file
+        if rgba is not None:
+            image_file = os.path.join(work_dir, f"subtitle-{index:05d}.png")
+            Image.fromarray(rgba, "RGBA").save(image_file, compress_level=1)
+        lines.append(f"file '{_quote(image_file)}'")
+        lines.append(f"duration {end - start:.6f}")
+    # the last file is listed again, otherwise its duration is ignored
+    lines.append(f"file '{_quote(blank_file)}'")
+
+    list_file = os.path.join(work_dir, "subtitles.ffconcat")
+    with open(list_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return list_file
+
+
+def _quote(file_path: str) -> str:
+    return os.path.abspath(file_path).replace("\\", "/").replace("'", r"'\''")
+
+
+def add_subtitles(graph: Graph, video: str, subtitle_list: str) -> str:
+    index = graph.add_input("-f", "concat", "-safe", "0", "-i", subtitle_list)
+    return graph.add([video, f"{index}:v:0"], "overlay=0:0:format=auto:eof_action=pass,format=yuv420p")
+
+
+def add_audio_mix(
+    graph: Graph,
+    duration: float,
+    voice_file: str,
+    voice_volume: float = 1.0,
+    bgm_file: str = "",
+    bgm_volume: float = 0.2,
+) -> str:
+    """
+    the voice and the bgm faded out at the end of every loop, like AudioFadeOut before
+    AudioLoop, mixed and cut to duration. returns the label of the audio
+    """
+    audio_format = f"aresample={sample_rate},aformat=sample_fmts=fltp:channel_layouts=stereo"
+    index = graph.add_input("-i", voice_file)
+    audio = graph.add([f"{index}:a:0"], f"{audio_format},volume={voice_volume},apad", prefix="a")
+
+    bgm_duration = bgm_catalog.get_duration(bgm_file) if bgm_file else 0
+    if bgm_duration:
+        index = graph.add_input("-i", bgm_file)
+        fade = min(bgm_fade_out, bgm_duration)
+        bgm = graph.add(
+            [f"{index}:a:0"],
+            f"{audio_format},"
+            f"afade=t=out:st={bgm_duration - fade:.6f}:d={fade:.6f},volume={bgm_volume},"
+            f"aloop=loop=-1:size={int(bgm_duration * sample_rate) + 1}",
+            prefix="a",
+        )
+        audio = graph.add([audio, bgm], "amix=inputs=2:duration=first:normalize=0", prefix="a")
+
+    # clipped like the numpy mix
+    return graph.add([audio], f"atrim=duration={duration:.6f},asoftclip=type=hard", prefix="a")
+
+
+def render(
+    graph: Graph,
+    output_file: str,
+    video: str,
+    audio: str = "",
+    audio_track: str = "",
+    fps: float = 30,
+    video_codec: str = "libx264",
+    audio_codec: str = "aac",
+    threads: int = 2,
+) -> bool:
+    """
+    runs the graph in a single ffmpeg process. the audio is either a label of the graph
+    or a pre-mixed track that is copied, with the output cut to the shorter stream
+    """
+    args = []
+    for input_args in graph.inputs:
+        args += input_args
+    track_index = len(graph.inputs)
+    if audio_track:
+        args += ["-i", audio_track]
+
+    script_file = f"{output_file}.filters.txt"
+    with open(script_file, "w", encoding="utf-8") as f:
+        f.write(";\n".join(graph.filters))
+
+    args += ["-filter_complex_script", script_file, "-map", f"[{video}]"]
+    if audio:
+        args += ["-map", f"[{audio}]", "-c:a", audio_codec, "-b:a", "192k"]
+    elif audio_track:
+        args += ["-map", f"{track_index}:a:0", "-c:a", "copy", "-shortest"]
+    else:
+        args += ["-an"]
+    args += [
+        "-r", str(fps),
+        "-c:v", video_codec,
+        "-preset", "medium",
+        "-pix_fmt", "yuv420p",
+        "-threads", str(threads),
+        "-movflags", "+faststart",
+        output_file,
+    ]
+
+    try:
+        ok = ffmpeg.run(args)
+    finally:
+        try:
+            os.remove(script_file)
+        except Exception:
+            pass
+    if not ok or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        logger.error(f"failed to render with ffmpeg: {output_file}")
+        return False
+    logger.info(f"rendered with ffmpeg: {output_file}, {len(graph.inputs)} inputs, {len(graph.filters)} filters")
+    return True
+
+
+def cleanup(work_dir: str):
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -5,10 +5,10 @@ from urllib.parse import urlencode
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services.media_index import media_index
 from app.utils import utils
 
 requested_count = 0
@@ -179,11 +179,8 @@ def save_video(video_url: str, save_dir: str = "") -> str:
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
+            media_info = media_index.probe(video_path)
+            if media_info.duration > 0 and media_info.fps > 0:
                 return video_path
         except Exception as e:
             try:
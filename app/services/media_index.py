@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+
+from loguru import logger
+
+from app.config import config
+from app.services.utils import ffmpeg, media_probe
+from app.utils import utils
+
+
+class MediaInfo:
+    def __init__(
+        self,
+        duration: float = 0.0,
+        width: int = 0,
+        height: int = 0,
+        fps: float = 0.0,
+        codec: str = "",
+        keyframe_interval: float = None,
+        has_video: bool = False,
+        has_audio: bool = False,
+    ):
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.keyframe_interval = keyframe_interval
+        self.has_video = has_video
+        self.has_audio = has_audio
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def __str__(self):
+        return f"MediaInfo(duration={self.duration}, width={self.width}, height={self.height}, fps={self.fps}, codec={self.codec}, keyframe_interval={self.keyframe_interval}, has_video={self.has_video}, has_audio={self.has_audio})"
+
+
+def probe_media(file_path: str) -> MediaInfo:
+    """
+    reads the MP4 or MP3 headers in-process, other containers are probed with ffmpeg
+    """
+    values = media_probe.probe(file_path)
+    if values is not None:
+        return MediaInfo(**values)
+
+    infos = ffmpeg.parse_infos(file_path)
+    info = MediaInfo(
+        duration=infos.get("duration") or 0.0,
+        has_video=bool(infos.get("video_found")),
+        has_audio=bool(infos.get("audio_found")),
+    )
+    if info.has_video:
+        info.width, info.height = infos.get("video_size") or (0, 0)
+        info.fps = infos.get("video_fps") or 0.0
+        info.codec = infos.get("video_codec_name") or ""
+        info.keyframe_interval = ffmpeg.probe_keyframe_interval(file_path)
+    logger.debug(f"probed media with ffmpeg: {file_path} => {info}")
+    return info
+
+
+class MediaIndex:
+    """
+    persistent index of material metadata, keyed by path and invalidated when the
+    file's mtime or size changes, so a file is only probed once across tasks.
+    task outputs are short-lived and should be probed with probe_media instead.
+    """
+
+    _columns = [
+        "duration",
+        "width",
+        "height",
+        "fps",
+        "codec",
+        "keyframe_interval",
+        "has_video",
+        "has_audio",
+    ]
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS media (
+                        path TEXT PRIMARY KEY,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        duration REAL,
+                        width INTEGER,
+                        height INTEGER,
+                        fps REAL,
+                        codec TEXT,
+                        keyframe_interval REAL,
+                        has_video INTEGER,
+                        has_audio INTEGER
+                    )
+                    """
+                )
+                conn.commit()
+                self._prune(conn)
+                self._initialized = True
+        return conn
+
+    def _prune(self, conn):
+        """
+        drops the entries of files that no longer exist, once per process
+        """
+        paths = [row[0] for row in conn.execute("SELECT path FROM media")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        if missing:
+            conn.executemany("DELETE FROM media WHERE path = ?", missing)
+            conn.commit()
+            logger.info(f"pruned {len(missing)} missing files from the media index")
+
+    def probe(self, file_path: str) -> MediaInfo:
+        """
+        returns the metadata of file_path, probing it only if the index has no
+        up-to-date entry. raises the probe error for unreadable files.
+        """
+        file_path = os.path.abspath(file_path)
+        st = os.stat(file_path)
+
+        info = self._lookup(file_path, st.st_mtime_ns, st.st_size)
+        if info is not None:
+            return info
+
+        info = probe_media(file_path)
+        self._store(file_path, st.st_mtime_ns, st.st_size, info)
+        return info
+
+    def _lookup(self, file_path: str, mtime_ns: int, size: int):
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    f"SELECT {', '.join(self._columns)} FROM media WHERE path = ? AND mtime_ns = ? AND size = ?",
+                    (file_path, mtime_ns, size),
+                ).fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"failed to query media index: {str(e)}")
+            return None
+
+        if row is None:
+            return None
+        values = dict(zip(self._columns, row))
+        values["has_video"] = bool(values["has_video"])
+        values["has_audio"] = bool(values["has_audio"])
+        return MediaInfo(**values)
+
+    def _store(self, file_path: str, mtime_ns: int, size: int, info: MediaInfo):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO media (path, mtime_ns, size, {', '.join(self._columns)}) VALUES (?, ?, ?, {', '.join('?' * len(self._columns))})",
+                    (
+                        file_path,
+                        mtime_ns,
+                        size,
+                        info.duration,
+                        info.width,
+                        info.height,
+                        info.fps,
+                        info.codec,
+                        info.keyframe_interval,
+                        int(info.has_video),
+                        int(info.has_audio),
+                    ),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"failed to update media index: {str(e)}")
+
+
+media_index = MediaIndex(
+    db_path=config.app.get("media_index_path", "")
+    or os.path.join(utils.storage_dir(create=True), "media_index.db")
+)
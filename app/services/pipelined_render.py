@@ -0,0 +1,112 @@
+from typing import List
+
+from loguru import logger
+
+from app.config import config
+from app.models.schema import VideoAspect, VideoParams
+from app.services import video
+from app.services.media_index import probe_media
+from app.services.planner import fps
+from app.services.utils import ffmpeg, frame_pipeline
+
+
+def pipeline_enabled() -> bool:
+    return config.app.get("render_pipeline", False) and frame_pipeline.available()
+
+
+def encode_frames(
+        video_file: str,
+        params: VideoParams,
+        overlay=None,
+        source_file: str = "",
+        video_clip=None,
+        start_frame: int = 0,
+        frames: int = None,
+        ffmpeg_params: List[str] = None,
+) -> bool:
+    """
+    encodes video_file without audio through frame_pipeline: the source, the subtitle
+    compositing and the encoder feed run as separate processes passing frames through
+    shared memory. frames come from source_file, decoded by ffmpeg, or from video_clip.
+    returns False when app.render_pipeline is off or the pipeline failed, the caller
+    then writes the clip with moviepy
+    """
+    if not pipeline_enabled():
+        return False
+
+    video_width, video_height = VideoAspect(params.video_aspect).to_resolution()
+    if video_clip is not None:
+        source = frame_pipeline.ClipSource(video_clip.get_frame, fps=fps, start_frame=start_frame)
+        duration = video_clip.duration
+    else:
+        source = frame_pipeline.FileSource(source_file, width=video_width, height=video_height, fps=fps)
+        duration = probe_media(source_file).duration
+    if frames is None:
+        frames = int(duration * fps) - start_frame
+
+    stages = [source]
+    if overlay is not None and overlay.lines:
+        stages.append(frame_pipeline.Compositor(overlay.draw, fps=fps, start_frame=start_frame))
+    stages.append(
+        frame_pipeline.Encoder(
+            video_file,
+            width=video_width,
+            height=video_height,
+            fps=fps,
+            codec=video.video_codec,
+            threads=params.n_threads or 2,
+            ffmpeg_params=ffmpeg_params,
+        )
+    )
+    try:
+        frame_pipeline.run(
+            stages,
+            frames=frames,
+            width=video_width,
+            height=video_height,
+            slots=int(config.app.get("render_pipeline_slots", 8)),
+        )
+    except Exception as e:
+        logger.error(f"failed to encode {video_file} in the frame pipeline, fallback to moviepy: {str(e)}")
+        video.delete_files(video_file)
+        return False
+    return True
+
+
+def render_pipelined(
+        output_file: str,
+        params: VideoParams,
+        audio_path: str,
+        subtitle_path: str,
+        audio_track: str = "",
+        source_file: str = "",
+        video_clip=None,
+) -> bool:
+    """
+    encodes the final video with encode_frames and muxes the mixed audio into it,
+    returns False if the video should be written with moviepy instead
+    """
+    if not pipeline_enabled():
+        return False
+
+    audio_track, temp_track = video.get_audio_track(
+        audio_track,
+        audio_path,
+        params,
+        duration=video_clip.duration if video_clip is not None else probe_media(source_file).duration,
+        output_file=output_file,
+    )
+    if not audio_track:
+        return False
+
+    video_file = f"{output_file}.video.mp4"
+    try:
+        overlay = video.get_subtitle_overlay(subtitle_path, params)
+        if not encode_frames(video_file, params, overlay=overlay, source_file=source_file, video_clip=video_clip):
+            return False
+        if not ffmpeg.mux_audio(video_file, audio_track, output_file):
+            logger.error(f"failed to mux audio track into {output_file}")
+            return False
+        return True
+    finally:
+        video.delete_files([video_file] + ([temp_track] if temp_track else []))
@@ -0,0 +1,361 @@
+import itertools
+import os
+import random
+from typing import List
+
+from loguru import logger
+from moviepy.video.tools.subtitles import file_to_subtitles
+
+from app.config import config
+from app.models.schema import (
+    Timeline,
+    TimelineAudio,
+    TimelineClip,
+    TimelineSubtitle,
+    VideoAspect,
+    VideoConcatMode,
+    VideoParams,
+    VideoTransitionMode,
+)
+from app.services.bgm_catalog import bgm_catalog
+from app.services.media_index import media_index, probe_media
+
+# every video is planned, and rendered, at this frame rate
+fps = 30
+
+
+class SubClippedVideoClip:
+    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None):
+        self.file_path = file_path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.width = width
+        self.height = height
+        if duration is None:
+            self.duration = end_time - start_time
+        else:
+            self.duration = duration
+
+    def __str__(self):
+        return f"SubClippedVideoClip(file_path={self.file_path}, start_time={self.start_time}, end_time={self.end_time}, duration={self.duration}, width={self.width}, height={self.height})"
+
+
+def get_bgm_file(bgm_type: str = "random", bgm_file: str = "", rng: random.Random = None):
+    if not bgm_type:
+        return ""
+
+    if bgm_file and os.path.exists(bgm_file):
+        return bgm_file
+
+    if bgm_type == "random":
+        return bgm_catalog.random_song(rng)
+
+    return ""
+
+
+def pick_transition(video_transition_mode: VideoTransitionMode = None, rng: random.Random = None):
+    # random choices are made in the task thread so the output does not depend on worker scheduling
+    rng = rng or random
+    shuffle_side = rng.choice(["left", "right", "top", "bottom"])
+    if video_transition_mode is None:
+        return VideoTransitionMode.none.value, shuffle_side
+
+    transition = video_transition_mode.value
+    if transition == VideoTransitionMode.crossfade.value:
+        # crossfades are applied when the clips are joined, not per clip
+        return VideoTransitionMode.none.value, shuffle_side
+    if transition == VideoTransitionMode.shuffle.value:
+        transition = rng.choice(
+            [
+                VideoTransitionMode.fade_in.value,
+                VideoTransitionMode.fade_out.value,
+                VideoTransitionMode.slide_in.value,
+                VideoTransitionMode.slide_out.value,
+            ]
+        )
+    return transition, shuffle_side
+
+
+def get_crossfade_duration(video_transition_mode: VideoTransitionMode = None) -> float:
+    """
+    how long adjacent clips overlap when they are joined, 0 unless the mode is crossfade
+    """
+    if video_transition_mode is None or video_transition_mode.value != VideoTransitionMode.crossfade.value:
+        return 0
+    return float(config.app.get("crossfade_duration", 1.0))
+
+
+def get_fit_size(clip_w: int, clip_h: int, video_width: int, video_height: int):
+    """
+    returns the largest size with the clip's aspect ratio that fits in the target frame
+    """
+    clip_ratio = clip_w / clip_h
+    video_ratio = video_width / video_height
+    if clip_ratio == video_ratio:
+        return video_width, video_height
+
+    if clip_ratio > video_ratio:
+        scale_factor = video_width / clip_w
+    else:
+        scale_factor = video_height / clip_h
+    return int(clip_w * scale_factor), int(clip_h * scale_factor)
+
+
+def get_subclipped_items(
+        video_paths: List[str],
+        video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+        max_clip_duration: int = 5,
+        rng: random.Random = None,
+) -> List[SubClippedVideoClip]:
+    subclipped_items = []
+    for video_path in video_paths:
+        try:
+            media_info = media_index.probe(video_path)
+        except Exception as e:
+            logger.error(f"failed to probe video: {video_path} => {str(e)}")
+            continue
+        clip_duration = media_info.duration
+        clip_w, clip_h = media_info.size
+
+        start_time = 0
+
+        while start_time < clip_duration:
+            end_time = min(start_time + max_clip_duration, clip_duration)
+            if clip_duration - start_time >= max_clip_duration:
+                subclipped_items.append(SubClippedVideoClip(file_path= video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
+            start_time = end_time
+            if video_concat_mode.value == VideoConcatMode.sequential.value:
+                break
+
+    # random subclipped_items order
+    if video_concat_mode.value == VideoConcatMode.random.value:
+        (rng or random).shuffle(subclipped_items)
+
+    logger.debug(f"total subclipped items: {len(subclipped_items)}")
+    return subclipped_items
+
+
+def get_audio_duration(audio_file: str) -> float:
+    return probe_media(audio_file).duration
+
+
+def has_subtitles(subtitle_path: str) -> bool:
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return False
+    try:
+        return bool(file_to_subtitles(subtitle_path, encoding="utf-8"))
+    except Exception as e:
+        logger.warning(f"failed to read subtitles: {subtitle_path} => {str(e)}")
+        return False
+
+
+def get_bgm_volume(bgm_file: str, params: VideoParams) -> float:
+    bgm_volume = params.bgm_volume
+    target_loudness = config.app.get("bgm_target_loudness", None)
+    if bgm_file and target_loudness is not None:
+        # bgm_volume is then relative to the target, whatever the song was mastered at
+        loudness = bgm_catalog.get_loudness(bgm_file)
+        if loudness is not None:
+            bgm_volume *= 10 ** ((float(target_loudness) - loudness) / 20)
+            logger.info(f"bgm loudness: {loudness} LUFS, volume: {bgm_volume:.3f}")
+    return bgm_volume
+
+
+def get_timeline_clips(
+        subclipped_items: List[SubClippedVideoClip],
+        transitions: List[tuple],
+        video_width: int,
+        video_height: int,
+        max_clip_duration: int = 5,
+) -> List[TimelineClip]:
+    """
+    the subclips with their durations, fit sizes and transitions, worked out from the
+    probed metadata without opening any clip
+    """
+    clips = []
+    for subclipped_item, (transition, side) in zip(subclipped_items, transitions):
+        width, height = video_width, video_height
+        if subclipped_item.width and subclipped_item.height:
+            width, height = get_fit_size(subclipped_item.width, subclipped_item.height, video_width, video_height)
+        clips.append(
+            TimelineClip(
+                file_path=subclipped_item.file_path,
+                start_time=subclipped_item.start_time,
+                duration=min(subclipped_item.duration, max_clip_duration),
+                width=subclipped_item.width or 0,
+                height=subclipped_item.height or 0,
+                fit_width=width,
+                fit_height=height,
+                transition=transition,
+                side=side,
+            )
+        )
+    return clips
+
+
+def plan_timeline(clips: List[TimelineClip], required_duration: float, crossfade: float = 0, loop: bool = True) -> List[TimelineClip]:
+    """
+    the clips build_timeline would join: cut once they pass required_duration and, with
+    loop, repeated until they cover it
+    """
+    base_clips = []
+    video_duration = 0
+    for clip in clips:
+        if video_duration > required_duration:
+            break
+        base_clips.append(clip)
+        video_duration += clip.duration - (crossfade if len(base_clips) > 1 else 0)
+
+    timeline_clips = base_clips.copy()
+    if loop and base_clips and video_duration < required_duration:
+        for clip in itertools.cycle(base_clips):
+            if video_duration >= required_duration:
+                break
+            timeline_clips.append(clip)
+            video_duration += clip.duration - crossfade
+    return timeline_clips
+
+
+def get_clip_key(clip: TimelineClip) -> tuple:
+    # clips with the same key render the same frames
+    return clip.file_path, clip.start_time, clip.transition, clip.side
+
+
+def get_timeline_items(clips: List[TimelineClip]):
+    """
+    the subclips and transitions of the clips up to the first looped one, which the
+    moviepy renderers loop the same way
+    """
+    subclipped_items = []
+    transitions = []
+    seen = set()
+    for clip in clips:
+        key = get_clip_key(clip)
+        if key in seen:
+            break
+        seen.add(key)
+        subclipped_items.append(
+            SubClippedVideoClip(
+                file_path=clip.file_path,
+                start_time=clip.start_time,
+                end_time=clip.start_time + clip.duration,
+                width=clip.width or None,
+                height=clip.height or None,
+            )
+        )
+        transitions.append((clip.transition, clip.side))
+    return subclipped_items, transitions
+
+
+def get_unique_clips(timelines: List[Timeline]) -> List[TimelineClip]:
+    # every clip the timelines play, once, in the order they first appear
+    clips = {}
+    for timeline in timelines:
+        for clip in timeline.clips:
+            clips.setdefault(get_clip_key(clip), clip)
+    return list(clips.values())
+
+
+def plan_videos(
+        video_paths: List[str],
+        audio_path: str,
+        subtitle_path: str,
+        params: VideoParams,
+        video_concat_mode: VideoConcatMode = None,
+        count: int = 1,
+) -> List[Timeline]:
+    """
+    plans `count` videos from probed metadata, without decoding a frame. every random
+    choice comes from params.seed, or from a new seed that is saved in the timelines,
+    so the same seed and materials give the same videos. more than one video are
+    variants that share one pool of subclips, each in its own order
+    """
+    seed = params.seed if params.seed is not None else random.randrange(2**32)
+    rng = random.Random(seed)
+    video_width, video_height = VideoAspect(params.video_aspect).to_resolution()
+    audio_duration = get_audio_duration(audio_path)
+    crossfade = get_crossfade_duration(params.video_transition_mode)
+    if count > 1:
+        # variants pick from one shuffled pool of subclips
+        video_concat_mode = VideoConcatMode.random
+    elif video_concat_mode is None:
+        video_concat_mode = VideoConcatMode(params.video_concat_mode)
+
+    subclipped_items = get_subclipped_items(
+        video_paths=video_paths,
+        video_concat_mode=video_concat_mode,
+        max_clip_duration=params.video_clip_duration,
+        rng=rng,
+    )
+    clips = get_timeline_clips(
+        subclipped_items,
+        transitions=[pick_transition(params.video_transition_mode, rng) for _ in subclipped_items],
+        video_width=video_width,
+        video_height=video_height,
+        max_clip_duration=params.video_clip_duration,
+    )
+    if count == 1:
+        sequences = [plan_timeline(clips, audio_duration, crossfade=crossfade)]
+    else:
+        # the pool covers every variant and is normalized once, each variant reorders it
+        pool = plan_timeline(clips, audio_duration * count, loop=False)
+        sequences = []
+        for _ in range(count):
+            ordered = pool.copy()
+            rng.shuffle(ordered)
+            sequences.append(plan_timeline(ordered, audio_duration, crossfade=crossfade))
+
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file, rng=rng)
+    audio = TimelineAudio(
+        voice_file=audio_path,
+        duration=audio_duration,
+        voice_volume=params.voice_volume,
+        bgm_file=bgm_file,
+        bgm_volume=get_bgm_volume(bgm_file, params),
+    )
+    subtitles = []
+    if has_subtitles(subtitle_path):
+        subtitles = [
+            TimelineSubtitle(start=start, end=end, text=text)
+            for (start, end), text in file_to_subtitles(subtitle_path, encoding="utf-8")
+        ]
+    else:
+        subtitle_path = ""
+
+    timelines = []
+    for sequence in sequences:
+        overlap = min([crossfade] + [clip.duration for clip in sequence]) if len(sequence) > 1 else 0
+        timelines.append(
+            Timeline(
+                seed=seed,
+                width=video_width,
+                height=video_height,
+                fps=fps,
+                duration=sum(clip.duration for clip in sequence) - overlap * max(0, len(sequence) - 1),
+                crossfade=crossfade,
+                clips=sequence,
+                subtitle_path=subtitle_path,
+                subtitles=subtitles,
+                audio=audio,
+            )
+        )
+    return timelines
+
+
+def validate_timeline(timeline: Timeline) -> List[str]:
+    """
+    what would make the render fail or come out wrong, found before it starts
+    """
+    errors = []
+    if not timeline.clips:
+        errors.append("no clips available for rendering")
+    for file_path in sorted({clip.file_path for clip in timeline.clips}):
+        if not os.path.exists(file_path):
+            errors.append(f"clip not found: {file_path}")
+    if timeline.clips and timeline.duration < timeline.audio.duration:
+        errors.append(f"video duration ({timeline.duration:.2f}s) is shorter than the audio ({timeline.audio.duration:.2f}s)")
+    if not os.path.exists(timeline.audio.voice_file):
+        errors.append(f"audio not found: {timeline.audio.voice_file}")
+    if timeline.audio.bgm_file and not os.path.exists(timeline.audio.bgm_file):
+        errors.append(f"bgm not found: {timeline.audio.bgm_file}")
+    return errors
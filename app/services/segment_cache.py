@@ -0,0 +1,233 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+def link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        # e.g. an earlier run left the same entry linked at dst
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except Exception:
+        shutil.copy(src, dst)
+
+
+# a temp file that hasn't been written to for this many seconds was left behind by a
+# writer that crashed, and is removed when the cache is evicted
+stale_temp_age = 3600
+
+
+def evict_lru(cache_dir: str, max_size: int, suffix: str) -> int:
+    """
+    removes the least recently modified files ending with suffix from cache_dir until
+    they take up no more than max_size bytes, and returns how many were removed.
+    stale .tmp files are swept on the way
+    """
+    entries = []
+    total_size = 0
+    stale_before = time.time() - stale_temp_age
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".tmp"):
+                    remove_stale_temp(entry.path, stale_before)
+                    continue
+                if not entry.name.endswith(suffix):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total_size += st.st_size
+    except FileNotFoundError:
+        return 0
+
+    if max_size <= 0:
+        return 0
+
+    evictions = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except Exception:
+            continue
+        total_size -= size
+        evictions += 1
+    return evictions
+
+
+def remove_stale_temp(file_path: str, stale_before: float):
+    try:
+        if os.stat(file_path).st_mtime < stale_before:
+            os.remove(file_path)
+            logger.info(f"removed stale temp file: {file_path}")
+    except Exception:
+        pass
+
+
+class SegmentCache:
+    """
+    content-addressed cache of normalized subclips (temp-clip-N.mp4) shared by all tasks.
+    entries are keyed by the source file hash, the subclip window, the target resolution,
+    fps, codec and transition; the least recently used entries are evicted once the
+    cache directory grows past max_size_mb.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: int = 2048, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb) * 1024 * 1024
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def file_hash(self, file_path: str) -> str:
+        st = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if memo_key in self._file_hashes:
+                return self._file_hashes[memo_key]
+
+        h = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._file_hashes[memo_key] = digest
+        return digest
+
+    def make_key(
+        self,
+        file_path: str,
+        start_time: float,
+        end_time: float,
+        width: int,
+        height: int,
+        fps: int,
+        codec: str,
+        transition: str = None,
+        side: str = "",
+    ) -> str:
+        # the slide side only changes the output of slide transitions
+        if not transition or not transition.startswith("Slide"):
+            side = ""
+        parts = [
+            self.file_hash(file_path),
+            f"{float(start_time):.3f}",
+            f"{float(end_time):.3f}",
+            f"{width}x{height}",
+            str(fps),
+            codec,
+            transition or "",
+            side or "",
+        ]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def make_image_key(
+        self,
+        file_path: str,
+        duration: float,
+        width: int,
+        height: int,
+        fps: int,
+        codec: str,
+    ) -> str:
+        # clips rendered from still images, see video.preprocess_video
+        parts = [
+            self.file_hash(file_path),
+            "image",
+            f"{float(duration):.3f}",
+            f"{width}x{height}",
+            str(fps),
+            codec,
+        ]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"seg-{key}.mp4")
+
+    def get(self, key: str, target_file: str) -> bool:
+        """
+        materializes a cached segment at target_file, returns False on a miss
+        """
+        if not self.enabled:
+            return False
+
+        entry = self._entry_path(key)
+        try:
+            # bump the mtime, it is the recency used for eviction
+            os.utime(entry)
+            link_or_copy(entry, target_file)
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, source_file: str):
+        if not self.enabled:
+            return
+
+        entry = self._entry_path(key)
+        temp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            link_or_copy(source_file, temp_entry)
+            os.replace(temp_entry, entry)
+        except Exception as e:
+            logger.warning(f"failed to cache segment: {str(e)}")
+            try:
+                os.remove(temp_entry)
+            except Exception:
+                pass
+            return
+
+        self.evict()
+
+    def evict(self):
+        evictions = evict_lru(self.cache_dir, self.max_size, ".mp4")
+        with self._lock:
+            self.evictions += evictions
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+segment_cache = SegmentCache(
+    cache_dir=utils.storage_dir("cache_segments"),
+    max_size_mb=config.app.get("segment_cache_max_size_mb", 2048),
+    enabled=config.app.get("segment_cache_enabled", True),
+)
+
+image_clip_cache = SegmentCache(
+    cache_dir=utils.storage_dir("cache_images"),
+    max_size_mb=config.app.get("image_clip_cache_max_size_mb", 1024),
+    enabled=config.app.get("segment_cache_enabled", True),
+)
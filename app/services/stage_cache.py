@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import threading
+
+from loguru import logger
+
+from app.utils import utils
+
+
+class StageCache:
+    """
+    the fingerprint of every stage a task ran and the outputs it produced, kept in
+    stages.json in the task dir. a fingerprint hashes the stage's inputs, which include
+    the fingerprints of the stages it depends on, so when a task is rendered again a
+    stage is only rerun if something it depends on changed or its files are gone
+    """
+
+    def __init__(self, task_dir: str):
+        self.file = os.path.join(task_dir, "stages.json")
+        self.stages = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.file):
+            try:
+                with open(self.file, "r", encoding="utf-8") as f:
+                    self.stages = json.load(f)
+            except Exception as e:
+                logger.warning(f"failed to load stages: {self.file} => {str(e)}")
+
+    @staticmethod
+    def fingerprint(*inputs) -> str:
+        data = json.dumps(inputs, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_stats(files) -> list:
+        # files are told apart by size and mtime instead of hashing their content
+        stats = []
+        for file in sorted(set(file for file in files if file)):
+            try:
+                st = os.stat(file)
+                stats.append((os.path.abspath(file), st.st_size, st.st_mtime_ns))
+            except OSError:
+                stats.append((os.path.abspath(file), None, None))
+        return stats
+
+    def get(self, stage: str, fingerprint: str):
+        """
+        the outputs of the stage if it last ran with the same fingerprint and all of
+        its files still exist, otherwise None
+        """
+        with self._lock:
+            entry = self.stages.get(stage)
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return None
+        if not all(os.path.exists(file) for file in entry.get("files", [])):
+            return None
+        logger.info(f"reusing stage: {stage}")
+        return entry.get("outputs")
+
+    def put(self, stage: str, fingerprint: str, outputs=None, files: list = None):
+        with self._lock:
+            self.stages[stage] = {
+                "fingerprint": fingerprint,
+                "outputs": outputs,
+                "files": [file for file in files or [] if file],
+            }
+            data = utils.to_json(self.stages)
+        with open(self.file, "w", encoding="utf-8") as f:
+            f.write(data)
@@ -1,6 +1,8 @@
+import json
 import math
 import os.path
 import re
+import shutil
 from os import path
 
 from loguru import logger
@@ -8,8 +10,9 @@ from loguru import logger
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
+from app.services import llm, material, planner, subtitle, video, voice
 from app.services import state as sm
+from app.services.stage_cache import StageCache
 from app.utils import utils
 
 
@@ -70,9 +73,9 @@ def save_script_data(task_id, video_script, video_terms, params):
         f.write(utils.to_json(script_data))
 
 
-def generate_audio(task_id, params, video_script):
+def generate_audio(task_id, params, video_script, audio_file=""):
     logger.info("\n\n## generating audio")
-    audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
+    audio_file = audio_file or path.join(utils.task_dir(task_id), "audio.mp3")
     sub_maker = voice.tts(
         text=video_script,
         voice_name=voice.parse_voice_name(params.voice_name),
@@ -93,11 +96,13 @@ def generate_audio(task_id, params, video_script):
     return audio_file, audio_duration, sub_maker
 
 
-def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
+def generate_subtitle(
+    task_id, params, video_script, sub_maker, audio_file, subtitle_path=""
+):
     if not params.subtitle_enabled:
         return ""
 
-    subtitle_path = path.join(utils.task_dir(task_id), "subtitle.srt")
+    subtitle_path = subtitle_path or path.join(utils.task_dir(task_id), "subtitle.srt")
     subtitle_provider = config.app.get("subtitle_provider", "edge").strip().lower()
     logger.info(f"\n\n## generating subtitle, provider: {subtitle_provider}")
 
@@ -123,11 +128,58 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     return subtitle_path
 
 
+def generate_languages(task_id, params):
+    # script, voice and subtitle of every extra language of a multi-language video
+    languages = []
+    task_dir = utils.task_dir(task_id)
+    for item in params.languages or []:
+        logger.info(f"\n\n## generating language: {item.language}")
+        name = re.sub(r"[^\w-]", "_", item.language)
+        language_params = params.model_copy(
+            update={
+                "video_language": item.language,
+                "voice_name": item.voice_name,
+                "video_script": item.video_script or "",
+            }
+        )
+        video_script = generate_script(task_id, language_params)
+        if not video_script or "Error: " in video_script:
+            return None
+
+        audio_file, _, sub_maker = generate_audio(
+            task_id,
+            language_params,
+            video_script,
+            audio_file=path.join(task_dir, f"audio-{name}.mp3"),
+        )
+        if not audio_file:
+            return None
+
+        subtitle_path = generate_subtitle(
+            task_id,
+            language_params,
+            video_script,
+            sub_maker,
+            audio_file,
+            subtitle_path=path.join(task_dir, f"subtitle-{name}.srt"),
+        )
+        languages.append(
+            {
+                "language": item.language,
+                "audio_file": audio_file,
+                "subtitle_path": subtitle_path,
+            }
+        )
+    return languages
+
+
 def get_video_materials(task_id, params, video_terms, audio_duration):
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            video_aspect=params.video_aspect,
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -156,57 +208,430 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
+def plan_videos(task_id, params, downloaded_videos, audio_file, subtitle_path, languages=None):
+    # the timelines of every video, planned from metadata and saved before anything is rendered
+    logger.info("\n\n## planning videos")
+    if languages or params.subtitle_mode in ("soft", "webvtt"):
+        # the footage covers the longest voice, the subtitles are muxed in as tracks
+        audio_file = max(
+            [audio_file] + [language["audio_file"] for language in languages or []],
+            key=planner.get_audio_duration,
+        )
+        subtitle_path = ""
+    timelines = planner.plan_videos(
+        video_paths=downloaded_videos,
+        audio_path=audio_file,
+        subtitle_path=subtitle_path,
+        params=params,
+        video_concat_mode=params.video_concat_mode,
+        count=params.video_count,
+    )
+
+    timeline_file = path.join(utils.task_dir(task_id), "timeline.json")
+    with open(timeline_file, "w", encoding="utf-8") as f:
+        f.write(utils.to_json(timelines))
+
+    errors = []
+    for index, timeline in enumerate(timelines):
+        errors += [f"video {index + 1}: {error}" for error in planner.validate_timeline(timeline)]
+    if errors:
+        logger.error(f"invalid timeline: {timeline_file}\n" + "\n".join(errors))
+        return None, timeline_file
+
+    clips = sum(len(timeline.clips) for timeline in timelines)
+    duration = sum(timeline.duration for timeline in timelines)
+    frames = sum(math.ceil(timeline.duration * timeline.fps) for timeline in timelines)
+    logger.info(
+        f"planned {len(timelines)} videos, seed: {timelines[0].seed}, clips: {clips}, "
+        f"duration: {duration:.2f}s, frames: {frames} => {timeline_file}"
+    )
+    return timelines, timeline_file
+
+
+def keep_footage(params, stages):
+    # the combined footage is kept in the task dir when it's asked for, or so that a
+    # task rendered again with only subtitle or audio changes skips straight to the overlay
+    return params.combined_video_enabled or (
+        stages is not None and config.app.get("incremental_render", False)
+    )
+
+
+def get_footage_key(timeline, params):
+    # the footage only depends on the clips and what draws them, not on the audio or subtitles
+    return StageCache.fingerprint(
+        timeline.model_dump(include={"width", "height", "fps", "crossfade", "clips"}),
+        StageCache.file_stats(clip.file_path for clip in timeline.clips),
+        video.get_render_backend(params),
+    )
+
+
+def mix_audio_track(params, audio_file, duration, output_file, stages=None, stage=""):
+    # reused as long as the voice, the bgm and their volumes are unchanged
+    bgm_file = planner.get_bgm_file(params.bgm_type, params.bgm_file)
+    key = StageCache.fingerprint(
+        StageCache.file_stats([audio_file, bgm_file]),
+        duration,
+        params.voice_volume,
+        params.bgm_volume,
+        config.app.get("bgm_target_loudness", None),
+    )
+    if stages is not None and stages.get(stage, key):
+        return output_file
+
+    audio_track = video.prepare_audio_track(
+        audio_path=audio_file,
+        params=params,
+        duration=duration,
+        output_file=output_file,
+    )
+    if stages is not None and audio_track:
+        stages.put(stage, key, {"audio_track": audio_track}, files=[audio_track])
+    return audio_track
+
+
+def generate_audio_track(task_id, params, audio_file, stages=None):
+    # voice and bgm are mixed and encoded once, then muxed into every video
+    if not config.app.get("audio_premix", True):
+        return ""
+    logger.info("\n\n## mixing audio track")
+    audio_duration = planner.get_audio_duration(audio_file)
+    # every video covers the voice and overshoots it by less than one clip
+    return mix_audio_track(
+        params,
+        audio_file,
+        duration=audio_duration + params.video_clip_duration,
+        output_file=path.join(utils.task_dir(task_id), "audio-track.m4a"),
+        stages=stages,
+        stage="audio-track",
+    )
+
+
+def generate_language_tracks(
+    task_id, params, audio_file, subtitle_path, languages, stages=None
+):
+    # one pre-mixed audio track per language, all as long as the longest voice needs
+    task_dir = utils.task_dir(task_id)
+    tracks = [
+        {
+            "language": params.video_language,
+            "audio_file": audio_file,
+            "subtitle_path": subtitle_path,
+        }
+    ] + languages
+    for track in tracks:
+        track["audio_duration"] = planner.get_audio_duration(track["audio_file"])
+    longest = max(tracks, key=lambda t: t["audio_duration"])
+
+    # the same bgm under every language
+    params = params.model_copy(
+        update={"bgm_file": planner.get_bgm_file(params.bgm_type, params.bgm_file)}
+    )
+    logger.info("\n\n## mixing audio tracks")
+    for track in tracks:
+        name = re.sub(r"[^\w-]", "_", track["language"] or "default")
+        track["audio_track"] = mix_audio_track(
+            params,
+            track["audio_file"],
+            duration=longest["audio_duration"] + params.video_clip_duration,
+            output_file=path.join(task_dir, f"audio-track-{name}.m4a"),
+            stages=stages,
+            stage=f"audio-track-{name}",
+        )
+    return tracks, longest
+
+
 def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
+    task_id,
+    params,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    languages=None,
+    timelines=None,
+    stages=None,
 ):
+    if not languages and params.subtitle_mode not in ("soft", "webvtt"):
+        audio_track = generate_audio_track(task_id, params, audio_file, stages=stages)
+        return render_final_videos(
+            task_id,
+            params,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            audio_track=audio_track,
+            timelines=timelines,
+            stages=stages,
+        )
+
+    # the footage is rendered once without subtitles, covering the longest voice,
+    # then the voice and subtitles of every language are muxed in as tracks
+    tracks, longest = generate_language_tracks(
+        task_id, params, audio_file, subtitle_path, languages or [], stages=stages
+    )
+    final_video_paths, combined_video_paths = render_final_videos(
+        task_id,
+        params,
+        downloaded_videos,
+        longest["audio_file"],
+        "",
+        audio_track=longest["audio_track"],
+        timelines=timelines,
+        stages=stages,
+    )
+    for final_video_path in final_video_paths:
+        video.add_language_tracks(final_video_path, tracks, params.subtitle_mode)
+    return final_video_paths, combined_video_paths
+
+
+def render_final_videos(
+    task_id,
+    params,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    audio_track="",
+    timelines=None,
+    stages=None,
+):
+    if params.video_count > 1:
+        return generate_final_video_variants(
+            task_id,
+            params,
+            downloaded_videos,
+            audio_file,
+            subtitle_path,
+            audio_track=audio_track,
+            timelines=timelines,
+            stages=stages,
+        )
+
     final_video_paths = []
     combined_video_paths = []
-    video_concat_mode = (
-        params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
-    )
-    video_transition_mode = params.video_transition_mode
+    video_concat_mode = params.video_concat_mode
 
     _progress = 50
     for i in range(params.video_count):
         index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
-        )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
-        )
+        timeline = timelines[i] if timelines else None
+        combined_video_path = ""
+        if keep_footage(params, stages):
+            combined_video_path = path.join(
+                utils.task_dir(task_id), f"combined-{index}.mp4"
+            )
+        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
 
-        _progress += 50 / params.video_count / 2
+        footage_key = ""
+        if combined_video_path and timeline and stages is not None:
+            footage_key = get_footage_key(timeline, params)
+
+        if footage_key and stages.get(f"footage-{index}", footage_key):
+            # only the subtitles and the audio go on top of the kept footage
+            logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+            video.generate_video(
+                video_path=combined_video_path,
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                audio_track=audio_track,
+            )
+            rendered = final_video_path
+        else:
+            logger.info(f"\n\n## rendering video: {index} => {final_video_path}")
+            rendered = video.render_video(
+                video_paths=downloaded_videos,
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                video_concat_mode=video_concat_mode,
+                combined_video_path=combined_video_path,
+                audio_track=audio_track,
+                timeline=timeline,
+            )
+            if rendered and footage_key:
+                stages.put(
+                    f"footage-{index}",
+                    footage_key,
+                    {"footage": combined_video_path},
+                    files=[combined_video_path],
+                )
+
+        _progress += 50 / params.video_count
         sm.state.update_task(task_id, progress=_progress)
+        if not rendered:
+            continue
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
+        final_video_paths.append(final_video_path)
+        if params.combined_video_enabled:
+            combined_video_paths.append(combined_video_path)
 
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
+    return final_video_paths, combined_video_paths
+
+
+def generate_final_video_variants(
+    task_id,
+    params,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    audio_track="",
+    timelines=None,
+    stages=None,
+):
+    # the clips of all variants are normalized once, each variant only joins
+    # its own sequence of them with stream copy
+    final_video_paths = []
+    combined_video_paths = []
+    task_dir = utils.task_dir(task_id)
+    if not timelines:
+        timelines = planner.plan_videos(
+            video_paths=downloaded_videos,
             audio_path=audio_file,
             subtitle_path=subtitle_path,
-            output_file=final_video_path,
             params=params,
+            count=params.video_count,
         )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+    # the footage of a variant is only combined again if its clips changed
+    footage_keys = {}
+    if keep_footage(params, stages) and stages is not None:
+        for i, timeline in enumerate(timelines):
+            footage_keys[i + 1] = get_footage_key(timeline, params)
+    reused = {
+        index
+        for index, footage_key in footage_keys.items()
+        if stages.get(f"footage-{index}", footage_key)
+    }
 
-        final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
+    logger.info(f"\n\n## preparing segments for {params.video_count} videos")
+    clips = planner.get_unique_clips(
+        [timeline for i, timeline in enumerate(timelines) if i + 1 not in reused]
+    )
+    clip_segments = video.prepare_clip_segments(
+        clips,
+        output_dir=task_dir,
+        video_aspect=params.video_aspect,
+        max_clip_duration=params.video_clip_duration,
+    )
+    segments = [segment for segment in clip_segments.values() if segment]
+    if clips and not segments:
+        logger.error("no segments available for rendering")
+        return final_video_paths, combined_video_paths
+
+    _progress = 60
+    variant_progress = {i + 1: 0 for i in range(params.video_count)}
+    sm.state.update_task(
+        task_id, progress=_progress, variant_progress=variant_progress
+    )
+
+    # variants are rendered in separate processes, each with its own scratch dir.
+    # segments are picked and joined here, so the random order does not depend on the worker
+    def finish_variant(job):
+        index, scratch_dir, combined_video_path, final_video_path, future = job
+        try:
+            future.result()
+            final_video_paths.append(final_video_path)
+            if params.combined_video_enabled:
+                combined_video_paths.append(combined_video_path)
+        except Exception as e:
+            logger.error(f"failed to generate video {index}: {str(e)}")
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        variant_progress[index] = 100
+        progress = _progress + 40 / params.video_count
+        sm.state.update_task(
+            task_id, progress=progress, variant_progress=variant_progress
+        )
+        return progress
+
+    pool = video.get_variant_pool() if params.video_count > 1 else None
+    jobs = []
+    try:
+        for i in range(params.video_count):
+            index = i + 1
+            scratch_dir = path.join(task_dir, f"variant-{index}")
+            os.makedirs(scratch_dir, exist_ok=True)
+            combined_video_path = path.join(scratch_dir, f"combined-{index}.mp4")
+            if keep_footage(params, stages):
+                combined_video_path = path.join(task_dir, f"combined-{index}.mp4")
+            final_video_path = path.join(task_dir, f"final-{index}.mp4")
+
+            if index not in reused:
+                logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
+                timeline = timelines[i]
+                video.assemble_video(
+                    combined_video_path,
+                    video.select_segments(timeline, clip_segments),
+                    threads=params.n_threads,
+                    crossfade=timeline.crossfade,
+                )
+                if index in footage_keys and os.path.exists(combined_video_path):
+                    stages.put(
+                        f"footage-{index}",
+                        footage_keys[index],
+                        {"footage": combined_video_path},
+                        files=[combined_video_path],
+                    )
+            variant_progress[index] = 50
+            sm.state.update_task(
+                task_id, progress=_progress, variant_progress=variant_progress
+            )
+
+            logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+            future = video.submit_job(
+                pool,
+                video.generate_video,
+                video_path=combined_video_path,
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                audio_track=audio_track,
+                # variants already run in parallel, don't split them into chunks as well
+                parallel=pool is None,
+            )
+            jobs.append((index, scratch_dir, combined_video_path, final_video_path, future))
+            if pool is None:
+                _progress = finish_variant(jobs.pop())
 
+    finally:
+        # the pool is shared with other tasks, so wait for this task's variants only
+        for job in jobs:
+            _progress = finish_variant(job)
+
+    video.delete_files([segment.file_path for segment in segments])
     return final_video_paths, combined_video_paths
 
 
+def load_params(task_id, changes: dict = None) -> VideoParams:
+    """
+    the params a task ran with, saved in script.json, with `changes` applied. the
+    seed of its timelines is kept unless it's changed, so the same clips are picked
+    again and start only reruns the stages the changes affect
+    """
+    unknown = sorted(set(changes or {}) - set(VideoParams.model_fields))
+    if unknown:
+        raise ValueError(f"unknown params: {', '.join(unknown)}")
+
+    task_dir = utils.task_dir(task_id)
+    script_file = path.join(task_dir, "script.json")
+    if not path.exists(script_file):
+        raise FileNotFoundError(f"task not found: {task_id}")
+    with open(script_file, "r", encoding="utf-8") as f:
+        values = json.load(f).get("params") or {}
+
+    timeline_file = path.join(task_dir, "timeline.json")
+    if values.get("seed") is None and path.exists(timeline_file):
+        with open(timeline_file, "r", encoding="utf-8") as f:
+            timelines = json.load(f)
+        if timelines:
+            values["seed"] = timelines[0]["seed"]
+
+    values.update(changes or {})
+    return VideoParams(**values)
+
+
 def start(task_id, params: VideoParams, stop_at: str = "video"):
     logger.info(f"start task: {task_id}, stop_at: {stop_at}")
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
@@ -214,11 +639,26 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
 
+    # every stage is fingerprinted by its inputs, a task that is rendered again
+    # only reruns the stages whose inputs changed
+    stages = StageCache(utils.task_dir(task_id))
+
     # 1. Generate script
-    video_script = generate_script(task_id, params)
-    if not video_script or "Error: " in video_script:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    script_key = stages.fingerprint(
+        params.video_subject,
+        params.video_script,
+        params.video_language,
+        params.paragraph_number,
+    )
+    cached = stages.get("script", script_key)
+    if cached:
+        video_script = cached["script"]
+    else:
+        video_script = generate_script(task_id, params)
+        if not video_script or "Error: " in video_script:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+        stages.put("script", script_key, {"script": video_script})
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=10)
 
@@ -231,10 +671,16 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     # 2. Generate terms
     video_terms = ""
     if params.video_source != "local":
-        video_terms = generate_terms(task_id, params, video_script)
-        if not video_terms:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-            return
+        terms_key = stages.fingerprint(script_key, params.video_terms)
+        cached = stages.get("terms", terms_key)
+        if cached:
+            video_terms = cached["terms"]
+        else:
+            video_terms = generate_terms(task_id, params, video_script)
+            if not video_terms:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                return
+            stages.put("terms", terms_key, {"terms": video_terms})
 
     save_script_data(task_id, video_script, video_terms, params)
 
@@ -246,13 +692,26 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=20)
 
-    # 3. Generate audio
-    audio_file, audio_duration, sub_maker = generate_audio(
-        task_id, params, video_script
+    # 3. Generate audio, the subtitle is timed from it and is kept in the same stage
+    subtitle_provider = config.app.get("subtitle_provider", "edge").strip().lower()
+    audio_key = stages.fingerprint(
+        script_key,
+        params.voice_name,
+        params.voice_rate,
+        params.subtitle_enabled,
+        subtitle_provider,
     )
-    if not audio_file:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    cached_audio = stages.get("audio", audio_key)
+    if cached_audio:
+        audio_file = cached_audio["audio_file"]
+        audio_duration = cached_audio["audio_duration"]
+    else:
+        audio_file, audio_duration, sub_maker = generate_audio(
+            task_id, params, video_script
+        )
+        if not audio_file:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
 
@@ -266,9 +725,54 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
     # 4. Generate subtitle
-    subtitle_path = generate_subtitle(
-        task_id, params, video_script, sub_maker, audio_file
-    )
+    if cached_audio:
+        subtitle_path = cached_audio["subtitle_path"]
+    else:
+        subtitle_path = generate_subtitle(
+            task_id, params, video_script, sub_maker, audio_file
+        )
+        stages.put(
+            "audio",
+            audio_key,
+            {
+                "audio_file": audio_file,
+                "audio_duration": audio_duration,
+                "subtitle_path": subtitle_path,
+            },
+            files=[audio_file, subtitle_path],
+        )
+
+    # 4.1 Generate the extra languages of a multi-language video
+    languages = []
+    if params.languages:
+        languages_key = stages.fingerprint(
+            script_key,
+            [item.model_dump() for item in params.languages],
+            params.voice_rate,
+            params.subtitle_enabled,
+            subtitle_provider,
+        )
+        cached = stages.get("languages", languages_key)
+        if cached:
+            languages = cached["languages"]
+        else:
+            languages = generate_languages(task_id, params)
+            if languages is None:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                return
+            stages.put(
+                "languages",
+                languages_key,
+                {"languages": languages},
+                files=[language["audio_file"] for language in languages]
+                + [language["subtitle_path"] for language in languages],
+            )
+        # the footage has to cover the longest voice
+        for language in languages:
+            audio_duration = max(
+                audio_duration,
+                math.ceil(planner.get_audio_duration(language["audio_file"])),
+            )
 
     if stop_at == "subtitle":
         sm.state.update_task(
@@ -282,12 +786,32 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
 
     # 5. Get video materials
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
+    materials_key = stages.fingerprint(
+        video_terms,
+        params.video_source,
+        params.video_materials,
+        params.video_aspect,
+        params.video_concat_mode,
+        params.video_clip_duration,
+        params.video_count,
+        audio_duration,
     )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    cached = stages.get("materials", materials_key)
+    if cached:
+        downloaded_videos = cached["materials"]
+    else:
+        downloaded_videos = get_video_materials(
+            task_id, params, video_terms, audio_duration
+        )
+        if not downloaded_videos:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+        stages.put(
+            "materials",
+            materials_key,
+            {"materials": downloaded_videos},
+            files=downloaded_videos,
+        )
 
     if stop_at == "materials":
         sm.state.update_task(
@@ -298,11 +822,38 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         )
         return {"materials": downloaded_videos}
 
+    # 6. Plan the timelines, every clip, transition and the bgm are picked here
+    timelines, timeline_file = plan_videos(
+        task_id, params, downloaded_videos, audio_file, subtitle_path, languages
+    )
+    if not timelines:
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return
+
+    if stop_at == "plan":
+        sm.state.update_task(
+            task_id,
+            state=const.TASK_STATE_COMPLETE,
+            progress=100,
+            timeline_file=timeline_file,
+        )
+        return {"timeline_file": timeline_file, "timelines": timelines}
+
+    # the audio tracks are mixed with the planned bgm
+    params = params.model_copy(update={"bgm_file": timelines[0].audio.bgm_file})
+
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
-    # 6. Generate final videos
+    # 7. Generate final videos
     final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
+        task_id,
+        params,
+        downloaded_videos,
+        audio_file,
+        subtitle_path,
+        languages,
+        timelines=timelines,
+        stages=stages,
     )
 
     if not final_video_paths:
@@ -322,7 +873,10 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         "audio_duration": audio_duration,
         "subtitle_path": subtitle_path,
         "materials": downloaded_videos,
+        "timeline_file": timeline_file,
     }
+    if languages:
+        kwargs["languages"] = languages
     sm.state.update_task(
         task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
     )
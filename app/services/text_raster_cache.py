@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.services.segment_cache import evict_lru
+from app.utils import utils
+
+
+class TextRasterCache:
+    """
+    LRU cache of rendered subtitle bitmaps (rgb and alpha as uint8), shared by every
+    task in the process. entries are keyed by the text and everything that changes
+    how it is drawn. an optional disk tier keeps bitmaps across restarts, its least
+    recently used files are evicted once it grows past max_disk_size_mb.
+    """
+
+    def __init__(self, max_size_mb: int = 256, cache_dir: str = "", max_disk_size_mb: int = 1024):
+        self.max_size = int(max_size_mb) * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.max_disk_size = int(max_disk_size_mb) * 1024 * 1024
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        text: str,
+        font_path: str,
+        font_size: int,
+        color,
+        bg_color,
+        stroke_color,
+        stroke_width,
+        wrap_width: int,
+    ) -> str:
+        parts = [
+            text,
+            font_path,
+            str(font_size),
+            str(color),
+            str(bg_color),
+            str(stroke_color),
+            str(stroke_width),
+            str(int(wrap_width)),
+        ]
+        return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir:
+            try:
+                disk_path = self._disk_path(key)
+                with np.load(disk_path) as data:
+                    entry = (data["rgb"], data["alpha"])
+                # bump the mtime, it is the recency used for eviction
+                os.utime(disk_path)
+                with self._lock:
+                    self.disk_hits += 1
+                self._add(key, entry)
+                return entry
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"failed to load cached subtitle bitmap: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, rgb: np.ndarray, alpha: np.ndarray):
+        entry = (rgb, alpha)
+        self._add(key, entry)
+
+        if self.cache_dir:
+            # written through a file object, np.savez would append .npz to the name
+            temp_path = f"{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(temp_path, "wb") as f:
+                    np.savez(f, rgb=rgb, alpha=alpha)
+                os.replace(temp_path, self._disk_path(key))
+            except Exception as e:
+                logger.warning(f"failed to save subtitle bitmap: {str(e)}")
+                try:
+                    os.remove(temp_path)
+                except Exception:
+                    pass
+                return
+            evict_lru(self.cache_dir, self.max_disk_size, ".npz")
+
+    def _add(self, key: str, entry):
+        size = entry[0].nbytes + entry[1].nbytes
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, (rgb, alpha) = self._entries.popitem(last=False)
+                self._size -= rgb.nbytes + alpha.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._size / 1024 / 1024, 2),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+            }
+
+
+text_raster_cache = TextRasterCache(
+    max_size_mb=config.app.get("text_raster_cache_max_size_mb", 256),
+    cache_dir=utils.storage_dir("cache_subtitles")
+    if config.app.get("text_raster_cache_disk", False)
+    else "",
+    max_disk_size_mb=config.app.get("text_raster_cache_disk_max_size_mb", 1024),
+)
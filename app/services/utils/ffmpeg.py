@@ -0,0 +1,256 @@
+import os
+import shutil
+import subprocess
+from typing import List, Tuple
+
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from app.config import config
+
+
+def get_ffprobe_binary() -> str:
+    ffprobe_path = config.app.get("ffprobe_path", "")
+    if ffprobe_path and os.path.isfile(ffprobe_path):
+        return ffprobe_path
+
+    # imageio-ffmpeg only ships ffmpeg, look for ffprobe next to it or on the PATH
+    sibling = os.path.join(os.path.dirname(FFMPEG_BINARY), "ffprobe")
+    if os.name == "nt":
+        sibling += ".exe"
+    if os.path.isfile(sibling):
+        return sibling
+    return shutil.which("ffprobe") or ""
+
+
+def run(args: List[str]) -> bool:
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *args]
+    logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+    try:
+        result = subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+    except Exception as e:
+        logger.error(f"failed to run ffmpeg: {str(e)}")
+        return False
+
+    if result.returncode != 0:
+        logger.warning(
+            f"ffmpeg exited with code {result.returncode}: {result.stderr.decode('utf-8', errors='ignore').strip()}"
+        )
+        return False
+    return True
+
+
+def concat_copy(clip_files: List[str], output_file: str) -> bool:
+    """
+    join clips that share codec, fps and resolution in a single pass with the
+    concat demuxer, copying the video stream instead of re-encoding it
+    """
+    if not clip_files:
+        return False
+
+    list_file = f"{output_file}.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        for clip_file in clip_files:
+            # the concat demuxer resolves relative paths against the list file
+            clip_file = os.path.abspath(clip_file).replace("\\", "/").replace("'", r"'\''")
+            f.write(f"file '{clip_file}'\n")
+
+    try:
+        ok = run(
+            [
+                "-f", "concat",
+                "-safe", "0",
+                "-i", list_file,
+                "-map", "0:v",
+                "-c", "copy",
+                "-an",
+                "-movflags", "+faststart",
+                output_file,
+            ]
+        )
+    finally:
+        try:
+            os.remove(list_file)
+        except Exception:
+            pass
+
+    if ok and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        return True
+    return False
+
+
+def mux_audio(video_file: str, audio_file: str, output_file: str) -> bool:
+    """
+    copies the video stream of video_file and the audio stream of audio_file into
+    output_file, cut to the shorter of the two
+    """
+    ok = run(
+        [
+            "-i", video_file,
+            "-i", audio_file,
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-c", "copy",
+            "-shortest",
+            "-movflags", "+faststart",
+            output_file,
+        ]
+    )
+    return ok and os.path.exists(output_file) and os.path.getsize(output_file) > 0
+
+
+# ISO 639-1 => ISO 639-2, mp4 language tags use the three letter codes
+_LANGUAGE_CODES = {
+    "ar": "ara",
+    "de": "deu",
+    "en": "eng",
+    "es": "spa",
+    "fr": "fra",
+    "hi": "hin",
+    "id": "ind",
+    "it": "ita",
+    "ja": "jpn",
+    "ko": "kor",
+    "nl": "nld",
+    "pl": "pol",
+    "pt": "por",
+    "ru": "rus",
+    "th": "tha",
+    "tr": "tur",
+    "uk": "ukr",
+    "vi": "vie",
+    "zh": "zho",
+}
+
+
+def get_language_code(language: str) -> str:
+    language = (language or "").split("-")[0].split("_")[0].lower()
+    if len(language) == 3:
+        return language
+    return _LANGUAGE_CODES.get(language, "und")
+
+
+def mux_tracks(
+    video_file: str,
+    audio_tracks: List[Tuple[str, str]],
+    subtitle_tracks: List[Tuple[str, str]],
+    output_file: str,
+    duration: float = None,
+) -> bool:
+    """
+    copies the video stream of video_file and adds one audio stream per (file, language)
+    in audio_tracks and one mov_text stream per (file, language) in subtitle_tracks,
+    the first track of each kind is the default one. without audio_tracks the audio of
+    video_file is kept.
+    """
+    args = ["-i", video_file]
+    for file, _ in audio_tracks + subtitle_tracks:
+        args += ["-i", file]
+
+    args += ["-map", "0:v:0"]
+    if not audio_tracks:
+        args += ["-map", "0:a?"]
+    for i in range(len(audio_tracks)):
+        args += ["-map", f"{i + 1}:a:0"]
+    for i in range(len(subtitle_tracks)):
+        args += ["-map", f"{len(audio_tracks) + i + 1}:s:0"]
+
+    args += ["-c:v", "copy", "-c:a", "copy", "-c:s", "mov_text"]
+    for kind, tracks in (("a", audio_tracks), ("s", subtitle_tracks)):
+        for i, (_, language) in enumerate(tracks):
+            args += [
+                f"-metadata:s:{kind}:{i}", f"language={get_language_code(language)}",
+                f"-disposition:{kind}:{i}", "default" if i == 0 else "0",
+            ]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    args += ["-movflags", "+faststart", output_file]
+
+    ok = run(args)
+    return ok and os.path.exists(output_file) and os.path.getsize(output_file) > 0
+
+
+def convert_subtitle(subtitle_file: str, output_file: str) -> bool:
+    """
+    converts between subtitle formats by extension, e.g. srt to vtt
+    """
+    return run(["-i", subtitle_file, output_file])
+
+
+def measure_loudness(file_path: str):
+    """
+    integrated loudness of the audio in file_path in LUFS (EBU R128), or None if it
+    can't be measured
+    """
+    cmd = [
+        FFMPEG_BINARY,
+        "-hide_banner",
+        "-nostats",
+        "-i", file_path,
+        "-vn",
+        "-af", "ebur128",
+        "-f", "null",
+        "-",
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except Exception as e:
+        logger.warning(f"failed to run ffmpeg: {str(e)}")
+        return None
+
+    # the summary at the end of the log holds the integrated loudness, e.g. "I: -14.2 LUFS"
+    loudness = None
+    for line in result.stderr.decode("utf-8", errors="ignore").splitlines():
+        line = line.strip()
+        if line.startswith("I:") and line.endswith("LUFS"):
+            try:
+                loudness = float(line[2:-4].strip())
+            except ValueError:
+                continue
+    return loudness
+
+
+def parse_infos(file_path: str) -> dict:
+    """
+    reads the container header with `ffmpeg -i`, without decoding any frame
+    """
+    return ffmpeg_parse_infos(file_path, check_duration=True, decode_file=False)
+
+
+def probe_keyframe_interval(file_path: str, scan_seconds: int = 30):
+    """
+    returns the average distance in seconds between keyframes in the first scan_seconds,
+    or None when ffprobe is not available
+    """
+    ffprobe = get_ffprobe_binary()
+    if not ffprobe:
+        return None
+
+    cmd = [
+        ffprobe,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-skip_frame", "nokey",
+        "-show_entries", "frame=pts_time",
+        "-read_intervals", f"%+{scan_seconds}",
+        "-of", "csv=p=0",
+        file_path,
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception as e:
+        logger.warning(f"failed to run ffprobe: {str(e)}")
+        return None
+
+    times = []
+    for line in result.stdout.decode("utf-8", errors="ignore").splitlines():
+        try:
+            times.append(float(line.strip().strip(",")))
+        except ValueError:
+            continue
+    if len(times) < 2:
+        return None
+    return (times[-1] - times[0]) / (len(times) - 1)
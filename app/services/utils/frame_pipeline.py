@@ -0,0 +1,291 @@
+import multiprocessing
+import queue
+import subprocess
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+
+# how long a stage blocks on the ring before checking whether another stage failed
+_poll_interval = 0.5
+
+
+def available() -> bool:
+    # stages are forked so they can run closures such as the subtitle rasterizer
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+class FrameRing:
+    """
+    preallocated rgb24 frames in shared memory, passed through the stages in order.
+    frame i lives in slot i % slots, and each stage hands a slot to the next one with a
+    semaphore, so the pixels are never pickled or copied between processes. the last
+    stage hands the slot back to the first one.
+    """
+
+    def __init__(self, ctx, slots: int, width: int, height: int, stages: int):
+        self.slots = slots
+        self.shape = (height, width, 3)
+        self.frame_size = width * height * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=self.frame_size * slots)
+        # ready[i] counts the slots stage i may take, the first stage starts with all of them
+        self.ready = [ctx.Semaphore(slots if i == 0 else 0) for i in range(stages)]
+        self.abort = ctx.Event()
+
+    def frame(self, slot: int) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.frame_size)
+
+    def take(self, stage: int):
+        while not self.ready[stage].acquire(timeout=_poll_interval):
+            if self.abort.is_set():
+                raise InterruptedError("pipeline aborted")
+
+    def give(self, stage: int):
+        self.ready[(stage + 1) % len(self.ready)].release()
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FileSource:
+    """
+    decodes a video file with ffmpeg straight into the ring slots. ffmpeg keeps repeating
+    the last frame past the end of the file, like a clip does
+    """
+
+    name = "decode"
+
+    def __init__(self, file_path: str, width: int, height: int, fps: float):
+        self.file_path = file_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.proc = None
+
+    def open(self):
+        cmd = [
+            FFMPEG_BINARY,
+            "-loglevel", "error",
+            "-i", self.file_path,
+            # the slots are drawn on downstream, so the padding can't be copied from them
+            "-vf", f"scale={self.width}:{self.height},tpad=stop_mode=clone:stop=-1",
+            "-r", str(self.fps),
+            "-f", "rawvideo",
+            "-pix_fmt", "rgb24",
+            "-",
+        ]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+    def __call__(self, frame: np.ndarray, index: int):
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < len(view):
+            n = self.proc.stdout.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled < len(view):
+            raise ValueError(f"no frames decoded from {self.file_path}")
+
+    def close(self):
+        if self.proc:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ClipSource:
+    """
+    renders the frames of a moviepy clip, whose readers decode in their own ffmpeg processes
+    """
+
+    name = "source"
+
+    def __init__(self, get_frame, fps: float, start_frame: int = 0):
+        self.get_frame = get_frame
+        self.fps = fps
+        self.start_frame = start_frame
+
+    def open(self):
+        pass
+
+    def __call__(self, frame: np.ndarray, index: int):
+        np.copyto(frame, self.get_frame((self.start_frame + index) / self.fps)[:, :, :3])
+
+    def close(self):
+        pass
+
+
+class Compositor:
+    """
+    draws on the frames in place, composite(frame, t)
+    """
+
+    name = "composite"
+
+    def __init__(self, composite, fps: float, start_frame: int = 0):
+        self.composite = composite
+        self.fps = fps
+        self.start_frame = start_frame
+
+    def open(self):
+        pass
+
+    def __call__(self, frame: np.ndarray, index: int):
+        self.composite(frame, (self.start_frame + index) / self.fps)
+
+    def close(self):
+        pass
+
+
+class Encoder:
+    """
+    feeds the frames to an ffmpeg encoder process
+    """
+
+    name = "encode"
+
+    def __init__(
+        self,
+        output_file: str,
+        width: int,
+        height: int,
+        fps: float,
+        codec: str = "libx264",
+        threads: int = 2,
+        ffmpeg_params: list = None,
+    ):
+        self.output_file = output_file
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.threads = threads
+        self.ffmpeg_params = ffmpeg_params or []
+        self.proc = None
+
+    def open(self):
+        cmd = [
+            FFMPEG_BINARY,
+            "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-pix_fmt", "rgb24",
+            "-s", f"{self.width}x{self.height}",
+            "-r", str(self.fps),
+            "-i", "-",
+            "-an",
+            "-c:v", self.codec,
+            "-preset", "medium",
+            "-pix_fmt", "yuv420p",
+            "-threads", str(self.threads),
+            *self.ffmpeg_params,
+            self.output_file,
+        ]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def __call__(self, frame: np.ndarray, index: int):
+        self.proc.stdin.write(memoryview(frame).cast("B"))
+
+    def close(self):
+        if not self.proc:
+            return
+        self.proc.stdin.close()
+        stderr = self.proc.stderr.read()
+        if self.proc.wait() != 0:
+            raise ValueError(f"ffmpeg failed to encode {self.output_file}: {stderr.decode('utf-8', errors='ignore').strip()}")
+
+
+def _run_stage(ring: FrameRing, index: int, stage, frames: int, results):
+    busy = 0.0
+    waited = 0.0
+    error = ""
+    try:
+        stage.open()
+        try:
+            for i in range(frames):
+                started = time.perf_counter()
+                ring.take(index)
+                taken = time.perf_counter()
+                stage(ring.frame(i % ring.slots), i)
+                ring.give(index)
+                waited += taken - started
+                busy += time.perf_counter() - taken
+        finally:
+            stage.close()
+    except Exception as e:
+        ring.abort.set()
+        error = str(e)
+    results.put((index, stage.name, busy, waited, error))
+
+
+def _collect_reports(ring: FrameRing, processes: list, stages: list, results) -> list:
+    """
+    waits for the report of every stage. a stage that was killed (e.g. out of memory or
+    a crashing decoder) never reports, so the others are stopped and the run fails
+    """
+    reports = []
+    while len(reports) < len(processes):
+        try:
+            reports.append(results.get(timeout=_poll_interval))
+            continue
+        except queue.Empty:
+            pass
+
+        # a stage that exits normally has always sent its report
+        dead = [
+            f"{stage.name} (exit code {process.exitcode})"
+            for process, stage in zip(processes, stages)
+            if process.exitcode not in (None, 0)
+        ]
+        if dead:
+            ring.abort.set()
+            for process in processes:
+                process.join(timeout=_poll_interval * 4)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            raise ValueError(f"frame pipeline failed: {', '.join(dead)} died")
+    return reports
+
+
+def run(stages: list, frames: int, width: int, height: int, slots: int = 8) -> dict:
+    """
+    runs the stages, each in its own process, over `frames` frames that flow through a
+    FrameRing. the first stage fills a slot, the following ones work on it in place.
+    returns the throughput of each stage, raises if any stage fails
+    """
+    ctx = multiprocessing.get_context("fork")
+    ring = FrameRing(ctx, slots=slots, width=width, height=height, stages=len(stages))
+    results = ctx.Queue()
+    started = time.perf_counter()
+    try:
+        processes = [
+            ctx.Process(target=_run_stage, args=(ring, index, stage, frames, results), daemon=True)
+            for index, stage in enumerate(stages)
+        ]
+        for process in processes:
+            process.start()
+        reports = _collect_reports(ring, processes, stages, results)
+        for process in processes:
+            process.join()
+    finally:
+        ring.close()
+    elapsed = time.perf_counter() - started
+
+    stats = {"frames": frames, "elapsed": round(elapsed, 2), "fps": round(frames / elapsed, 2) if elapsed else 0.0}
+    errors = []
+    for index, name, busy, waited, error in sorted(reports):
+        stats[name] = {
+            "fps": round(frames / busy, 2) if busy else 0.0,
+            "busy": round(busy, 2),
+            "waited": round(waited, 2),
+        }
+        if error:
+            errors.append(f"{name}: {error}")
+    if errors:
+        raise ValueError(f"frame pipeline failed: {'; '.join(errors)}")
+    logger.info(f"frame pipeline stats: {stats}")
+    return stats
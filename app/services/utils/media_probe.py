@@ -0,0 +1,307 @@
+"""
+pure-python readers for the MP4 and MP3 headers, used to get the duration, size
+and frame rate of a file without spawning an ffmpeg process.
+every function returns None for files it does not understand, so callers can
+fall back to ffmpeg.
+"""
+
+import os
+import struct
+
+# sample entry fourcc => ffmpeg codec name
+_MP4_CODECS = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hvc1": "hevc",
+    "hev1": "hevc",
+    "mp4v": "mpeg4",
+    "vp09": "vp9",
+    "av01": "av1",
+}
+
+
+def probe(file_path: str):
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(12)
+            if len(head) < 12:
+                return None
+            f.seek(0)
+            if head[4:8] == b"ftyp" or ext in (".mp4", ".mov", ".m4a"):
+                return probe_mp4(f)
+            if head[:3] == b"ID3" or ext == ".mp3" or (head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+                return probe_mp3(f, os.path.getsize(file_path))
+    except (OSError, struct.error, ValueError, ZeroDivisionError):
+        return None
+    return None
+
+
+# MP4
+
+
+def _iter_boxes(f, start: int, end: int):
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find_box(f, start: int, end: int, box_type: bytes):
+    for t, body_start, body_end in _iter_boxes(f, start, end):
+        if t == box_type:
+            return body_start, body_end
+    return None
+
+
+def _read_box(f, box):
+    f.seek(box[0])
+    return f.read(box[1] - box[0])
+
+
+def _parse_mvhd(data: bytes):
+    version = data[0]
+    if version == 1:
+        timescale, duration = struct.unpack(">IQ", data[20:32])
+    else:
+        timescale, duration = struct.unpack(">II", data[12:20])
+    return timescale, duration
+
+
+def _parse_tkhd(data: bytes):
+    version = data[0]
+    matrix_offset = 52 if version == 1 else 40
+    a, b = struct.unpack(">ii", data[matrix_offset:matrix_offset + 8])
+    width, height = struct.unpack(">II", data[matrix_offset + 36:matrix_offset + 44])
+    width, height = width >> 16, height >> 16
+    # a rotation of 90 or 270 degrees swaps the displayed width and height
+    if a == 0 and b != 0:
+        width, height = height, width
+    return width, height
+
+
+def _parse_stts(data: bytes):
+    entry_count = struct.unpack(">I", data[4:8])[0]
+    sample_count = 0
+    for i in range(entry_count):
+        count, _ = struct.unpack(">II", data[8 + i * 8:16 + i * 8])
+        sample_count += count
+    return sample_count
+
+
+def _parse_stss(data: bytes, limit: int = 64):
+    entry_count = struct.unpack(">I", data[4:8])[0]
+    entry_count = min(entry_count, limit)
+    return [struct.unpack(">I", data[8 + i * 4:12 + i * 4])[0] for i in range(entry_count)]
+
+
+def _parse_trak(f, start: int, end: int):
+    tkhd = _find_box(f, start, end, b"tkhd")
+    mdia = _find_box(f, start, end, b"mdia")
+    if not tkhd or not mdia:
+        return None
+
+    hdlr = _find_box(f, mdia[0], mdia[1], b"hdlr")
+    mdhd = _find_box(f, mdia[0], mdia[1], b"mdhd")
+    if not hdlr or not mdhd:
+        return None
+
+    track = {"handler": _read_box(f, hdlr)[8:12]}
+    timescale, duration = _parse_mvhd(_read_box(f, mdhd))
+    track["duration"] = duration / timescale if timescale else 0.0
+    if track["handler"] != b"vide":
+        return track
+
+    track["width"], track["height"] = _parse_tkhd(_read_box(f, tkhd))
+    minf = _find_box(f, mdia[0], mdia[1], b"minf")
+    stbl = _find_box(f, minf[0], minf[1], b"stbl") if minf else None
+    if not stbl:
+        return track
+
+    stsd = _find_box(f, stbl[0], stbl[1], b"stsd")
+    if stsd:
+        # the fourcc of the first sample entry, e.g. avc1 or hvc1
+        fourcc = _read_box(f, stsd)[12:16].decode("ascii", errors="ignore").strip()
+        track["codec"] = _MP4_CODECS.get(fourcc, fourcc)
+
+    stts = _find_box(f, stbl[0], stbl[1], b"stts")
+    if stts and track["duration"]:
+        sample_count = _parse_stts(_read_box(f, stts))
+        track["fps"] = round(sample_count / track["duration"], 3)
+
+    stss = _find_box(f, stbl[0], stbl[1], b"stss")
+    fps = track.get("fps")
+    if fps:
+        if stss:
+            # sync sample numbers of the first keyframes
+            keyframes = _parse_stss(_read_box(f, stss))
+            if len(keyframes) > 1:
+                track["keyframe_interval"] = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1) / fps
+        else:
+            # without an stss box every sample is a keyframe
+            track["keyframe_interval"] = 1 / fps
+    return track
+
+
+def probe_mp4(f):
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    moov = _find_box(f, 0, file_size, b"moov")
+    if not moov:
+        return None
+
+    mvhd = _find_box(f, moov[0], moov[1], b"mvhd")
+    if not mvhd:
+        return None
+    timescale, duration = _parse_mvhd(_read_box(f, mvhd))
+    if not timescale or not duration:
+        # fragmented files keep the duration in the fragments
+        return None
+
+    info = {
+        "duration": duration / timescale,
+        "width": 0,
+        "height": 0,
+        "fps": 0.0,
+        "codec": "",
+        "keyframe_interval": None,
+        "has_video": False,
+        "has_audio": False,
+    }
+    for box_type, start, end in _iter_boxes(f, moov[0], moov[1]):
+        if box_type != b"trak":
+            continue
+        track = _parse_trak(f, start, end)
+        if not track:
+            continue
+        if track["handler"] == b"soun":
+            info["has_audio"] = True
+        elif track["handler"] == b"vide" and not info["has_video"]:
+            info["has_video"] = True
+            info["width"] = track.get("width", 0)
+            info["height"] = track.get("height", 0)
+            info["fps"] = track.get("fps", 0.0)
+            info["codec"] = track.get("codec", "")
+            info["keyframe_interval"] = track.get("keyframe_interval")
+
+    if info["has_video"] and not (info["width"] and info["height"] and info["fps"]):
+        return None
+    return info
+
+
+# MP3
+
+_MP3_BITRATES = {
+    # (mpeg version 1, layer): kbps by index
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+
+def _parse_mp3_header(header: bytes):
+    b1, b2, b3 = header[1], header[2], header[3]
+    if header[0] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((b1 >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 3 and version != 1:
+        samples_per_frame = 576
+    else:
+        samples_per_frame = 1152
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples_per_frame": samples_per_frame,
+        "mono": (b3 >> 6) == 3,
+    }
+
+
+def probe_mp3(f, file_size: int):
+    audio_start = 0
+    header = f.read(10)
+    if header[:3] == b"ID3":
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        audio_start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+
+    # look for the first frame sync in the first 64KB after the tag
+    f.seek(audio_start)
+    data = f.read(65536)
+    frame = None
+    for i in range(len(data) - 4):
+        if data[i] == 0xFF and data[i + 1] & 0xE0 == 0xE0:
+            frame = _parse_mp3_header(data[i:i + 4])
+            if frame:
+                audio_start += i
+                data = data[i:]
+                break
+    if not frame:
+        return None
+
+    audio_end = file_size
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b"TAG":
+        audio_end -= 128
+
+    if frame["version"] == 1:
+        side_info = 17 if frame["mono"] else 32
+    else:
+        side_info = 9 if frame["mono"] else 17
+
+    frames = None
+    xing = data[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", xing[4:8])[0]
+        if flags & 0x01:
+            frames = struct.unpack(">I", xing[8:12])[0]
+    elif data[36:40] == b"VBRI":
+        frames = struct.unpack(">I", data[50:54])[0]
+
+    if frames:
+        duration = frames * frame["samples_per_frame"] / frame["sample_rate"]
+    else:
+        # constant bitrate
+        duration = (audio_end - audio_start) * 8 / frame["bitrate"]
+
+    return {
+        "duration": duration,
+        "width": 0,
+        "height": 0,
+        "fps": 0.0,
+        "codec": "mp3",
+        "keyframe_interval": None,
+        "has_video": False,
+        "has_audio": True,
+    }
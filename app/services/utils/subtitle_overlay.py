@@ -0,0 +1,183 @@
+import bisect
+
+import numpy as np
+from moviepy import Clip
+
+
+class SubtitleBitmap:
+    """
+    one subtitle line rasterized once: premultiplied rgb and inverse alpha, already
+    cropped to the part of the bitmap that falls inside the video frame
+    """
+
+    def __init__(self, x: int, y: int, rgb: np.ndarray, alpha: np.ndarray):
+        self.x = x
+        self.y = y
+        alpha = alpha.astype(np.float32)[:, :, None]
+        self.premultiplied = rgb[:, :, :3].astype(np.float32) * alpha
+        self.inverse_alpha = 1.0 - alpha
+
+    @property
+    def h(self):
+        return self.premultiplied.shape[0]
+
+    @property
+    def w(self):
+        return self.premultiplied.shape[1]
+
+
+class SubtitleOverlay:
+    """
+    blends subtitle lines onto video frames. the active lines for a frame are found
+    with a binary search over the start times instead of scanning every line, and
+    only each line's bounding box is blended.
+
+    lines are rasterized lazily: rasterize(text) is called when the frame time gets
+    within `lookahead` seconds of a line's start, and the bitmap is dropped once the
+    line has ended. memory therefore depends on how many lines are near the playhead,
+    not on the length of the script.
+    """
+
+    def __init__(self, video_width: int, video_height: int, rasterize, lookahead: float = 2.0):
+        self.video_width = video_width
+        self.video_height = video_height
+        # rasterize(text) => (x, y, rgb, alpha), alpha as uint8 or float in [0, 1]
+        self.rasterize = rasterize
+        self.lookahead = lookahead
+        self.lines = []
+        self._starts = []
+        self._max_ends = None
+        # line index => SubtitleBitmap, or None for lines that fall outside the frame
+        self._bitmaps = {}
+
+    def add(self, start: float, end: float, text: str):
+        if end <= start:
+            return
+        index = bisect.bisect_right(self._starts, start)
+        self.lines.insert(index, (start, end, text))
+        self._starts.insert(index, start)
+        self._max_ends = None
+        self._bitmaps = {}
+
+    def _lines_between(self, t: float, until: float):
+        """
+        indexes of the lines that start before `until` and are still playing at t
+        """
+        # lines are sorted by start, walk back from the last line that has started
+        # while an earlier line could still be playing
+        if self._max_ends is None:
+            self._max_ends = np.maximum.accumulate([line[1] for line in self.lines])
+        index = bisect.bisect_right(self._starts, until) - 1
+        indexes = []
+        while index >= 0 and self._max_ends[index] > t:
+            if self.lines[index][1] > t:
+                indexes.append(index)
+            index -= 1
+        indexes.reverse()
+        return indexes
+
+    def _make_bitmap(self, text: str):
+        x, y, rgb, alpha = self.rasterize(text)
+        x, y = int(x), int(y)
+        h, w = rgb.shape[:2]
+        if alpha is None:
+            alpha = np.ones((h, w), dtype=np.float32)
+        elif alpha.dtype == np.uint8:
+            alpha = alpha.astype(np.float32) / 255
+
+        # crop the bitmap to the frame
+        left, top = max(0, -x), max(0, -y)
+        right = min(w, self.video_width - x)
+        bottom = min(h, self.video_height - y)
+        if right <= left or bottom <= top:
+            return None
+
+        return SubtitleBitmap(
+            x=x + left,
+            y=y + top,
+            rgb=rgb[top:bottom, left:right],
+            alpha=alpha[top:bottom, left:right],
+        )
+
+    def active(self, t: float):
+        """
+        the bitmaps to draw at t. lines inside the lookahead window are materialized,
+        everything outside of it is released.
+        """
+        window = self._lines_between(t, t + self.lookahead)
+        bitmaps = {}
+        for index in window:
+            if index in self._bitmaps:
+                bitmaps[index] = self._bitmaps[index]
+            else:
+                bitmaps[index] = self._make_bitmap(self.lines[index][2])
+        self._bitmaps = bitmaps
+
+        return [
+            bitmaps[index]
+            for index in window
+            if self.lines[index][0] <= t and bitmaps[index] is not None
+        ]
+
+    def blend(self, frame: np.ndarray, t: float) -> np.ndarray:
+        active = self.active(t)
+        if not active:
+            return frame
+
+        # frames from readers are read-only and may be reused, so draw on a copy
+        frame = frame.copy()
+        self._draw(frame, active)
+        return frame
+
+    def draw(self, frame: np.ndarray, t: float):
+        """
+        draws the lines active at t on a writable frame in place
+        """
+        self._draw(frame, self.active(t))
+
+    def _draw(self, frame: np.ndarray, active):
+        for bitmap in active:
+            region = frame[bitmap.y:bitmap.y + bitmap.h, bitmap.x:bitmap.x + bitmap.w]
+            blended = region.astype(np.float32)
+            blended *= bitmap.inverse_alpha
+            blended += bitmap.premultiplied
+            region[...] = blended
+
+    def segments(self, duration: float):
+        """
+        the overlay as full-frame images for renderers that composite it themselves:
+        yields (start, end, rgba) for every span in which the same lines are shown,
+        with straight alpha, or None as rgba where no line is shown
+        """
+        times = {0.0, duration}
+        for start, end, _ in self.lines:
+            times.update(t for t in (start, end) if 0 < t < duration)
+        times = sorted(times)
+
+        premultiplied = np.zeros((self.video_height, self.video_width, 3), dtype=np.float32)
+        alpha = np.zeros((self.video_height, self.video_width, 1), dtype=np.float32)
+        for start, end in zip(times, times[1:]):
+            active = self.active(start)
+            if not active:
+                yield start, end, None
+                continue
+
+            premultiplied.fill(0)
+            alpha.fill(0)
+            for bitmap in active:
+                box = (slice(bitmap.y, bitmap.y + bitmap.h), slice(bitmap.x, bitmap.x + bitmap.w))
+                premultiplied[box] *= bitmap.inverse_alpha
+                premultiplied[box] += bitmap.premultiplied
+                alpha[box] *= bitmap.inverse_alpha
+                alpha[box] += 1.0 - bitmap.inverse_alpha
+
+            rgba = np.zeros((self.video_height, self.video_width, 4), dtype=np.uint8)
+            visible = alpha[:, :, 0] > 0
+            rgba[visible, :3] = np.clip(premultiplied[visible] / alpha[visible], 0, 255)
+            rgba[:, :, 3] = np.round(alpha[:, :, 0] * 255)
+            yield start, end, rgba
+
+    def apply(self, clip: Clip) -> Clip:
+        if not self.lines:
+            return clip
+        return clip.transform(lambda get_frame, t: self.blend(get_frame(t), t))
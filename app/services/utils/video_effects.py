@@ -1,21 +1,224 @@
-from moviepy import Clip, vfx
+import bisect
+from typing import List
+
+import numpy as np
+from moviepy import Clip, VideoClip
+from PIL import Image
+
+# ramps hold fixed point weights in 1/256 steps, so a uint8 frame is scaled with one
+# integer multiply and a shift
+_weight_one = 256
+_default_fps = 30
+
+
+def _frame_index(t: float, fps: float) -> int:
+    return int(round(t * fps))
+
+
+def fade_ramp(duration: float, fps: float, fade_in: bool = True) -> np.ndarray:
+    """
+    weights (0-256) for each frame of a fade of `duration` seconds
+    """
+    frames = max(1, _frame_index(duration, fps))
+    progress = np.arange(frames) / (duration * fps)
+    if not fade_in:
+        progress = 1.0 - progress
+    return np.clip(np.round(progress * _weight_one), 0, _weight_one).astype(np.uint16)
+
+
+def slide_ramp(duration: float, fps: float, distance: int, slide_in: bool = True) -> np.ndarray:
+    """
+    pixel offsets for each frame of a slide of `duration` seconds, from `distance`
+    to 0 when sliding in and from 0 to `distance` when sliding out
+    """
+    frames = max(1, _frame_index(duration, fps))
+    progress = np.minimum(np.arange(frames) / (duration * fps), 1.0)
+    if slide_in:
+        progress = 1.0 - progress
+    return np.round(progress * distance).astype(np.int64)
+
+
+def _fade(clip: Clip, weights: np.ndarray, start: float) -> Clip:
+    fps = clip.fps or _default_fps
+    buffers = {}
+
+    def filter(get_frame, t):
+        frame = get_frame(t)
+        index = _frame_index(t - start, fps)
+        if index < 0 or index >= len(weights):
+            return frame
+
+        frame = frame[:, :, :3]
+        if frame.shape not in buffers:
+            buffers[frame.shape] = (
+                np.empty(frame.shape, dtype=np.uint16),
+                np.empty(frame.shape, dtype=np.uint8),
+            )
+        scaled, buffer = buffers[frame.shape]
+        np.multiply(frame, weights[index], out=scaled, dtype=np.uint16)
+        np.right_shift(scaled, 8, out=scaled)
+        np.copyto(buffer, scaled, casting="unsafe")
+        return buffer
+
+    return clip.transform(filter)
+
+
+def _shift_frame(frame: np.ndarray, dx: int, dy: int, buffer: np.ndarray) -> np.ndarray:
+    h, w = frame.shape[:2]
+    buffer.fill(0)
+    if abs(dx) >= w or abs(dy) >= h:
+        return buffer
+    buffer[max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)] = frame[
+        max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx), :3
+    ]
+    return buffer
+
+
+def _slide(clip: Clip, offsets: np.ndarray, start: float, side: str) -> Clip:
+    fps = clip.fps or _default_fps
+    # the sign turns an offset into a move towards `side`
+    sign_x, sign_y = {
+        "left": (-1, 0),
+        "right": (1, 0),
+        "top": (0, -1),
+        "bottom": (0, 1),
+    }[side]
+    buffers = {}
+
+    def filter(get_frame, t):
+        frame = get_frame(t)
+        index = _frame_index(t - start, fps)
+        if index < 0 or index >= len(offsets):
+            return frame
+
+        buffer = buffers.get(frame.shape[:2])
+        if buffer is None:
+            buffer = buffers[frame.shape[:2]] = np.empty((*frame.shape[:2], 3), dtype=np.uint8)
+        offset = int(offsets[index])
+        return _shift_frame(frame, sign_x * offset, sign_y * offset, buffer)
+
+    return clip.transform(filter)
 
 
 # FadeIn
 def fadein_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeIn(t)])
+    return _fade(clip, fade_ramp(t, clip.fps or _default_fps), start=0)
 
 
 # FadeOut
 def fadeout_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeOut(t)])
+    fps = clip.fps or _default_fps
+    # the ramp ends just after the clip's last frame
+    weights = fade_ramp(t, fps, fade_in=False)
+    start = clip.duration - len(weights) / fps
+    return _fade(clip, weights, start=start)
 
 
 # SlideIn
 def slidein_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideIn(t, side)])
+    w, h = clip.size
+    distance = w if side in ("left", "right") else h
+    return _slide(clip, slide_ramp(t, clip.fps or _default_fps, distance), start=0, side=side)
 
 
 # SlideOut
 def slideout_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideOut(t, side)])
+    fps = clip.fps or _default_fps
+    w, h = clip.size
+    distance = w if side in ("left", "right") else h
+    offsets = slide_ramp(t, fps, distance, slide_in=False)
+    start = clip.duration - len(offsets) / fps
+    return _slide(clip, offsets, start=start, side=side)
+
+
+# Crossfade
+def crossfade_concat(clips: List[Clip], t: float, fps: float = None) -> Clip:
+    """
+    concatenates clips of the same size, each one fading into the next over t seconds.
+    adjacent clips overlap, so the result is t seconds shorter per join.
+    """
+    fps = fps or clips[0].fps or _default_fps
+    # a clip can't overlap more than it lasts
+    t = min([t] + [clip.duration for clip in clips])
+    starts = []
+    position = 0
+    for clip in clips:
+        starts.append(position)
+        position += clip.duration - t
+    duration = position + t
+    weights = fade_ramp(t, fps)
+
+    w, h = clips[0].size
+    outgoing = np.empty((h, w, 3), dtype=np.uint16)
+    incoming = np.empty((h, w, 3), dtype=np.uint16)
+    buffer = np.empty((h, w, 3), dtype=np.uint8)
+
+    def get_clip_frame(index, t):
+        clip = clips[index]
+        return clip.get_frame(min(t - starts[index], clip.duration))[:, :, :3]
+
+    def frame_function(t):
+        index = max(0, bisect.bisect_right(starts, t) - 1)
+        frame = get_clip_frame(index, t)
+        step = _frame_index(t - starts[index], fps)
+        if index == 0 or step >= len(weights):
+            return frame
+
+        weight = weights[step]
+        # scale the incoming frame before reading the outgoing one, a clip looped into
+        # itself returns both frames in the same reused buffer
+        np.multiply(frame, weight, out=incoming, dtype=np.uint16)
+        np.multiply(get_clip_frame(index - 1, t), _weight_one - weight, out=outgoing, dtype=np.uint16)
+        np.add(outgoing, incoming, out=outgoing)
+        np.right_shift(outgoing, 8, out=outgoing)
+        np.copyto(buffer, outgoing, casting="unsafe")
+        return buffer
+
+    return VideoClip(frame_function, duration=duration).with_fps(fps)
+
+
+# Letterbox
+def letterbox(clip: Clip, width: int, height: int) -> Clip:
+    """
+    centers the (already scaled) frames of clip on a black width x height frame.
+    the output frame is a buffer owned by the clip and reused for every frame,
+    only the borders are cleared again in case a later effect drew on them.
+    """
+    clip_w, clip_h = clip.size
+    x = (width - clip_w) // 2
+    y = (height - clip_h) // 2
+    buffer = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def pad(frame):
+        buffer[:y] = 0
+        buffer[y + clip_h:] = 0
+        buffer[y:y + clip_h, :x] = 0
+        buffer[y:y + clip_h, x + clip_w:] = 0
+        buffer[y:y + clip_h, x:x + clip_w] = frame[:, :, :3]
+        return buffer
+
+    return clip.image_transform(pad)
+
+
+# Ken Burns
+def ken_burns(image: Image.Image, width: int, height: int, duration: float, zoom: float) -> Clip:
+    """
+    a clip of `image` slowly zooming into its center, from the full image to 1/zoom of it.
+    the image is scaled once so the most zoomed-in frame is a 1:1 crop, every frame
+    is then a crop-and-resize of it into a width x height buffer.
+    """
+    src_w, src_h = round(width * zoom), round(height * zoom)
+    image = image.convert("RGB").resize((src_w, src_h), Image.LANCZOS)
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+    def frame_function(t):
+        scale = 1 + (zoom - 1) * min(max(t / duration, 0), 1)
+        crop_w, crop_h = src_w / scale, src_h / scale
+        x, y = (src_w - crop_w) / 2, (src_h - crop_h) / 2
+        frame = image.resize(
+            (width, height), Image.BILINEAR, box=(x, y, x + crop_w, y + crop_h)
+        )
+        buffer[...] = np.asarray(frame)
+        return buffer
+
+    return VideoClip(frame_function, duration=duration)
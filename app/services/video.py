@@ -1,55 +1,59 @@
-import glob
+import collections
+import functools
 import itertools
 import os
-import random
 import gc
 import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
 from typing import List
+import numpy as np
 from loguru import logger
 from moviepy import (
     AudioFileClip,
-    ColorClip,
     CompositeAudioClip,
-    CompositeVideoClip,
-    ImageClip,
     TextClip,
+    VideoClip,
     VideoFileClip,
     afx,
     concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
+from moviepy.video.tools.subtitles import file_to_subtitles
+from PIL import Image, ImageFont
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
+    Timeline,
+    TimelineClip,
     VideoAspect,
     VideoConcatMode,
     VideoParams,
     VideoTransitionMode,
 )
-from app.services.utils import video_effects
+from app.services import audio_mix, chunked_render, ffmpeg_render, pipelined_render
+from app.services.media_index import media_index, probe_media
+from app.services.planner import (
+    SubClippedVideoClip,
+    fps,
+    get_bgm_file,
+    get_bgm_volume,
+    get_clip_key,
+    get_fit_size,
+    get_timeline_items,
+    get_unique_clips,
+    has_subtitles,
+    plan_videos,
+)
+from app.services.segment_cache import image_clip_cache, segment_cache
+from app.services.text_raster_cache import text_raster_cache
+from app.services.utils import ffmpeg, subtitle_overlay, video_effects
 from app.utils import utils
 
-class SubClippedVideoClip:
-    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None):
-        self.file_path = file_path
-        self.start_time = start_time
-        self.end_time = end_time
-        self.width = width
-        self.height = height
-        if duration is None:
-            self.duration = end_time - start_time
-        else:
-            self.duration = duration
-
-    def __str__(self):
-        return f"SubClippedVideoClip(file_path={self.file_path}, start_time={self.start_time}, end_time={self.end_time}, duration={self.duration}, width={self.width}, height={self.height})"
-
 
 audio_codec = "aac"
 video_codec = "libx264"
-fps = 30
 
 def close_clip(clip):
     if clip is None:
@@ -98,20 +102,167 @@ def delete_files(files: List[str] | str):
         except:
             pass
 
-def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
-    if not bgm_type:
-        return ""
 
-    if bgm_file and os.path.exists(bgm_file):
-        return bgm_file
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(name: str, workers: int):
+    """
+    returns the process pool `name` shared by all tasks, started with `workers` processes
+    the first time it's asked for, or None when workers is not greater than 1
+    """
+    if workers <= 1:
+        return None
+
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            logger.info(f"starting {name} pool with {workers} worker processes")
+            pool = _pools[name] = ProcessPoolExecutor(max_workers=workers)
+    return pool
+
+
+def get_clip_pool():
+    """
+    returns the process pool shared by all tasks for subclip normalization,
+    or None when app.clip_workers is not greater than 1
+    """
+    return get_process_pool("clip", int(config.app.get("clip_workers", 1) or 1))
+
+
+def get_clip_workers_per_task():
+    workers = int(config.app.get("clip_workers", 1) or 1)
+    per_task = int(config.app.get("clip_workers_per_task", workers) or workers)
+    return max(1, min(workers, per_task))
+
+
+def submit_job(pool, fn, **kwargs) -> Future:
+    if pool is not None:
+        return pool.submit(fn, **kwargs)
+
+    # run in the calling thread, but keep the same interface as the pool
+    future = Future()
+    try:
+        future.set_result(fn(**kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def normalize_clip(
+        subclipped_item: SubClippedVideoClip,
+        clip_file: str,
+        video_width: int,
+        video_height: int,
+        transition: str = None,
+        side: str = "left",
+        max_clip_duration: int = 5,
+) -> SubClippedVideoClip:
+    """
+    resizes, letterboxes and applies the transition to one subclip, then writes it to clip_file.
+    runs in a clip pool worker process, so all arguments must be picklable.
+    """
+    clip = open_video_clip(
+        subclipped_item.file_path,
+        width=subclipped_item.width,
+        height=subclipped_item.height,
+        video_width=video_width,
+        video_height=video_height,
+    ).subclipped(subclipped_item.start_time, subclipped_item.end_time)
+    clip_w, clip_h = subclipped_item.width, subclipped_item.height
+    clip = build_normalized_clip(
+        clip,
+        video_width=video_width,
+        video_height=video_height,
+        transition=transition,
+        side=side,
+        max_clip_duration=max_clip_duration,
+    )
+
+    # wirte clip to temp file
+    write_clip_file(clip, clip_file)
+    duration = clip.duration
+    close_clip(clip)
+
+    return SubClippedVideoClip(file_path=clip_file, duration=duration, width=clip_w, height=clip_h)
+
+
+def write_clip_file(clip, clip_file: str):
+    # clip_file may be a hard link to a segment or image cache entry, so it is replaced
+    # instead of being written in place
+    temp_file = f"{clip_file}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+    try:
+        clip.write_videofile(temp_file, logger=None, fps=fps, codec=video_codec)
+        os.replace(temp_file, clip_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def open_video_clip(file_path: str, width: int, height: int, video_width: int, video_height: int):
+    """
+    opens a source video without its audio and lets ffmpeg scale the frames to fit the
+    target frame while decoding, so 4K sources never reach python at full resolution
+    """
+    target_resolution = None
+    if width and height and (width, height) != (video_width, video_height):
+        target_resolution = get_fit_size(width, height, video_width, video_height)
+    return VideoFileClip(file_path, audio=False, target_resolution=target_resolution)
+
+
+def build_normalized_clip(
+        clip,
+        video_width: int,
+        video_height: int,
+        transition: str = None,
+        side: str = "left",
+        max_clip_duration: int = 5,
+):
+    # Not all videos are same size, so we need to resize them.
+    # clips opened with open_video_clip are already scaled by ffmpeg and only need the letterbox
+    clip_w, clip_h = clip.size
+    if clip_w != video_width or clip_h != video_height:
+        new_width, new_height = get_fit_size(clip_w, clip_h, video_width, video_height)
+        logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, fit: {new_width}x{new_height}, target: {video_width}x{video_height}")
+
+        if (new_width, new_height) != (clip_w, clip_h):
+            clip = clip.resized(new_size=(new_width, new_height))
 
-    if bgm_type == "random":
-        suffix = "*.mp3"
-        song_dir = utils.song_dir()
-        files = glob.glob(os.path.join(song_dir, suffix))
-        return random.choice(files)
+        if (new_width, new_height) != (video_width, video_height):
+            clip = video_effects.letterbox(clip, video_width, video_height)
 
-    return ""
+    if transition == VideoTransitionMode.fade_in.value:
+        clip = video_effects.fadein_transition(clip, 1)
+    elif transition == VideoTransitionMode.fade_out.value:
+        clip = video_effects.fadeout_transition(clip, 1)
+    elif transition == VideoTransitionMode.slide_in.value:
+        clip = video_effects.slidein_transition(clip, 1, side)
+    elif transition == VideoTransitionMode.slide_out.value:
+        clip = video_effects.slideout_transition(clip, 1, side)
+
+    if clip.duration > max_clip_duration:
+        clip = clip.subclipped(0, max_clip_duration)
+
+    return clip
+
+
+def get_segment_cache_key(subclipped_item: SubClippedVideoClip, video_width: int, video_height: int, transition: str = None, side: str = ""):
+    try:
+        return segment_cache.make_key(
+            file_path=subclipped_item.file_path,
+            start_time=subclipped_item.start_time,
+            end_time=subclipped_item.end_time,
+            width=video_width,
+            height=video_height,
+            fps=fps,
+            codec=video_codec,
+            transition=transition,
+            side=side,
+        )
+    except Exception as e:
+        logger.warning(f"failed to build segment cache key: {str(e)}")
+        return None
 
 
 def combine_videos(
@@ -123,124 +274,185 @@ def combine_videos(
         video_transition_mode: VideoTransitionMode = None,
         max_clip_duration: int = 5,
         threads: int = 2,
+        render_backend: str = "",
+        timeline: Timeline = None,
 ) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
-    logger.info(f"audio duration: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"maximum clip duration: {req_dur} seconds")
+    params = VideoParams(
+        video_subject="",
+        video_aspect=video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        video_clip_duration=max_clip_duration,
+        n_threads=threads,
+        # the combined video has no bgm, the audio tracks are mixed on the final video
+        bgm_type="",
+    )
+    if timeline is None:
+        timeline = plan_videos(video_paths, audio_file, "", params, video_concat_mode)[0]
+    logger.info(f"audio duration: {timeline.audio.duration} seconds")
+    logger.info(f"maximum clip duration: {max_clip_duration} seconds")
     output_dir = os.path.dirname(combined_video_path)
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
+    if render_backend == "ffmpeg":
+        if timeline.clips and render_ffmpeg(combined_video_path, params, timeline=timeline):
+            logger.info("video combining completed")
+            return combined_video_path
+        logger.warning("failed to combine videos with ffmpeg, fallback to moviepy")
+
+    # every clip of the plan is normalized once and joined in the planned order
+    clip_segments = prepare_clip_segments(
+        get_unique_clips([timeline]),
+        output_dir=output_dir,
+        video_aspect=video_aspect,
+        max_clip_duration=max_clip_duration,
+    )
+    segments = [segment for segment in clip_segments.values() if segment]
+    assemble_video(
+        combined_video_path,
+        select_segments(timeline, clip_segments),
+        threads=threads,
+        crossfade=timeline.crossfade,
+    )
 
-    processed_clips = []
-    subclipped_items = []
-    video_duration = 0
-    for video_path in video_paths:
-        clip = VideoFileClip(video_path)
-        clip_duration = clip.duration
-        clip_w, clip_h = clip.size
-        close_clip(clip)
-
-        start_time = 0
-
-        while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)
-            if clip_duration - start_time >= max_clip_duration:
-                subclipped_items.append(SubClippedVideoClip(file_path= video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
-            start_time = end_time
-            if video_concat_mode.value == VideoConcatMode.sequential.value:
-                break
+    # clean temp files
+    delete_files([clip.file_path for clip in segments])
 
-    # random subclipped_items order
-    if video_concat_mode.value == VideoConcatMode.random.value:
-        random.shuffle(subclipped_items)
+    logger.info("video combining completed")
+    return combined_video_path
 
-    logger.debug(f"total subclipped items: {len(subclipped_items)}")
 
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    for i, subclipped_item in enumerate(subclipped_items):
-        if video_duration > audio_duration:
+def prepare_segments(
+        subclipped_items: List[SubClippedVideoClip],
+        transitions: List[tuple],
+        output_dir: str,
+        video_aspect: VideoAspect = VideoAspect.portrait,
+        max_clip_duration: int = 5,
+) -> List[SubClippedVideoClip]:
+    """
+    normalizes the planned subclips with their transitions into temp-clip-N.mp4 files
+    in output_dir. returns the segment of every item in order, None for items that failed
+    """
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
+
+    # clips are normalized concurrently when a clip pool is configured, with at most
+    # max_in_flight of them queued so one task doesn't take the whole pool
+    pool = get_clip_pool()
+    max_in_flight = get_clip_workers_per_task() if pool else 1
+    pending = collections.deque()
+    segments = []
+    items = iter(enumerate(zip(subclipped_items, transitions)))
+    while True:
+        for i, (subclipped_item, (transition, side)) in itertools.islice(items, max_in_flight - len(pending)):
+            logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}")
+            expected_duration = min(subclipped_item.duration, max_clip_duration)
+            clip_file = get_segment_file(output_dir, i)
+            cache_key = get_segment_cache_key(subclipped_item, video_width, video_height, transition, side)
+            if cache_key and segment_cache.get(cache_key, clip_file):
+                logger.debug(f"segment cache hit: {subclipped_item}")
+                future = Future()
+                future.set_result(SubClippedVideoClip(file_path=clip_file, duration=expected_duration, width=subclipped_item.width, height=subclipped_item.height))
+                cache_key = None
+            else:
+                future = submit_job(
+                    pool,
+                    normalize_clip,
+                    subclipped_item=subclipped_item,
+                    clip_file=clip_file,
+                    video_width=video_width,
+                    video_height=video_height,
+                    transition=transition,
+                    side=side,
+                    max_clip_duration=max_clip_duration,
+                )
+            pending.append((cache_key, future))
+
+        if not pending:
             break
 
-        logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
-
+        cache_key, future = pending.popleft()
         try:
-            clip = VideoFileClip(subclipped_item.file_path).subclipped(subclipped_item.start_time, subclipped_item.end_time)
-            clip_duration = clip.duration
-            # Not all videos are same size, so we need to resize them
-            clip_w, clip_h = clip.size
-            if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-                logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, ratio: {clip_ratio:.2f}, target: {video_width}x{video_height}, ratio: {video_ratio:.2f}")
-
-                if clip_ratio == video_ratio:
-                    clip = clip.resized(new_size=(video_width, video_height))
-                else:
-                    if clip_ratio > video_ratio:
-                        scale_factor = video_width / clip_w
-                    else:
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-
-                    background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
-                    clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
-                    clip = CompositeVideoClip([background, clip_resized])
-
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            if video_transition_mode.value == VideoTransitionMode.none.value:
-                clip = clip
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                clip = video_effects.fadein_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                clip = video_effects.fadeout_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                clip = shuffle_transition(clip)
+            segment = future.result()
+            if cache_key:
+                segment_cache.put(cache_key, segment.file_path)
+        except Exception as e:
+            segment = None
+            logger.error(f"failed to process clip: {str(e)}")
+        segments.append(segment)
 
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
+    logger.debug(f"segment cache stats: {segment_cache.stats()}")
+    return segments
 
-            # wirte clip to temp file
-            clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec)
 
-            close_clip(clip)
+def prepare_clip_segments(
+        clips: List[TimelineClip],
+        output_dir: str,
+        video_aspect: VideoAspect = VideoAspect.portrait,
+        max_clip_duration: int = 5,
+) -> dict:
+    """
+    normalizes each of the distinct timeline clips with prepare_segments and returns
+    the segment of every clip key, None for clips that failed
+    """
+    if not clips:
+        return {}
+    subclipped_items, transitions = get_timeline_items(clips)
+    segments = prepare_segments(
+        subclipped_items,
+        transitions,
+        output_dir=output_dir,
+        video_aspect=video_aspect,
+        max_clip_duration=max_clip_duration,
+    )
+    return {get_clip_key(clip): segment for clip, segment in zip(clips, segments)}
 
-            processed_clips.append(SubClippedVideoClip(file_path=clip_file, duration=clip.duration, width=clip_w, height=clip_h))
-            video_duration += clip.duration
 
-        except Exception as e:
-            logger.error(f"failed to process clip: {str(e)}")
+def select_segments(timeline: Timeline, clip_segments: dict) -> List[SubClippedVideoClip]:
+    """
+    the segments of the timeline clips in order. if some clips failed to normalize,
+    the others are looped instead
+    """
+    selected = [
+        clip_segments[get_clip_key(clip)]
+        for clip in timeline.clips
+        if clip_segments.get(get_clip_key(clip))
+    ]
+    if len(selected) < len(timeline.clips):
+        selected = loop_segments(selected, timeline.audio.duration, overlap=timeline.crossfade)
+    return selected
+
 
+def get_segment_file(output_dir: str, index: int) -> str:
+    # the normalized file of the index-th subclip given to prepare_segments
+    return f"{output_dir}/temp-clip-{index+1}.mp4"
+
+
+def get_timeline_duration(clips: List[SubClippedVideoClip], overlap: float = 0) -> float:
+    # adjacent clips overlap by `overlap` seconds when they are crossfaded
+    if not clips:
+        return 0
+    return sum(clip.duration for clip in clips) - overlap * (len(clips) - 1)
+
+
+def loop_segments(segments: List[SubClippedVideoClip], required_duration: float, overlap: float = 0) -> List[SubClippedVideoClip]:
     # loop processed clips until the video duration matches or exceeds the audio duration.
-    if video_duration < audio_duration:
-        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), looping clips to match audio length.")
-        base_clips = processed_clips.copy()
-        for clip in itertools.cycle(base_clips):
-            if video_duration >= audio_duration:
+    processed_clips = segments.copy()
+    video_duration = get_timeline_duration(processed_clips, overlap)
+    if processed_clips and video_duration < required_duration:
+        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({required_duration:.2f}s), looping clips to match audio length.")
+        for clip in itertools.cycle(segments):
+            if video_duration >= required_duration:
                 break
             processed_clips.append(clip)
-            video_duration += clip.duration
-        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(processed_clips)-len(base_clips)} clips")
+            video_duration += clip.duration - overlap
+        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {required_duration:.2f}s, looped {len(processed_clips)-len(segments)} clips")
+    return processed_clips
+
 
-    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
+def assemble_video(combined_video_path: str, processed_clips: List[SubClippedVideoClip], threads: int = 2, crossfade: float = 0) -> str:
+    """
+    joins normalized segments into combined_video_path, the segment files are left in place.
+    with crossfade > 0 adjacent segments fade into each other over that many seconds.
+    """
     logger.info("starting clip merging process")
     if not processed_clips:
         logger.warning("no clips available for merging")
@@ -250,92 +462,149 @@ def combine_videos(
     if len(processed_clips) == 1:
         logger.info("using single clip directly")
         shutil.copy(processed_clips[0].file_path, combined_video_path)
-        delete_files(processed_clips)
-        logger.info("video combining completed")
         return combined_video_path
 
-    # create initial video file as base
-    base_clip_path = processed_clips[0].file_path
-    temp_merged_video = f"{output_dir}/temp-merged-video.mp4"
-    temp_merged_next = f"{output_dir}/temp-merged-next.mp4"
-
-    # copy first clip as initial merged video
-    shutil.copy(base_clip_path, temp_merged_video)
-
-    # merge remaining video clips one by one
-    for i, clip in enumerate(processed_clips[1:], 1):
-        logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
+    return merge_clips(
+        clip_files=[clip.file_path for clip in processed_clips],
+        combined_video_path=combined_video_path,
+        threads=threads,
+        crossfade=crossfade,
+    )
 
-        try:
-            # load current base video and next clip to merge
-            base_clip = VideoFileClip(temp_merged_video)
-            next_clip = VideoFileClip(clip.file_path)
-
-            # merge these two clips
-            merged_clip = concatenate_videoclips([base_clip, next_clip])
-
-            # save merged result to temp file
-            merged_clip.write_videofile(
-                filename=temp_merged_next,
-                threads=threads,
-                logger=None,
-                temp_audiofile_path=output_dir,
-                audio_codec=audio_codec,
-                fps=fps,
-            )
-            close_clip(base_clip)
-            close_clip(next_clip)
-            close_clip(merged_clip)
 
-            # replace base file with new merged file
-            delete_files(temp_merged_video)
-            os.rename(temp_merged_next, temp_merged_video)
+def merge_clips(clip_files: List[str], combined_video_path: str, threads: int = 2, crossfade: float = 0):
+    # every temp clip is written with the same codec, fps and resolution, so they can
+    # be joined in one pass with stream copy; re-encoding is only used as a fallback,
+    # or when the clips are crossfaded
+    merge_mode = config.app.get("video_merge_mode", "copy").strip().lower()
+    if merge_mode == "copy" and not crossfade:
+        logger.info(f"merging {len(clip_files)} clips with stream copy")
+        if ffmpeg.concat_copy(clip_files, combined_video_path):
+            return combined_video_path
+        logger.warning("stream copy merge failed, fallback to re-encoding")
 
-        except Exception as e:
-            logger.error(f"failed to merge clip: {str(e)}")
-            continue
+    output_dir = os.path.dirname(combined_video_path)
+    logger.info(f"merging {len(clip_files)} clips with re-encoding")
+    readers = {}
+    merged_clip = None
+    try:
+        clips = open_clips_lazily(clip_files, readers)
+        if crossfade:
+            merged_clip = video_effects.crossfade_concat(clips, crossfade, fps=fps)
+        else:
+            merged_clip = concatenate_videoclips(clips)
+        merged_clip.write_videofile(
+            filename=combined_video_path,
+            threads=threads,
+            logger=None,
+            temp_audiofile_path=output_dir,
+            audio_codec=audio_codec,
+            fps=fps,
+        )
+    except Exception as e:
+        logger.error(f"failed to merge clips: {str(e)}")
+    finally:
+        for reader in readers.values():
+            close_clip(reader)
+        close_clip(merged_clip)
 
-    # after merging, rename final result to target file name
-    os.rename(temp_merged_video, combined_video_path)
+    return combined_video_path
 
-    # clean temp files
-    clip_files = [clip.file_path for clip in processed_clips]
-    delete_files(clip_files)
 
-    logger.info("video combining completed")
-    return combined_video_path
+def open_clips_lazily(clip_files: List[str], readers: dict) -> List[VideoClip]:
+    """
+    clips of the files that only open a reader, kept in readers, on their first frame.
+    the files are merged in order, so opening one closes the readers of the files
+    before the previous one and at most two are open at a time
+    """
+
+    def get_frame(index, t):
+        reader = readers.get(index)
+        if reader is None:
+            for done in [i for i in readers if i < index - 1]:
+                close_clip(readers.pop(done))
+            reader = readers[index] = VideoFileClip(clip_files[index], audio=False)
+        return reader.get_frame(t)
+
+    clips = []
+    for index, clip_file in enumerate(clip_files):
+        media_info = probe_media(clip_file)
+        # the size is set up front, a clip made from a frame function would read its first frame
+        clip = VideoClip(duration=media_info.duration).with_fps(fps)
+        clip.frame_function = functools.partial(get_frame, index)
+        clip.size = media_info.size
+        clips.append(clip)
+    return clips
+
+
+@functools.lru_cache(maxsize=32)
+def get_font(font_path, fontsize):
+    # loading a truetype font parses the whole file, keep the loaded faces around
+    return ImageFont.truetype(font_path, fontsize)
+
+
+def _last_fitting(fits, lo, hi):
+    """
+    returns the largest index in [lo, hi) for which fits() is true, or lo - 1.
+    fits() must be monotone: once it is false it stays false.
+    """
+    # gallop first so a short line never measures the whole remaining text
+    step = 1
+    while lo + step - 1 < hi and fits(lo + step - 1):
+        lo += step
+        step *= 2
+    hi = min(hi, lo + step - 1)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo - 1
 
 
 def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
+    font = get_font(font, fontsize)
 
     def get_text_size(inner_text):
         inner_text = inner_text.strip()
         left, top, right, bottom = font.getbbox(inner_text)
         return right - left, bottom - top
 
+    def fits(inner_text):
+        return get_text_size(inner_text)[0] <= max_width
+
     width, height = get_text_size(text)
     if width <= max_width:
         return text, height
 
+    # appending text never makes a line narrower, so instead of measuring the line
+    # after every word, binary search for the last word that still fits
     processed = True
 
     _wrapped_lines_ = []
     words = text.split(" ")
     _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
-                processed = False
-                break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
+    i = 0
+    while i < len(words):
+        line = _txt_
+        last = _last_fitting(
+            lambda j: fits(line + "".join(f"{word} " for word in words[i:j + 1])),
+            i,
+            len(words),
+        )
+        _txt_ += "".join(f"{word} " for word in words[i:last + 1])
+        i = last + 1
+        if i >= len(words):
+            break
+
+        word = words[i]
+        if (_txt_ + f"{word} ").strip() == word.strip():
+            processed = False
+            break
+        _wrapped_lines_.append(_txt_)
+        _txt_ = f"{word} "
+        i += 1
     _wrapped_lines_.append(_txt_)
     if processed:
         _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
@@ -343,18 +612,17 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
         height = len(_wrapped_lines_) * height
         return result, height
 
+    # a single word is wider than the line, break between characters instead. the
+    # character that overflows stays on its line, as it always has
     _wrapped_lines_ = []
-    chars = list(text)
-    _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            _wrapped_lines_.append(_txt_)
-            _txt_ = ""
-    _wrapped_lines_.append(_txt_)
+    start = 0
+    while start < len(text):
+        end = _last_fitting(lambda j: fits(text[start:j + 1]), start, len(text)) + 1
+        if end >= len(text):
+            break
+        _wrapped_lines_.append(text[start:end + 1])
+        start = end + 1
+    _wrapped_lines_.append(text[start:])
     result = "\n".join(_wrapped_lines_).strip()
     height = len(_wrapped_lines_) * height
     return result, height
@@ -366,6 +634,8 @@ def generate_video(
         subtitle_path: str,
         output_file: str,
         params: VideoParams,
+        audio_track: str = "",
+        parallel: bool = True,
 ):
     aspect = VideoAspect(params.video_aspect)
     video_width, video_height = aspect.to_resolution()
@@ -376,10 +646,262 @@ def generate_video(
     logger.info(f"  ③ subtitle: {subtitle_path}")
     logger.info(f"  ④ output: {output_file}")
 
+    if not has_subtitles(subtitle_path):
+        # nothing to draw on the frames, copy the video stream and mux the audio in
+        if mux_video(video_path, audio_path, output_file, params, audio_track=audio_track):
+            return
+        logger.warning("muxing failed, fallback to re-encoding")
+
+    if get_render_backend(params) == "ffmpeg":
+        if render_ffmpeg(
+            output_file,
+            params,
+            video_path=video_path,
+            subtitle_path=subtitle_path,
+            audio_path=audio_path,
+            audio_track=audio_track,
+        ):
+            return
+        logger.warning("failed to render with ffmpeg, fallback to moviepy")
+
+    if parallel and chunked_render.render_chunked(
+        chunked_render.open_timeline,
+        dict(video_path=video_path),
+        duration=probe_media(video_path).duration,
+        audio_path=audio_path,
+        subtitle_path=subtitle_path,
+        output_file=output_file,
+        params=params,
+        audio_track=audio_track,
+    ):
+        return
+
+    if pipelined_render.render_pipelined(
+        output_file,
+        params,
+        audio_path=audio_path,
+        subtitle_path=subtitle_path,
+        audio_track=audio_track,
+        source_file=video_path,
+    ):
+        return
+
+    video_clip = VideoFileClip(video_path).without_audio()
+    video_clip = compose_video(
+        video_clip=video_clip,
+        audio_path=audio_path,
+        subtitle_path=subtitle_path,
+        params=params,
+        audio_track=audio_track,
+    )
+    write_final_video(video_clip, output_file=output_file, params=params, audio_track=audio_track)
+
+
+def mux_video(video_path: str, audio_path: str, output_file: str, params: VideoParams, audio_track: str = "") -> bool:
+    """
+    builds output_file from the video stream of video_path and the mixed audio without
+    decoding a single frame
+    """
+    audio_track, temp_track = get_audio_track(
+        audio_track, audio_path, params, duration=probe_media(video_path).duration, output_file=output_file
+    )
+    if not audio_track:
+        return False
+
+    try:
+        logger.info(f"muxing audio into video: {output_file}")
+        return ffmpeg.mux_audio(video_path, audio_track, output_file)
+    finally:
+        if temp_track:
+            delete_files(temp_track)
+
+
+def add_language_tracks(video_file: str, tracks: List[dict], subtitle_mode: str = "soft") -> bool:
+    """
+    replaces the audio of video_file with one track per language and adds their subtitles
+    as mov_text tracks, copying the video stream. tracks are dicts with language,
+    audio_track and subtitle_path. with subtitle_mode webvtt the subtitles are also
+    written next to the video as {name}.{language}.vtt
+    """
+    audio_tracks = [(t["audio_track"], t["language"]) for t in tracks if t.get("audio_track")]
+    subtitle_tracks = [(t["subtitle_path"], t["language"]) for t in tracks if t.get("subtitle_path")]
+    temp_file = f"{video_file}.tracks.mp4"
+    ok = ffmpeg.mux_tracks(
+        video_file,
+        audio_tracks=audio_tracks,
+        subtitle_tracks=subtitle_tracks,
+        output_file=temp_file,
+        duration=probe_media(video_file).duration,
+    )
+    if not ok:
+        delete_files(temp_file)
+        logger.error(f"failed to add language tracks to {video_file}")
+        return False
+    os.replace(temp_file, video_file)
+
+    if subtitle_mode == "webvtt":
+        name = os.path.splitext(video_file)[0]
+        for subtitle_path, language in subtitle_tracks:
+            ffmpeg.convert_subtitle(subtitle_path, f"{name}.{language or 'und'}.vtt")
+    logger.info(f"added {len(audio_tracks)} audio and {len(subtitle_tracks)} subtitle tracks to {video_file}")
+    return True
+
+
+def prepare_audio_track(audio_path: str, params: VideoParams, duration: float, output_file: str) -> str:
+    """
+    mixes the voice and bgm once into an AAC track that every video of a task is muxed with,
+    returns "" if the track can't be rendered and the audio should be mixed per video
+    """
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    bgm_volume = get_bgm_volume(bgm_file, params)
+    try:
+        return audio_mix.render_audio_track(
+            voice_file=audio_path,
+            output_file=output_file,
+            duration=duration,
+            bgm_file=bgm_file,
+            voice_volume=params.voice_volume,
+            bgm_volume=bgm_volume,
+            audio_codec=audio_codec,
+        )
+    except Exception as e:
+        logger.error(f"failed to render audio track: {str(e)}")
+        return ""
+
+
+def get_audio_track(audio_track: str, audio_path: str, params: VideoParams, duration: float, output_file: str) -> tuple:
+    """
+    the pre-mixed audio_track if there is one, otherwise a track mixed from audio_path
+    into a temp file next to output_file. returns the track, "" if it couldn't be mixed,
+    and the temp file the caller deletes once the track is muxed
+    """
+    if audio_track:
+        return audio_track, ""
+    temp_track = f"{output_file}.audio.m4a"
+    audio_track = prepare_audio_track(
+        audio_path=audio_path,
+        params=params,
+        duration=duration,
+        output_file=temp_track,
+    )
+    return audio_track, temp_track
+
+
+def write_final_video(video_clip, output_file: str, params: VideoParams, audio_track: str = ""):
     # https://github.com/Vishal-Kumar-S/textToVideoGeneration/issues/217
     # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
     # write into the same directory as the output file
     output_dir = os.path.dirname(output_file)
+    # with a pre-mixed audio track only the video is encoded, the track is muxed in afterwards
+    video_file = f"{output_file}.video.mp4" if audio_track else output_file
+    video_clip.write_videofile(
+        video_file,
+        audio=not audio_track,
+        audio_codec=audio_codec,
+        temp_audiofile_path=output_dir,
+        threads=params.n_threads or 2,
+        logger=None,
+        fps=fps,
+    )
+    video_clip.close()
+    del video_clip
+    if audio_track:
+        try:
+            if not ffmpeg.mux_audio(video_file, audio_track, output_file):
+                raise ValueError(f"failed to mux audio track into {output_file}")
+        finally:
+            delete_files(video_file)
+    logger.debug(f"subtitle raster cache stats: {text_raster_cache.stats()}")
+
+
+def get_variant_pool():
+    """
+    returns the process pool shared by all tasks for rendering the video_count variants
+    of a task, or None when app.variant_workers is not greater than 1. the pool is
+    capped at the cpu count, so concurrent tasks queue their variants instead of each
+    starting encoders of their own
+    """
+    workers = min(int(config.app.get("variant_workers", 1) or 1), os.cpu_count() or 1)
+    return get_process_pool("variant", workers)
+
+
+def get_render_backend(params: VideoParams = None) -> str:
+    """
+    moviepy, or ffmpeg to compile the video into one filtergraph, set per task or in app.render_backend
+    """
+    backend = (params.render_backend if params else "") or config.app.get("render_backend", "")
+    return backend or "moviepy"
+
+
+def render_ffmpeg(
+        output_file: str,
+        params: VideoParams,
+        timeline: Timeline = None,
+        video_path: str = "",
+        subtitle_path: str = "",
+        audio_path: str = "",
+        audio_track: str = "",
+) -> bool:
+    """
+    renders the clips of the timeline, or the frames of video_path, with the subtitles
+    and the audio in a single ffmpeg process. without audio_path and audio_track the
+    output has no audio, as combined videos
+    """
+    graph = ffmpeg_render.Graph()
+    if timeline:
+        video = ffmpeg_render.add_timeline(
+            graph, timeline.clips, timeline.width, timeline.height, timeline.fps, crossfade=timeline.crossfade
+        )
+        duration = timeline.duration
+    else:
+        index = graph.add_input("-i", video_path)
+        video = graph.add([f"{index}:v:0"], "format=yuv420p")
+        duration = probe_media(video_path).duration
+
+    work_dir = f"{output_file}.subtitles"
+    try:
+        overlay = get_subtitle_overlay(subtitle_path, params)
+        if overlay is not None and overlay.lines:
+            subtitle_list = ffmpeg_render.write_subtitle_track(overlay, duration, work_dir)
+            video = ffmpeg_render.add_subtitles(graph, video, subtitle_list)
+
+        audio = ""
+        if audio_path and not audio_track:
+            bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+            audio = ffmpeg_render.add_audio_mix(
+                graph,
+                duration=duration,
+                voice_file=audio_path,
+                voice_volume=params.voice_volume,
+                bgm_file=bgm_file,
+                bgm_volume=get_bgm_volume(bgm_file, params),
+            )
+
+        return ffmpeg_render.render(
+            graph,
+            output_file,
+            video=video,
+            audio=audio,
+            audio_track=audio_track,
+            fps=fps,
+            video_codec=video_codec,
+            audio_codec=audio_codec,
+            threads=params.n_threads or 2,
+        )
+    except Exception as e:
+        logger.error(f"failed to render with ffmpeg: {str(e)}")
+        return False
+    finally:
+        ffmpeg_render.cleanup(work_dir)
+
+
+def get_subtitle_overlay(subtitle_path: str, params: VideoParams):
+    """
+    the overlay that draws the subtitles of subtitle_path with the style in params,
+    or None if there is no subtitle file
+    """
+    aspect = VideoAspect(params.video_aspect)
+    video_width, video_height = aspect.to_resolution()
 
     font_path = ""
     if params.subtitle_enabled:
@@ -391,11 +913,24 @@ def generate_video(
 
         logger.info(f"  ⑤ font: {font_path}")
 
-    def create_text_clip(subtitle_item):
+    def rasterize_subtitle(phrase):
         params.font_size = int(params.font_size)
         params.stroke_width = int(params.stroke_width)
-        phrase = subtitle_item[1]
         max_width = video_width * 0.9
+        cache_key = text_raster_cache.make_key(
+            text=phrase,
+            font_path=font_path,
+            font_size=params.font_size,
+            color=params.text_fore_color,
+            bg_color=params.text_background_color,
+            stroke_color=params.stroke_color,
+            stroke_width=params.stroke_width,
+            wrap_width=max_width,
+        )
+        cached = text_raster_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         wrapped_txt, txt_height = wrap_text(
             phrase, max_width=max_width, font=font_path, fontsize=params.font_size
         )
@@ -413,56 +948,81 @@ def generate_video(
             # interline=interline,
             # size=size,
         )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
+        rgb = _clip.get_frame(0)
+        if _clip.mask is not None:
+            alpha = np.round(_clip.mask.get_frame(0) * 255).astype(np.uint8)
+        else:
+            alpha = np.full(rgb.shape[:2], 255, dtype=np.uint8)
+        text_raster_cache.put(cache_key, rgb, alpha)
+        return rgb, alpha
+
+    def get_subtitle_position(w, h):
+        x = (video_width - w) / 2
         if params.subtitle_position == "bottom":
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
+            return x, video_height * 0.95 - h
         elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
+            return x, video_height * 0.05
         elif params.subtitle_position == "custom":
             # Ensure the subtitle is fully within the screen bounds
             margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
+            max_y = video_height - h - margin
             min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
+            custom_y = (video_height - h) * (params.custom_position / 100)
             custom_y = max(
                 min_y, min(custom_y, max_y)
             )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
+            return x, custom_y
         else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
-
-    video_clip = VideoFileClip(video_path).without_audio()
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
+            return x, (video_height - h) / 2
+
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return None
+
+    def rasterize_line(phrase):
+        rgb, alpha = rasterize_subtitle(phrase)
+        x, y = get_subtitle_position(rgb.shape[1], rgb.shape[0])
+        return x, y, rgb, alpha
+
+    # lines are rasterized just before they show up and released once they end
+    overlay = subtitle_overlay.SubtitleOverlay(
+        video_width,
+        video_height,
+        rasterize=rasterize_line,
+        lookahead=config.app.get("subtitle_lookahead", 2.0),
     )
+    for (start, end), phrase in file_to_subtitles(subtitle_path, encoding="utf-8"):
+        overlay.add(start=start, end=end, text=phrase)
+    return overlay
 
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font=font_path,
-            font_size=params.font_size,
-        )
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
-        )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
+def compose_video(
+        video_clip,
+        audio_path: str,
+        subtitle_path: str,
+        params: VideoParams,
+        audio_track: str = "",
+):
+    """
+    overlays the subtitles on video_clip and attaches the voice and bgm audio,
+    the returned clip is ready to be encoded. with a pre-mixed audio_track no
+    audio is attached, write_final_video muxes the track instead.
+    """
+    overlay = get_subtitle_overlay(subtitle_path, params)
+    if overlay is not None:
+        video_clip = overlay.apply(video_clip)
+
+    if audio_track:
+        return video_clip
 
+    audio_clip = AudioFileClip(audio_path).with_effects(
+        [afx.MultiplyVolume(params.voice_volume)]
+    )
     bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
     if bgm_file:
         try:
             bgm_clip = AudioFileClip(bgm_file).with_effects(
                 [
-                    afx.MultiplyVolume(params.bgm_volume),
+                    afx.MultiplyVolume(get_bgm_volume(bgm_file, params)),
                     afx.AudioFadeOut(3),
                     afx.AudioLoop(duration=video_clip.duration),
                 ]
@@ -471,61 +1031,319 @@ def generate_video(
         except Exception as e:
             logger.error(f"failed to add bgm: {str(e)}")
 
-    video_clip = video_clip.with_audio(audio_clip)
-    video_clip.write_videofile(
-        output_file,
-        audio_codec=audio_codec,
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
-        logger=None,
-        fps=fps,
+    return video_clip.with_audio(audio_clip)
+
+
+def build_timeline(
+        subclipped_items: List[SubClippedVideoClip],
+        transitions: List[tuple],
+        required_duration: float,
+        video_width: int,
+        video_height: int,
+        max_clip_duration: int = 5,
+        crossfade: float = 0,
+):
+    """
+    normalizes the subclips in memory and joins them into one clip that lasts at least
+    required_duration, looping them if needed. the transitions are picked by the caller,
+    so every process that builds the same timeline renders the same frames.
+    returns the clip, None if no subclip could be opened, and the source clips to close
+    once the clip is rendered
+    """
+    # subclips of the same file share one reader instead of spawning an ffmpeg process each
+    source_clips = {}
+    timeline_clips = []
+    video_duration = 0
+    for subclipped_item, (transition, side) in zip(subclipped_items, transitions):
+        if video_duration > required_duration:
+            break
+
+        try:
+            source_clip = source_clips.get(subclipped_item.file_path)
+            if source_clip is None:
+                source_clip = open_video_clip(
+                    subclipped_item.file_path,
+                    width=subclipped_item.width,
+                    height=subclipped_item.height,
+                    video_width=video_width,
+                    video_height=video_height,
+                )
+                source_clips[subclipped_item.file_path] = source_clip
+
+            clip = build_normalized_clip(
+                source_clip.subclipped(subclipped_item.start_time, subclipped_item.end_time),
+                video_width=video_width,
+                video_height=video_height,
+                transition=transition,
+                side=side,
+                max_clip_duration=max_clip_duration,
+            )
+            timeline_clips.append(clip)
+            video_duration += clip.duration - (crossfade if len(timeline_clips) > 1 else 0)
+        except Exception as e:
+            logger.error(f"failed to process clip: {str(e)}")
+
+    if not timeline_clips:
+        return None, list(source_clips.values())
+
+    # loop clips until the video duration matches or exceeds the audio duration.
+    if video_duration < required_duration:
+        base_clips = timeline_clips.copy()
+        for clip in itertools.cycle(base_clips):
+            if video_duration >= required_duration:
+                break
+            timeline_clips.append(clip)
+            video_duration += clip.duration - crossfade
+        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {required_duration:.2f}s, looped {len(timeline_clips)-len(base_clips)} clips")
+
+    if crossfade and len(timeline_clips) > 1:
+        video_clip = video_effects.crossfade_concat(timeline_clips, crossfade, fps=fps)
+    else:
+        video_clip = concatenate_videoclips(timeline_clips)
+    return video_clip, list(source_clips.values())
+
+
+def render_video(
+        video_paths: List[str],
+        audio_path: str,
+        subtitle_path: str,
+        output_file: str,
+        params: VideoParams,
+        video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+        combined_video_path: str = "",
+        audio_track: str = "",
+        parallel: bool = True,
+        timeline: Timeline = None,
+):
+    """
+    renders the final video in a single encode: the subclips are normalized in memory,
+    concatenated and composited with the subtitles and audio, without writing the
+    temp clips or combined-N.mp4. with parallel and a render pool the frames are
+    encoded in time chunks, see chunked_render.render_chunked.
+    if combined_video_path is set, the combined video is written first and the final
+    video is generated from it, as callers that need the combined file expect. the same
+    happens without subtitles, where the final video is muxed instead of encoded.
+    the clips, transitions and bgm come from the timeline, planned here if not given
+    """
+    if timeline is None:
+        timeline = plan_videos(video_paths, audio_path, subtitle_path, params, video_concat_mode)[0]
+    if not timeline.clips:
+        logger.error("no clips available for rendering")
+        return ""
+    # the planned bgm, not another random pick
+    params = params.model_copy(update={"bgm_file": timeline.audio.bgm_file})
+
+    if get_render_backend(params) == "ffmpeg" and not combined_video_path:
+        if render_ffmpeg(
+            output_file,
+            params,
+            timeline=timeline,
+            subtitle_path=subtitle_path,
+            audio_path=audio_path,
+            audio_track=audio_track,
+        ):
+            return output_file
+        logger.warning("failed to render with ffmpeg, fallback to moviepy")
+
+    # without subtitles the final video is just the joined segments plus the audio, which
+    # the combined path builds with stream copy, so go through a temp combined file
+    temp_combined_path = ""
+    if not combined_video_path and not has_subtitles(subtitle_path):
+        combined_video_path = temp_combined_path = f"{output_file}.combined.mp4"
+
+    if combined_video_path:
+        try:
+            combine_videos(
+                combined_video_path=combined_video_path,
+                video_paths=video_paths,
+                audio_file=audio_path,
+                video_aspect=params.video_aspect,
+                video_concat_mode=video_concat_mode,
+                video_transition_mode=params.video_transition_mode,
+                max_clip_duration=params.video_clip_duration,
+                threads=params.n_threads,
+                render_backend=get_render_backend(params),
+                timeline=timeline,
+            )
+            if not os.path.exists(combined_video_path):
+                logger.error("no clips available for rendering")
+                return ""
+            generate_video(
+                video_path=combined_video_path,
+                audio_path=audio_path,
+                subtitle_path=subtitle_path,
+                output_file=output_file,
+                params=params,
+                audio_track=audio_track,
+                parallel=parallel,
+            )
+        finally:
+            if temp_combined_path:
+                delete_files(temp_combined_path)
+        return output_file
+
+    logger.info(f"rendering video: {timeline.width} x {timeline.height}")
+    logger.info(f"  ① materials: {len(video_paths)}, clips: {len(timeline.clips)}")
+    logger.info(f"  ② audio: {audio_path}, duration: {timeline.audio.duration:.2f}s")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {output_file}")
+
+    subclipped_items, transitions = get_timeline_items(timeline.clips)
+    timeline_args = dict(
+        subclipped_items=subclipped_items,
+        transitions=transitions,
+        required_duration=timeline.audio.duration,
+        video_width=timeline.width,
+        video_height=timeline.height,
+        max_clip_duration=params.video_clip_duration,
+        crossfade=timeline.crossfade,
     )
-    video_clip.close()
-    del video_clip
+    video_clip, source_clips = build_timeline(**timeline_args)
+    if video_clip is None:
+        logger.error("no clips available for rendering")
+        for source_clip in source_clips:
+            close_clip(source_clip)
+        return ""
+
+    if parallel and chunked_render.get_render_pool() is not None:
+        # the workers build the timeline themselves. the readers are closed before any
+        # worker is forked, a child holding their pipes would block closing them later
+        duration = video_clip.duration
+        for source_clip in source_clips:
+            close_clip(source_clip)
+        if chunked_render.render_chunked(
+            build_timeline,
+            timeline_args,
+            duration=duration,
+            audio_path=audio_path,
+            subtitle_path=subtitle_path,
+            output_file=output_file,
+            params=params,
+            audio_track=audio_track,
+        ):
+            return output_file
+        video_clip, source_clips = build_timeline(**timeline_args)
+
+    try:
+        if pipelined_render.pipeline_enabled():
+            if pipelined_render.render_pipelined(
+                output_file,
+                params,
+                audio_path=audio_path,
+                subtitle_path=subtitle_path,
+                audio_track=audio_track,
+                video_clip=video_clip,
+            ):
+                return output_file
+            # the forked source stage read from the same ffmpeg readers, which are now
+            # at an unknown position, so moviepy starts over with fresh ones
+            for source_clip in source_clips:
+                close_clip(source_clip)
+            source_clips = []
+            video_clip, source_clips = build_timeline(**timeline_args)
+
+        video_clip = compose_video(
+            video_clip=video_clip,
+            audio_path=audio_path,
+            subtitle_path=subtitle_path,
+            params=params,
+            audio_track=audio_track,
+        )
+        write_final_video(video_clip, output_file=output_file, params=params, audio_track=audio_track)
+    finally:
+        for source_clip in source_clips:
+            close_clip(source_clip)
+
+    return output_file
+
+
+def render_image_clip(image_file: str, output_file: str, width: int, height: int, duration: float) -> str:
+    """
+    writes a Ken Burns clip of image_file, zooming in by 3% per second.
+    runs in a clip pool worker process, so all arguments must be picklable.
+    """
+    with Image.open(image_file) as image:
+        clip = video_effects.ken_burns(
+            image,
+            width=width,
+            height=height,
+            duration=duration,
+            zoom=1 + duration * 0.03,
+        )
+    write_clip_file(clip, output_file)
+    close_clip(clip)
+    return output_file
+
 
+def preprocess_video(materials: List[MaterialInfo], clip_duration=4, video_aspect: VideoAspect = VideoAspect.portrait):
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
+    # images are rendered concurrently when a clip pool is configured
+    pool = get_clip_pool()
+    jobs = []
     for material in materials:
         if not material.url:
             continue
 
         ext = utils.parse_extension(material.url)
         try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
+            if ext in const.FILE_TYPE_IMAGES:
+                with Image.open(material.url) as image:
+                    width, height = image.size
+            else:
+                width, height = media_index.probe(material.url).size
+        except Exception as e:
+            logger.warning(f"invalid material: {material.url} => {str(e)}")
+            continue
 
-        width = clip.size[0]
-        height = clip.size[1]
         if width < 480 or height < 480:
             logger.warning(f"low resolution material: {width}x{height}, minimum 480x480 required")
             continue
 
         if ext in const.FILE_TYPE_IMAGES:
             logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
-            )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
+            # render at the size the clip is scaled to in the final video, not the image size
+            clip_w, clip_h = get_fit_size(width, height, video_width, video_height)
+            clip_w, clip_h = clip_w - clip_w % 2, clip_h - clip_h % 2
+            video_file = f"{material.url}.mp4"
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
+            cache_key = None
+            try:
+                cache_key = image_clip_cache.make_image_key(
+                    file_path=material.url,
+                    duration=clip_duration,
+                    width=clip_w,
+                    height=clip_h,
+                    fps=fps,
+                    codec=video_codec,
+                )
+            except Exception as e:
+                logger.warning(f"failed to build image cache key: {str(e)}")
+
+            if cache_key and image_clip_cache.get(cache_key, video_file):
+                material.url = video_file
+                logger.success(f"image loaded from cache: {video_file}")
+                continue
+
+            future = submit_job(
+                pool,
+                render_image_clip,
+                image_file=material.url,
+                output_file=video_file,
+                width=clip_w,
+                height=clip_h,
+                duration=clip_duration,
+            )
+            jobs.append((material, cache_key, future))
 
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None)
-            close_clip(clip)
-            material.url = video_file
-            logger.success(f"image processed: {video_file}")
-    return materials
\ No newline at end of file
+    for material, cache_key, future in jobs:
+        try:
+            video_file = future.result()
+        except Exception as e:
+            logger.error(f"failed to process image: {material.url} => {str(e)}")
+            continue
+        if cache_key:
+            image_clip_cache.put(cache_key, video_file)
+        material.url = video_file
+        logger.success(f"image processed: {video_file}")
+    return materials
@@ -1228,12 +1228,10 @@ def siliconflow_tts(
                 sub_maker = SubMaker()
 
                 try:
-                    # Get the actual duration of the audio file using moviepy.
-                    from moviepy import AudioFileClip
+                    # Get the actual duration of the audio file from its headers.
+                    from app.services.media_index import probe_media
 
-                    audio_clip = AudioFileClip(voice_file)
-                    audio_duration = audio_clip.duration
-                    audio_clip.close()
+                    audio_duration = probe_media(voice_file).duration
 
                     # Convert duration to 100-nanosecond units for edge_tts compatibility.
                     audio_duration_100ns = int(audio_duration * 10000000)
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.models import const
+from app.models.exception import HttpException
+from app.services import state as sm
+from app.utils import utils
+
+try:
+    from app.controllers.v1 import video as video_controller
+except ImportError:
+    # the controllers need fastapi and the task module's llm, tts and whisper clients
+    video_controller = None
+
+
+@unittest.skipIf(video_controller is None, "the api dependencies are not installed")
+class TestRerenderTask(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.task_id = "rerender"
+        self.request = mock.Mock(headers={"x-task-id": "request"})
+
+        def task_dir(sub_dir: str = ""):
+            d = os.path.join(self.root, "tasks", sub_dir)
+            os.makedirs(d, exist_ok=True)
+            return d
+
+        with open(os.path.join(task_dir(self.task_id), "script.json"), "w", encoding="utf-8") as f:
+            json.dump({"params": {"video_subject": "subject", "seed": 3}}, f)
+
+        self.task_manager = mock.Mock()
+        for target, name, value in [
+            (utils, "task_dir", task_dir),
+            (video_controller, "task_manager", self.task_manager),
+        ]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(sm.state.delete_task, self.task_id)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def rerender(self, changes: dict):
+        return video_controller.rerender_task(self.request, task_id=self.task_id, changes=changes)
+
+    def assert_status(self, changes: dict, status_code: int):
+        with self.assertRaises(HttpException) as context:
+            self.rerender(changes)
+        self.assertEqual(context.exception.status_code, status_code)
+        self.task_manager.add_task.assert_not_called()
+
+    def test_queues_the_task_with_the_changes(self):
+        response = self.rerender({"font_name": "MicrosoftYaHeiBold.ttc"})
+        self.assertEqual(response["status"], 200)
+        params = self.task_manager.add_task.call_args.kwargs["params"]
+        self.assertEqual(params.font_name, "MicrosoftYaHeiBold.ttc")
+        self.assertEqual(params.seed, 3)
+
+    def test_processing_task_is_rejected(self):
+        sm.state.update_task(self.task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+        self.assert_status({"font_name": "MicrosoftYaHeiBold.ttc"}, 409)
+
+    def test_unknown_params_are_rejected(self):
+        self.assert_status({"font": "MicrosoftYaHeiBold.ttc"}, 400)
+
+    def test_missing_task(self):
+        self.task_id = "missing"
+        self.assert_status({}, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import subprocess
+
+import numpy as np
+from moviepy import VideoFileClip
+from moviepy.config import FFMPEG_BINARY
+
+
+def make_video(file_path: str, duration: float, size=(480, 854), source: str = "testsrc2", fps: int = 30) -> str:
+    """
+    writes a silent h264 test pattern, source is a lavfi video source such as
+    testsrc2, or color=c=red
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    w, h = size
+    if source.startswith("color="):
+        lavfi = f"{source}:s={w}x{h}:r={fps}:d={duration}"
+    else:
+        lavfi = f"{source}=s={w}x{h}:r={fps}:d={duration}"
+    subprocess.run(
+        [
+            FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", lavfi,
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(fps),
+            file_path,
+        ],
+        check=True,
+    )
+    return file_path
+
+
+def make_audio(file_path: str, duration: float) -> str:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    subprocess.run(
+        [
+            FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:a", "libmp3lame", file_path,
+        ],
+        check=True,
+    )
+    return file_path
+
+
+def get_duration(file_path: str) -> float:
+    with VideoFileClip(file_path, audio=False) as clip:
+        return clip.duration
+
+
+def frame_diff(file_a: str, file_b: str, times) -> float:
+    # the largest mean absolute difference between the frames of two videos, in 0-255
+    with VideoFileClip(file_a, audio=False) as a, VideoFileClip(file_b, audio=False) as b:
+        return max(
+            float(np.abs(a.get_frame(t).astype(np.float32) - b.get_frame(t).astype(np.float32)).mean())
+            for t in times
+        )
+
+
+def isolate_storage(test, root: str):
+    """
+    points the caches and indexes that live under storage/ at root for the duration of
+    the test, so running the tests never touches the repo's storage dir
+    """
+    from unittest import mock
+
+    from app.services import audio_mix
+    from app.services.bgm_catalog import bgm_catalog
+    from app.services.media_index import media_index
+    from app.services.segment_cache import image_clip_cache, segment_cache
+    from app.services.text_raster_cache import text_raster_cache
+
+    patches = [
+        mock.patch.object(segment_cache, "cache_dir", os.path.join(root, "cache_segments")),
+        mock.patch.object(image_clip_cache, "cache_dir", os.path.join(root, "cache_images")),
+        mock.patch.object(text_raster_cache, "cache_dir", ""),
+        mock.patch.object(audio_mix, "pcm_cache_dir", os.path.join(root, "cache_pcm")),
+        mock.patch.object(media_index, "db_path", os.path.join(root, "media_index.db")),
+        mock.patch.object(media_index, "_initialized", False),
+        mock.patch.object(bgm_catalog, "db_path", os.path.join(root, "bgm_catalog.db")),
+        mock.patch.object(bgm_catalog, "_initialized", False),
+        mock.patch.object(bgm_catalog, "_songs", {}),
+        mock.patch.object(bgm_catalog, "_names", []),
+        mock.patch.object(bgm_catalog, "_dir_mtime_ns", None),
+        mock.patch.object(bgm_catalog, "_refreshed_at", 0),
+    ]
+    for patcher in patches:
+        patcher.start()
+        test.addCleanup(patcher.stop)
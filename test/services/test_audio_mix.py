@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.services import audio_mix
+from test.helpers import isolate_storage, make_audio
+
+
+class TestAudioMix(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.cache_dir = audio_mix.pcm_cache_dir
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_pcm_cache_evicts_least_recently_used(self):
+        files = [make_audio(os.path.join(self.root, f"bgm-{i}.mp3"), 2) for i in range(3)]
+        # a little more than two decoded files fit
+        size = 2 * audio_mix.sample_rate * audio_mix.channels * 4
+        with mock.patch.object(audio_mix, "get_pcm_cache_size", lambda: int(size * 2.5)):
+            audio_mix.decode_pcm(files[0])
+            audio_mix.decode_pcm(files[1])
+            os.utime(audio_mix.get_pcm_file(files[0]), (0, 0))
+            audio_mix.decode_pcm(files[1])
+            audio_mix.decode_pcm(files[2])
+
+        cached = sorted(os.listdir(self.cache_dir))
+        expected = sorted(os.path.basename(audio_mix.get_pcm_file(f)) for f in files[1:])
+        self.assertEqual(cached, expected)
+
+    def test_stale_voice_pcm_is_not_reused(self):
+        voice_file = make_audio(os.path.join(self.root, "voice.mp3"), 1)
+        output_file = os.path.join(self.root, "audio-track.m4a")
+        # left behind by an interrupted run of another voice
+        np.ones((10, audio_mix.channels), dtype=np.float32).tofile(f"{output_file}.voice.f32")
+
+        voices = []
+        mix_track = audio_mix.mix_track
+
+        def record(out, voice, **kwargs):
+            voices.append(len(voice))
+            mix_track(out, voice, **kwargs)
+
+        with mock.patch.object(audio_mix, "mix_track", record):
+            audio_mix.render_audio_track(voice_file, output_file, duration=1)
+        self.assertGreater(voices[0], audio_mix.sample_rate // 2)
+        self.assertFalse(os.path.exists(f"{output_file}.voice.f32"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from moviepy import VideoFileClip
+
+from app.models.schema import VideoAspect, VideoConcatMode, VideoParams, VideoTransitionMode
+from app.services import video as vd
+from test.helpers import isolate_storage, make_audio, make_video
+
+colors = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "cyan": (0, 255, 255),
+    "magenta": (255, 0, 255),
+}
+
+
+class TestCombineVideos(unittest.TestCase):
+    """
+    the combined video plays the planned clips, in the planned order
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        # one 3s window per file, so every clip is told apart by its color
+        self.video_paths = [
+            make_video(os.path.join(self.root, f"{name}.mp4"), 3, size=(480, 480), source=f"color=c={name}")
+            for name in colors
+        ]
+        patcher = mock.patch.object(vd.segment_cache, "enabled", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_plan_rendered(self, transition_mode: VideoTransitionMode, audio_duration: float, video_count: int = 6):
+        audio_path = make_audio(os.path.join(self.root, f"voice-{audio_duration}.mp3"), audio_duration)
+        video_paths = self.video_paths[:video_count]
+        params = VideoParams(
+            video_subject="test",
+            video_aspect=VideoAspect.square,
+            video_concat_mode=VideoConcatMode.random,
+            video_transition_mode=transition_mode,
+            video_clip_duration=3,
+            bgm_type="",
+            seed=3,
+        )
+        timeline = vd.plan_videos(video_paths, audio_path, "", params)[0]
+        output_file = os.path.join(self.root, f"combined-{transition_mode.value}.mp4")
+        vd.combine_videos(
+            output_file,
+            video_paths,
+            audio_path,
+            video_aspect=params.video_aspect,
+            video_concat_mode=params.video_concat_mode,
+            video_transition_mode=params.video_transition_mode,
+            max_clip_duration=params.video_clip_duration,
+            timeline=timeline,
+        )
+
+        planned = [os.path.basename(clip.file_path)[:-4] for clip in timeline.clips]
+        rendered = []
+        with VideoFileClip(output_file, audio=False) as clip:
+            self.assertAlmostEqual(clip.duration, timeline.duration, delta=0.1)
+            start = 0
+            for timeline_clip in timeline.clips:
+                # the middle of the clip, clear of the transitions
+                frame = clip.get_frame(start + timeline_clip.duration / 2).reshape(-1, 3).mean(axis=0)
+                rendered.append(min(colors, key=lambda name: np.abs(frame - colors[name]).sum()))
+                start += timeline_clip.duration - timeline.crossfade
+        self.assertEqual(rendered, planned)
+
+    def test_concat(self):
+        self.assert_plan_rendered(VideoTransitionMode.fade_in, 8)
+
+    def test_crossfade(self):
+        # four 3s clips joined by 1s crossfades cover 8s, three would not
+        self.assert_plan_rendered(VideoTransitionMode.crossfade, 8)
+
+    def test_looped(self):
+        self.assert_plan_rendered(VideoTransitionMode.crossfade, 14, video_count=2)
+
+    def test_merge_opens_the_clips_lazily(self):
+        opened = []
+        open_counts = []
+
+        def open_clip(*args, **kwargs):
+            open_counts.append(sum(clip.reader.proc is not None for clip in opened) + 1)
+            opened.append(VideoFileClip(*args, **kwargs))
+            return opened[-1]
+
+        output_file = os.path.join(self.root, "merged.mp4")
+        with mock.patch.object(vd, "VideoFileClip", open_clip):
+            vd.merge_clips(self.video_paths, output_file, crossfade=1)
+
+        self.assertEqual(len(opened), len(self.video_paths))
+        self.assertLessEqual(max(open_counts), 2)
+        self.assertTrue(all(clip.reader.proc is None for clip in opened))
+        with VideoFileClip(output_file, audio=False) as clip:
+            self.assertAlmostEqual(clip.duration, 6 * 3 - 5, delta=0.1)
+            rendered = []
+            for i in range(len(colors)):
+                frame = clip.get_frame(i * 2 + 1.5).reshape(-1, 3).mean(axis=0)
+                rendered.append(min(colors, key=lambda name: np.abs(frame - colors[name]).sum()))
+        self.assertEqual(rendered, list(colors))
+
+    def test_planned_without_bgm(self):
+        audio_path = make_audio(os.path.join(self.root, "voice.mp3"), 4)
+        with (
+            mock.patch.object(vd, "plan_videos", wraps=vd.plan_videos) as plan_videos,
+            mock.patch.object(vd, "prepare_clip_segments", return_value={}),
+            mock.patch.object(vd, "assemble_video"),
+        ):
+            vd.combine_videos(os.path.join(self.root, "combined.mp4"), self.video_paths[:2], audio_path)
+        params = plan_videos.call_args.args[3]
+        self.assertEqual(params.bgm_type, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
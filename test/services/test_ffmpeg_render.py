@@ -0,0 +1,151 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.models.schema import TimelineClip, VideoAspect, VideoConcatMode, VideoParams, VideoTransitionMode
+from app.services import ffmpeg_render
+from app.services import video as vd
+from app.services.bgm_catalog import bgm_catalog
+from app.services.media_index import media_index
+from app.services.utils import ffmpeg
+from test.helpers import frame_diff, get_duration, isolate_storage, make_audio, make_video
+
+
+class TestFfmpegRender(unittest.TestCase):
+    """
+    the ffmpeg backend renders the same frames as moviepy from the same timeline
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.video_paths = [
+            make_video(os.path.join(self.root, "wide.mp4"), 6, size=(960, 540), source="testsrc2"),
+            make_video(os.path.join(self.root, "tall.mp4"), 6, size=(540, 960), source="smptebars"),
+        ]
+        self.audio_path = make_audio(os.path.join(self.root, "voice.mp3"), 7)
+        patcher = mock.patch.object(vd.segment_cache, "enabled", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def plan(self, transition_mode: VideoTransitionMode):
+        params = VideoParams(
+            video_subject="test",
+            video_aspect=VideoAspect.square,
+            video_concat_mode=VideoConcatMode.random,
+            video_transition_mode=transition_mode,
+            video_clip_duration=2,
+            bgm_type="",
+            seed=7,
+        )
+        timeline = vd.plan_videos(self.video_paths, self.audio_path, "", params)[0]
+        return params, timeline
+
+    def combine(self, name: str, params: VideoParams, timeline, render_backend: str) -> str:
+        output_file = os.path.join(self.root, name, "combined.mp4")
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        vd.combine_videos(
+            output_file,
+            self.video_paths,
+            self.audio_path,
+            video_aspect=params.video_aspect,
+            video_concat_mode=params.video_concat_mode,
+            video_transition_mode=params.video_transition_mode,
+            max_clip_duration=params.video_clip_duration,
+            render_backend=render_backend,
+            timeline=timeline,
+        )
+        return output_file
+
+    def assert_same_frames(self, transition_mode: VideoTransitionMode, sides=None):
+        params, timeline = self.plan(transition_mode)
+        if sides:
+            for clip, side in zip(timeline.clips, sides):
+                clip.side = side
+        expected = self.combine(f"moviepy-{transition_mode.value}", params, timeline, "")
+        rendered = []
+        render_ffmpeg = vd.render_ffmpeg
+
+        def spy(*args, **kwargs):
+            rendered.append(render_ffmpeg(*args, **kwargs))
+            return rendered[-1]
+
+        # no silent fallback to moviepy
+        with mock.patch.object(vd, "render_ffmpeg", spy):
+            actual = self.combine(f"ffmpeg-{transition_mode.value}", params, timeline, "ffmpeg")
+        self.assertEqual(rendered, [True])
+
+        self.assertAlmostEqual(get_duration(actual), get_duration(expected), delta=0.05)
+        # sampled inside every clip and across the transitions
+        times = [i * 0.25 + 0.1 for i in range(int(get_duration(expected) * 4) - 1)]
+        # two encodes of the test patterns differ by up to ~2/255 even where the frames
+        # match, a frame shifted by one pixel differs by ~10/255
+        self.assertLess(frame_diff(expected, actual, times), 2.5)
+
+    def test_fade(self):
+        self.assert_same_frames(VideoTransitionMode.fade_in)
+        self.assert_same_frames(VideoTransitionMode.fade_out)
+
+    def test_slide(self):
+        sides = ["left", "right", "top", "bottom"]
+        self.assert_same_frames(VideoTransitionMode.slide_in, sides)
+        self.assert_same_frames(VideoTransitionMode.slide_out, sides)
+
+    def test_crossfade(self):
+        self.assert_same_frames(VideoTransitionMode.crossfade)
+
+
+class TestGroupInputs(unittest.TestCase):
+    def clip(self, file_path: str, start_time: float) -> TimelineClip:
+        return TimelineClip(file_path=file_path, start_time=start_time, duration=2, fit_width=1080, fit_height=1080)
+
+    def test_in_order_clips_share_an_input(self):
+        clips = [self.clip("a.mp4", 0), self.clip("b.mp4", 4), self.clip("a.mp4", 2), self.clip("a.mp4", 6)]
+        self.assertEqual(ffmpeg_render._group_inputs(clips), [[0, 2, 3], [1]])
+
+    def test_looped_and_far_clips_get_their_own_input(self):
+        clips = [self.clip("a.mp4", 2), self.clip("a.mp4", 0), self.clip("a.mp4", 2), self.clip("a.mp4", 60)]
+        self.assertEqual(ffmpeg_render._group_inputs(clips), [[0], [1, 2], [3]])
+
+
+class TestAudioMix(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.song_dir = os.path.join(self.root, "songs")
+        os.makedirs(self.song_dir)
+        patcher = mock.patch.object(bgm_catalog, "song_dir", self.song_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_looped(self, bgm_file: str, duration: float):
+        graph = ffmpeg_render.Graph()
+        voice_file = make_audio(os.path.join(self.root, "voice.mp3"), 1)
+        with mock.patch.object(ffmpeg, "parse_infos", side_effect=AssertionError("probed the bgm")):
+            ffmpeg_render.add_audio_mix(graph, 10, voice_file, bgm_file=bgm_file)
+        self.assertIn(f"aloop=loop=-1:size={int(duration * ffmpeg_render.sample_rate) + 1}", ";".join(graph.filters))
+
+    def test_catalog_song_duration_is_not_probed_again(self):
+        bgm_file = make_audio(os.path.join(self.song_dir, "song.mp3"), 3)
+        duration = bgm_catalog.get_duration(bgm_file)
+        self.assertAlmostEqual(duration, 3, delta=0.1)
+        self.assert_looped(bgm_file, duration)
+
+    def test_custom_bgm_duration_comes_from_the_media_index(self):
+        bgm_file = make_audio(os.path.join(self.root, "custom.mp3"), 2)
+        duration = media_index.probe(bgm_file).duration
+        self.assertAlmostEqual(duration, 2, delta=0.1)
+        self.assert_looped(bgm_file, duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import signal
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from moviepy import VideoFileClip
+
+from app.services.utils import frame_pipeline
+from test.helpers import get_duration, make_video
+
+
+def gray(t):
+    return np.full((64, 64, 3), int(t * 30) % 256, dtype=np.uint8)
+
+
+@unittest.skipUnless(frame_pipeline.available(), "the frame pipeline needs fork")
+class TestFramePipeline(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.temp_dir.name, "out.mp4")
+        # a hung pipeline fails the test instead of blocking it
+        signal.signal(signal.SIGALRM, lambda *args: self.fail("frame pipeline hung"))
+        signal.alarm(60)
+
+    def tearDown(self):
+        signal.alarm(0)
+        self.temp_dir.cleanup()
+
+    def stages(self):
+        return [
+            frame_pipeline.ClipSource(gray, fps=30),
+            frame_pipeline.Encoder(self.output_file, width=64, height=64, fps=30),
+        ]
+
+    def test_run(self):
+        stats = frame_pipeline.run(self.stages(), frames=60, width=64, height=64, slots=4)
+        self.assertEqual(stats["frames"], 60)
+        self.assertAlmostEqual(get_duration(self.output_file), 2, delta=0.1)
+
+    def test_killed_stage_fails_the_run(self):
+        encode = frame_pipeline.Encoder.__call__
+
+        def crash(encoder, frame, index):
+            if index == 10:
+                os.kill(os.getpid(), signal.SIGKILL)
+            encode(encoder, frame, index)
+
+        with mock.patch.object(frame_pipeline.Encoder, "__call__", crash):
+            with self.assertRaisesRegex(ValueError, "encode"):
+                frame_pipeline.run(self.stages(), frames=60, width=64, height=64, slots=4)
+
+    def test_file_source_holds_the_last_frame(self):
+        source_file = make_video(os.path.join(self.temp_dir.name, "white.mp4"), 1, size=(64, 64), source="color=c=white")
+
+        def darken(frame, t):
+            frame //= 2
+
+        stages = [
+            frame_pipeline.FileSource(source_file, width=64, height=64, fps=30),
+            frame_pipeline.Compositor(darken, fps=30),
+            frame_pipeline.Encoder(self.output_file, width=64, height=64, fps=30),
+        ]
+        frame_pipeline.run(stages, frames=45, width=64, height=64, slots=4)
+
+        self.assertAlmostEqual(get_duration(self.output_file), 1.5, delta=0.1)
+        with VideoFileClip(self.output_file, audio=False) as clip:
+            # the padding is darkened once, like the decoded frames
+            for t in (0.5, 1.4):
+                self.assertAlmostEqual(float(clip.get_frame(t).mean()), 127, delta=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
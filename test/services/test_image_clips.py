@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from app.models.schema import MaterialInfo, VideoAspect
+from app.services import video as vd
+from app.services.segment_cache import SegmentCache
+from test.helpers import get_duration, isolate_storage
+
+
+class TestImageClips(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.image = os.path.join(self.root, "image.png")
+        Image.new("RGB", (600, 800), (200, 40, 40)).save(self.image)
+        cache = SegmentCache(cache_dir=os.path.join(self.root, "cache"), max_size_mb=0)
+        patcher = mock.patch.object(vd, "image_clip_cache", cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = cache
+        self.outputs = 0
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def preprocess(self, duration: float) -> str:
+        materials = [MaterialInfo(provider="local", url=self.image, duration=0)]
+        materials = vd.preprocess_video(materials, clip_duration=duration, video_aspect=VideoAspect.square)
+        # keep a copy, the next call renders onto the same {image}.mp4
+        self.outputs += 1
+        output_file = os.path.join(self.root, f"out-{self.outputs}.mp4")
+        shutil.copy(materials[0].url, output_file)
+        return output_file
+
+    def test_durations_are_cached_separately(self):
+        self.assertAlmostEqual(get_duration(self.preprocess(2)), 2, delta=0.1)
+        self.assertAlmostEqual(get_duration(self.preprocess(1)), 1, delta=0.1)
+        self.assertAlmostEqual(get_duration(self.preprocess(2)), 2, delta=0.1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        entries = [
+            os.path.join(self.cache.cache_dir, name)
+            for name in os.listdir(self.cache.cache_dir)
+            if name.endswith(".mp4")
+        ]
+        self.assertEqual(len(entries), 2)
+        self.assertNotEqual(os.stat(entries[0]).st_ino, os.stat(entries[1]).st_ino)
+        durations = sorted(round(get_duration(entry)) for entry in entries)
+        self.assertEqual(durations, [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app.services.media_index import MediaIndex
+from test.helpers import make_audio
+
+
+class TestMediaIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.db_path = os.path.join(self.root, "media_index.db")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def indexed_paths(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return sorted(row[0] for row in conn.execute("SELECT path FROM media"))
+        finally:
+            conn.close()
+
+    def test_missing_files_are_pruned(self):
+        kept = make_audio(os.path.join(self.root, "kept.mp3"), 1)
+        removed = make_audio(os.path.join(self.root, "removed.mp3"), 1)
+        index = MediaIndex(self.db_path)
+        index.probe(kept)
+        index.probe(removed)
+        self.assertEqual(self.indexed_paths(), sorted([kept, removed]))
+
+        os.remove(removed)
+        # a new process prunes the entry on its first connection
+        self.assertGreater(MediaIndex(self.db_path).probe(kept).duration, 0)
+        self.assertEqual(self.indexed_paths(), [kept])
+
+
+if __name__ == "__main__":
+    unittest.main()
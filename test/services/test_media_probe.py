@@ -0,0 +1,112 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from moviepy.config import FFMPEG_BINARY
+
+from app.services.media_index import probe_media
+from app.services.utils import ffmpeg, media_probe
+from test.helpers import make_audio, make_video
+
+
+def ffmpeg_run(*args):
+    subprocess.run([FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *args], check=True)
+
+
+class TestMediaProbe(unittest.TestCase):
+    """
+    the header readers agree with ffmpeg on the files the app writes and downloads
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.video = make_video(os.path.join(self.root, "video.mp4"), 3, size=(480, 854), fps=25)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def assert_same_as_ffmpeg(self, file_path: str):
+        values = media_probe.probe(file_path)
+        self.assertIsNotNone(values)
+        infos = ffmpeg.parse_infos(file_path)
+        self.assertAlmostEqual(values["duration"], infos["duration"], delta=0.05)
+        self.assertEqual(values["has_video"], bool(infos.get("video_found")))
+        self.assertEqual(values["has_audio"], bool(infos.get("audio_found")))
+        if values["has_video"]:
+            self.assertEqual((values["width"], values["height"]), tuple(infos["video_size"]))
+            self.assertAlmostEqual(values["fps"], infos["video_fps"], places=2)
+            self.assertEqual(values["codec"], infos["video_codec_name"])
+        return values
+
+    def test_mp4(self):
+        # ffmpeg writes the moov box after the media data unless asked for faststart
+        with open(self.video, "rb") as f:
+            data = f.read()
+        self.assertGreater(data.find(b"moov"), data.find(b"mdat"))
+        values = self.assert_same_as_ffmpeg(self.video)
+        self.assertAlmostEqual(values["keyframe_interval"], 1, delta=0.05)
+
+    def test_faststart_mp4_with_audio(self):
+        output = self.path("faststart.mp4")
+        ffmpeg_run(
+            "-i", self.video, "-f", "lavfi", "-i", "sine=frequency=440:duration=3",
+            "-c:v", "copy", "-c:a", "aac", "-shortest", "-movflags", "+faststart", output,
+        )
+        with open(output, "rb") as f:
+            data = f.read()
+        self.assertLess(data.find(b"moov"), data.find(b"mdat"))
+        values = self.assert_same_as_ffmpeg(output)
+        self.assertTrue(values["has_audio"])
+
+    def test_mp3(self):
+        self.assert_same_as_ffmpeg(make_audio(self.path("cbr.mp3"), 5))
+
+    def test_vbr_mp3(self):
+        output = self.path("vbr.mp3")
+        ffmpeg_run("-f", "lavfi", "-i", "sine=frequency=440:duration=5", "-c:a", "libmp3lame", "-q:a", "4", output)
+        self.assert_same_as_ffmpeg(output)
+
+    def test_corrupt_files_are_not_understood(self):
+        truncated = self.path("truncated.mp4")
+        with open(self.video, "rb") as f:
+            data = f.read()
+        with open(truncated, "wb") as f:
+            # the moov box is at the end and gets cut off
+            f.write(data[: len(data) // 2])
+        garbage = self.path("garbage.mp3")
+        with open(garbage, "wb") as f:
+            f.write(os.urandom(4096).replace(b"\xff", b"\x00"))
+        empty = self.path("empty.mp4")
+        open(empty, "wb").close()
+
+        for file_path in (truncated, garbage, empty):
+            self.assertIsNone(media_probe.probe(file_path), file_path)
+            # ffmpeg finds no streams in them either
+            info = probe_media(file_path)
+            self.assertEqual((info.duration, info.has_video, info.has_audio), (0, False, False))
+
+    def test_fallback_to_ffmpeg(self):
+        # fragmented files keep the duration in the fragments, other containers aren't read at all
+        fragmented = self.path("fragmented.mp4")
+        ffmpeg_run("-i", self.video, "-c", "copy", "-movflags", "frag_keyframe+empty_moov", fragmented)
+        matroska = self.path("video.mkv")
+        ffmpeg_run("-i", self.video, "-c", "copy", matroska)
+
+        for file_path in (fragmented, matroska):
+            self.assertIsNone(media_probe.probe(file_path), file_path)
+            info = probe_media(file_path)
+            infos = ffmpeg.parse_infos(file_path)
+            self.assertAlmostEqual(info.duration, infos["duration"], delta=0.05)
+            self.assertEqual(info.size, (480, 854))
+            self.assertAlmostEqual(info.fps, 25, places=2)
+            self.assertEqual(info.codec, "h264")
+            self.assertTrue(info.has_video)
+
+
+if __name__ == "__main__":
+    unittest.main()
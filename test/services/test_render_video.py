@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from moviepy import ColorClip
+
+from app.config import config
+from app.models.schema import VideoAspect, VideoConcatMode, VideoParams
+from app.services import video as vd
+from app.services.bgm_catalog import bgm_catalog
+from app.services.utils import frame_pipeline
+from test.helpers import frame_diff, isolate_storage, make_audio, make_video
+
+
+class TestRenderVideo(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.video_paths = [
+            make_video(os.path.join(self.root, f"src{i}.mp4"), 4, size=(640, 640), source=source)
+            for i, source in enumerate(("testsrc2", "testsrc", "smptebars"))
+        ]
+        self.audio_path = make_audio(os.path.join(self.root, "voice.mp3"), 6)
+        self.subtitle_path = os.path.join(self.root, "subtitle.srt")
+        with open(self.subtitle_path, "w", encoding="utf-8") as f:
+            f.write("1\n00:00:00,000 --> 00:00:03,000\nHello world\n\n2\n00:00:03,500 --> 00:00:05,500\nSecond line\n")
+        self.params = VideoParams(
+            video_subject="test",
+            video_aspect=VideoAspect.square,
+            video_concat_mode=VideoConcatMode.sequential,
+            video_clip_duration=2,
+            font_name="Charm-Regular.ttf",
+            bgm_type="",
+            n_threads=2,
+            seed=1,
+        )
+        self.timeline = vd.plan_videos(
+            self.video_paths, self.audio_path, self.subtitle_path, self.params, VideoConcatMode.sequential
+        )[0]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def render(self, output_file: str, **app_config):
+        app_config = {"render_workers": 1, "render_backend": "moviepy", **app_config}
+        with mock.patch.dict(config.app, app_config):
+            return vd.render_video(
+                self.video_paths,
+                self.audio_path,
+                self.subtitle_path,
+                os.path.join(self.root, output_file),
+                self.params,
+                video_concat_mode=VideoConcatMode.sequential,
+                parallel=False,
+                timeline=self.timeline,
+            )
+
+    @unittest.skipUnless(frame_pipeline.available(), "the frame pipeline needs fork")
+    def test_fallback_after_pipeline_failure(self):
+        expected = self.render("expected.mp4", render_pipeline=False)
+
+        encode = frame_pipeline.Encoder.__call__
+
+        def fail_midway(encoder, frame, index):
+            if index == 100:
+                raise ValueError("encoder died")
+            encode(encoder, frame, index)
+
+        with mock.patch.object(frame_pipeline.Encoder, "__call__", fail_midway):
+            fallback = self.render("fallback.mp4", render_pipeline=True)
+
+        self.assertLess(frame_diff(expected, fallback, (0.1, 1.5, 2.5, 3.4, 4.2, 5.5)), 1)
+
+
+class TestComposeVideo(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_bgm_is_leveled_to_the_target_loudness(self):
+        voice_file = make_audio(os.path.join(self.root, "voice.mp3"), 2)
+        bgm_file = make_audio(os.path.join(self.root, "bgm.mp3"), 2)
+        params = VideoParams(video_subject="test", bgm_type="custom", bgm_file=bgm_file, bgm_volume=0.4, subtitle_enabled=False)
+        volumes = []
+        multiply_volume = vd.afx.MultiplyVolume
+
+        def record(factor, *args, **kwargs):
+            volumes.append(factor)
+            return multiply_volume(factor, *args, **kwargs)
+
+        # a song mastered 6dB above the target is played at half the volume
+        with (
+            mock.patch.dict(config.app, {"bgm_target_loudness": -20}),
+            mock.patch.object(bgm_catalog, "get_loudness", return_value=-14),
+            mock.patch.object(vd, "get_bgm_file", return_value=bgm_file),
+            mock.patch.object(vd.afx, "MultiplyVolume", record),
+        ):
+            clip = vd.compose_video(ColorClip((64, 64), (0, 0, 0), duration=2), voice_file, "", params)
+        vd.close_clip(clip)
+        self.assertEqual(len(volumes), 2)
+        self.assertAlmostEqual(volumes[1], 0.4 * 10 ** (-6 / 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
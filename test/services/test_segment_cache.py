@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from moviepy import VideoFileClip
+
+from app.services import video as vd
+from app.services.segment_cache import SegmentCache
+from test.helpers import isolate_storage, make_video
+
+
+def mean_color(file_path: str):
+    with VideoFileClip(file_path, audio=False) as clip:
+        return clip.get_frame(0.5).reshape(-1, 3).mean(axis=0)
+
+
+class TestSegmentCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.cache = SegmentCache(cache_dir=os.path.join(self.root, "cache"), max_size_mb=0)
+        self.red = make_video(os.path.join(self.root, "red.mp4"), 2, size=(480, 854), source="color=c=red")
+        self.blue = make_video(os.path.join(self.root, "blue.mp4"), 2, size=(480, 854), source="color=c=blue")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def normalize(self, file_path: str, clip_file: str):
+        item = vd.SubClippedVideoClip(file_path=file_path, start_time=0, end_time=1, width=480, height=854)
+        return vd.normalize_clip(item, clip_file, video_width=480, video_height=854)
+
+    def test_rewriting_a_linked_segment_keeps_the_entry(self):
+        first_dir = os.path.join(self.root, "task-1")
+        second_dir = os.path.join(self.root, "task-2")
+        os.makedirs(first_dir)
+        os.makedirs(second_dir)
+
+        clip = self.normalize(self.red, vd.get_segment_file(first_dir, 0))
+        key = self.cache.make_key(self.red, 0, 1, 480, 854, vd.fps, vd.video_codec)
+        self.cache.put(key, clip.file_path)
+
+        # a rerun links the entry into place, then normalizes another clip onto the same path
+        clip_file = vd.get_segment_file(second_dir, 0)
+        self.assertTrue(self.cache.get(key, clip_file))
+        self.normalize(self.blue, clip_file)
+
+        entry_file = os.path.join(self.root, "entry.mp4")
+        self.assertTrue(self.cache.get(key, entry_file))
+        self.assertFalse(os.path.samefile(entry_file, clip_file))
+        r, g, b = mean_color(entry_file)
+        self.assertGreater(r, 200)
+        self.assertLess(b, 50)
+        r, g, b = mean_color(clip_file)
+        self.assertGreater(b, 200)
+
+    def test_eviction_sweeps_stale_temp_files(self):
+        os.makedirs(self.cache.cache_dir)
+        stale = os.path.join(self.cache.cache_dir, "seg-a.mp4.1.1.tmp")
+        fresh = os.path.join(self.cache.cache_dir, "seg-b.mp4.1.2.tmp")
+        for file_path in (stale, fresh):
+            with open(file_path, "wb") as f:
+                f.write(b"partial")
+        os.utime(stale, (0, 0))
+
+        key = self.cache.make_key(self.red, 0, 2, 480, 854, vd.fps, vd.video_codec)
+        self.cache.put(key, self.red)
+        # a write still in progress is left alone
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)), [f"seg-{key}.mp4", "seg-b.mp4.1.2.tmp"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from app.services.stage_cache import StageCache
+
+
+class TestStageCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_fingerprint_depends_on_every_input(self):
+        key = StageCache.fingerprint("script", 1.0, {"a": 1, "b": 2})
+        self.assertEqual(key, StageCache.fingerprint("script", 1.0, {"b": 2, "a": 1}))
+        self.assertNotEqual(key, StageCache.fingerprint("script", 1.5, {"a": 1, "b": 2}))
+
+    def test_stages_survive_a_restart(self):
+        output = os.path.join(self.root, "audio.mp3")
+        with open(output, "wb") as f:
+            f.write(b"audio")
+        StageCache(self.root).put("audio", "key", {"audio_file": output}, files=[output])
+
+        stages = StageCache(self.root)
+        self.assertEqual(stages.get("audio", "key"), {"audio_file": output})
+        self.assertIsNone(stages.get("audio", "other"))
+        self.assertIsNone(stages.get("script", "key"))
+
+    def test_stage_with_missing_files_is_rerun(self):
+        output = os.path.join(self.root, "audio.mp3")
+        with open(output, "wb") as f:
+            f.write(b"audio")
+        stages = StageCache(self.root)
+        stages.put("audio", "key", {"audio_file": output}, files=[output])
+        os.remove(output)
+        self.assertIsNone(stages.get("audio", "key"))
+
+    def test_file_stats_change_with_the_file(self):
+        file = os.path.join(self.root, "clip.mp4")
+        with open(file, "wb") as f:
+            f.write(b"1")
+        before = StageCache.file_stats([file])
+        with open(file, "wb") as f:
+            f.write(b"12")
+        self.assertNotEqual(before, StageCache.file_stats([file]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.models.schema import VideoParams
+from app.utils import utils
+from test.helpers import isolate_storage, make_audio, make_video
+
+try:
+    from app.services import task as tm
+except ImportError:
+    # the task module pulls in the llm, tts and whisper clients
+    tm = None
+
+
+@unittest.skipIf(tm is None, "the task dependencies are not installed")
+class TestRerender(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        isolate_storage(self, self.root)
+        self.materials = [
+            make_video(os.path.join(self.root, f"material-{i}.mp4"), 4, size=(480, 854), source=source)
+            for i, source in enumerate(("testsrc2", "smptebars", "color=c=red"))
+        ]
+
+        def task_dir(sub_dir: str = ""):
+            d = os.path.join(self.root, "tasks", sub_dir)
+            os.makedirs(d, exist_ok=True)
+            return d
+
+        def generate_audio(task_id, params, video_script, audio_file=""):
+            # the voice is as long as the script is words
+            duration = len(video_script.split())
+            audio_file = make_audio(os.path.join(task_dir(task_id), "audio.mp3"), duration)
+            return audio_file, duration, None
+
+        self.generate_audio = mock.Mock(side_effect=generate_audio)
+        for name, value in [
+            ("generate_audio", self.generate_audio),
+            ("get_video_materials", mock.Mock(return_value=self.materials)),
+        ]:
+            patcher = mock.patch.object(tm, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(utils, "task_dir", task_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.task_id = "rerender"
+        self.params = VideoParams(
+            video_subject="subject",
+            video_script="one two three four five",
+            video_source="local",
+            video_aspect="9:16",
+            video_clip_duration=2,
+            subtitle_enabled=False,
+            bgm_type="",
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def plan(self, params):
+        result = tm.start(self.task_id, params, stop_at="plan")
+        return tm.get_footage_key(result["timelines"][0], params)
+
+    def test_load_params_merges_the_changes_and_keeps_the_seed(self):
+        self.plan(self.params)
+        seed = tm.load_params(self.task_id).seed
+        self.assertIsNotNone(seed)
+
+        params = tm.load_params(self.task_id, {"font_name": "MicrosoftYaHeiBold.ttc"})
+        self.assertEqual(params.font_name, "MicrosoftYaHeiBold.ttc")
+        self.assertEqual(params.video_script, self.params.video_script)
+        self.assertEqual(params.seed, seed)
+        self.assertEqual(tm.load_params(self.task_id, {"seed": 7}).seed, 7)
+
+    def test_load_params_rejects_unknown_params(self):
+        self.plan(self.params)
+        with self.assertRaises(ValueError):
+            tm.load_params(self.task_id, {"font": "MicrosoftYaHeiBold.ttc"})
+        with self.assertRaises(FileNotFoundError):
+            tm.load_params("missing")
+
+    def test_changed_font_reuses_the_audio_and_footage(self):
+        footage_key = self.plan(self.params)
+        self.assertEqual(self.generate_audio.call_count, 1)
+
+        params = tm.load_params(self.task_id, {"font_name": "MicrosoftYaHeiBold.ttc"})
+        self.assertEqual(self.plan(params), footage_key)
+        self.assertEqual(self.generate_audio.call_count, 1)
+
+    def test_changed_script_reruns_the_audio_and_footage(self):
+        footage_key = self.plan(self.params)
+
+        params = tm.load_params(self.task_id, {"video_script": "one two three four five six seven eight"})
+        self.assertNotEqual(self.plan(params), footage_key)
+        self.assertEqual(self.generate_audio.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
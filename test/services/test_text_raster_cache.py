@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.services.text_raster_cache import TextRasterCache
+
+
+class TestTextRasterCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache_subtitles")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def bitmap(self, value: int):
+        # a little under 1MB on disk, the noise keeps np.savez from shrinking it
+        rng = np.random.default_rng(value)
+        return rng.integers(0, 255, (360, 720, 3), dtype=np.uint8), np.full((360, 720), value, dtype=np.uint8)
+
+    def test_disk_tier_survives_a_restart(self):
+        rgb, alpha = self.bitmap(1)
+        TextRasterCache(cache_dir=self.cache_dir).put("a", rgb, alpha)
+
+        cache = TextRasterCache(cache_dir=self.cache_dir)
+        entry = cache.get("a")
+        self.assertTrue(np.array_equal(entry[0], rgb))
+        self.assertTrue(np.array_equal(entry[1], alpha))
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        self.assertEqual(os.listdir(self.cache_dir), ["a.npz"])
+
+    def test_disk_tier_evicts_least_recently_used(self):
+        cache = TextRasterCache(cache_dir=self.cache_dir, max_disk_size_mb=2)
+        cache.put("a", *self.bitmap(1))
+        cache.put("b", *self.bitmap(2))
+        os.utime(os.path.join(self.cache_dir, "a.npz"), (0, 0))
+        os.utime(os.path.join(self.cache_dir, "b.npz"), (1, 1))
+        # a disk hit makes "a" the most recently used
+        self.assertIsNotNone(TextRasterCache(cache_dir=self.cache_dir).get("a"))
+        cache.put("c", *self.bitmap(3))
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["a.npz", "c.npz"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+from moviepy import VideoClip
+
+from app.services.utils import video_effects
+
+
+def step_clip(duration: float, value: int, switch_at: float):
+    # frames are `value` until switch_at and black afterwards, returned in one reused buffer
+    buffer = np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def frame_function(t):
+        buffer[...] = value if t < switch_at else 0
+        return buffer
+
+    return VideoClip(frame_function, duration=duration).with_fps(30)
+
+
+class TestCrossfade(unittest.TestCase):
+    def test_looped_clip_fades_into_itself(self):
+        clip = step_clip(2, 200, switch_at=1)
+        merged = video_effects.crossfade_concat([clip, clip], 1)
+        self.assertAlmostEqual(merged.duration, 3)
+
+        # halfway through the fade the incoming start (200) meets the outgoing end (0)
+        frame = merged.get_frame(1.5)
+        self.assertAlmostEqual(int(frame[2, 2, 0]), 100, delta=2)
+
+    def test_fade_weights(self):
+        a = step_clip(2, 200, switch_at=3)
+        b = step_clip(2, 0, switch_at=3)
+        merged = video_effects.crossfade_concat([a, b], 1)
+        self.assertEqual(int(merged.get_frame(0.5)[0, 0, 0]), 200)
+        self.assertAlmostEqual(int(merged.get_frame(1.5)[0, 0, 0]), 100, delta=2)
+        self.assertEqual(int(merged.get_frame(2.5)[0, 0, 0]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import unittest
+
+from PIL import ImageFont
+
+from app.services import video as vd
+from app.utils import utils
+
+font_path = os.path.join(utils.font_dir(), "Charm-Regular.ttf")
+fontsize = 60
+
+
+def wrap_text_linear(text, max_width, font, fontsize):
+    # the line breaking wrap_text did before it searched for the breaks, measuring the
+    # line after every word and then after every character
+    font = ImageFont.truetype(font, fontsize)
+
+    def get_text_size(inner_text):
+        inner_text = inner_text.strip()
+        left, top, right, bottom = font.getbbox(inner_text)
+        return right - left, bottom - top
+
+    width, height = get_text_size(text)
+    if width <= max_width:
+        return text, height
+
+    processed = True
+    lines = []
+    line = ""
+    for word in text.split(" "):
+        before = line
+        line += f"{word} "
+        if get_text_size(line)[0] <= max_width:
+            continue
+        if line.strip() == word.strip():
+            processed = False
+            break
+        lines.append(before)
+        line = f"{word} "
+    lines.append(line)
+    if processed:
+        lines = [line.strip() for line in lines]
+        return "\n".join(lines).strip(), len(lines) * height
+
+    lines = []
+    line = ""
+    for char in text:
+        line += char
+        if get_text_size(line)[0] <= max_width:
+            continue
+        lines.append(line)
+        line = ""
+    lines.append(line)
+    return "\n".join(lines).strip(), len(lines) * height
+
+
+def text_width(text):
+    left, _, right, _ = ImageFont.truetype(font_path, fontsize).getbbox(text)
+    return right - left
+
+
+class TestWrapText(unittest.TestCase):
+    def assert_wraps_like_before(self, text, max_width):
+        self.assertEqual(
+            vd.wrap_text(text, max_width, font=font_path, fontsize=fontsize),
+            wrap_text_linear(text, max_width, font_path, fontsize),
+            f"{text!r} at {max_width}",
+        )
+
+    def test_words(self):
+        text = "the quick brown fox jumps over the lazy dog while the cat watches from the fence"
+        for max_width in (200, 350, 500, 800):
+            self.assert_wraps_like_before(text, max_width)
+
+    def test_cjk(self):
+        # no spaces, so the text is broken between characters
+        for text in ("人工智能正在改变我们的生活方式和工作方式", "今天 天气很好，我们一起去公园散步吧"):
+            for max_width in (150, 300, 600):
+                self.assert_wraps_like_before(text, max_width)
+
+    def test_long_words(self):
+        for text in (
+            "supercalifragilisticexpialidocious",
+            "short pneumonoultramicroscopicsilicovolcanoconiosis words",
+            "a b c antidisestablishmentarianism",
+        ):
+            for max_width in (120, 250, 400):
+                self.assert_wraps_like_before(text, max_width)
+
+    def test_exact_width(self):
+        words = "one two three four five six seven eight".split(" ")
+        for count in range(1, len(words) + 1):
+            max_width = text_width(" ".join(words[:count]))
+            # a line exactly as wide as the limit still fits, one pixel less does not
+            for width in (max_width - 1, max_width, max_width + 1):
+                self.assert_wraps_like_before(" ".join(words), width)
+
+        text = "exactly"
+        self.assertEqual(vd.wrap_text(text, text_width(text), font=font_path, fontsize=fontsize)[0], text)
+        self.assertEqual(
+            vd.wrap_text(text, text_width(text) - 1, font=font_path, fontsize=fontsize)[0].replace("\n", ""),
+            text,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,6 +24,7 @@ from app.models.schema import (
 )
 from app.services import llm, voice
 from app.services import task as tm
+from app.services.bgm_catalog import bgm_catalog
 from app.utils import utils
 
 st.set_page_config(
@@ -92,12 +93,7 @@ def get_all_fonts():
 
 
 def get_all_songs():
-    songs = []
-    for root, dirs, files in os.walk(song_dir):
-        for file in files:
-            if file.endswith(".mp3"):
-                songs.append(file)
-    return songs
+    return [song["name"] for song in bgm_catalog.songs()]
 
 
 def open_task_folder(task_id):
@@ -543,6 +539,7 @@ with middle_panel:
             (tr("FadeOut"), VideoTransitionMode.fade_out.value),
             (tr("SlideIn"), VideoTransitionMode.slide_in.value),
             (tr("SlideOut"), VideoTransitionMode.slide_out.value),
+            (tr("Crossfade"), VideoTransitionMode.crossfade.value),
         ]
         selected_index = st.selectbox(
             tr("Video Transition Mode"),